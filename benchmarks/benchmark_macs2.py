@@ -0,0 +1,215 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Benchmark the stages of the MACS2 peak calling on synthetic data.
+
+`Macs2.run` is run in local mode over a synthetic bam file with
+`macs2_profile` set, and the summary of each stage from the profile is
+written as JSON so that the results of different releases can be compared,
+for example::
+
+    python benchmarks/benchmark_macs2.py --contigs 24 --reads 200000 \\
+        --control --output new.json --compare old.json
+
+The macs2 command needs to be available on the PATH.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import pysam
+
+from synthetic_bam import generate_chip_bam
+
+
+# ------------------------------------------------------------------------------
+
+def _run_tool(args, work_dir, bam_file, control_file):
+    """
+    Run the whole of the Macs2 tool in local mode with the profile saved to
+    the work directory. The batch size is only used if a strategy is not
+    given.
+
+    Returns
+    -------
+    dict
+        The summary and the records of the profile of the run
+    """
+    sys._run_from_cmdl = True  # pylint: disable=protected-access
+    from basic_modules.metadata import Metadata
+    from mg_process_macs2.tool.macs2 import Macs2
+
+    input_files = {"bam": bam_file}
+    metadata = {"bam": Metadata("data_chip_seq", "bam", bam_file, [], {"assembly": "test"}, 9606)}
+    if control_file is not None:
+        input_files["bam_bg"] = control_file
+        metadata["bam_bg"] = Metadata(
+            "data_chip_seq", "bam", control_file, [], {"assembly": "test"}, 9606)
+
+    output_files = dict([
+        (output_type, os.path.join(work_dir, "tool_" + output_type + ".bed"))
+        for output_type in ["narrow_peak", "summits", "broad_peak", "gapped_peak"]
+    ])
+    profile_file = os.path.join(work_dir, "macs2_profile.json")
+    configuration = {
+        "execution": work_dir, "macs2_fragment_model": "task", "macs_nomodel_param": True,
+        "macs2_profile": profile_file
+    }
+    if args.strategy is None:
+        configuration["macs2_batch_size"] = args.batch_size
+    else:
+        configuration["macs2_strategy"] = args.strategy
+    if args.trace:
+        configuration["macs2_trace"] = args.trace
+
+    Macs2(configuration).run(input_files, metadata, output_files)
+
+    with open(profile_file, "r") as file_handle:
+        return json.load(file_handle)
+
+
+def run_benchmark(args, work_dir):
+    """
+    Generate the synthetic data and profile a run of the tool over it.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments
+    work_dir : str
+        Directory for the synthetic data and the intermediate files
+
+    Returns
+    -------
+    dict
+        The configuration of the benchmark, the wall time of the whole run
+        and the summary of each stage of the run from the StageProfiler
+    """
+    bam_file = os.path.join(work_dir, "treatment.bam")
+    generated = generate_chip_bam(
+        bam_file, args.contigs, args.contig_length, args.reads, args.paired, seed=args.seed)
+    control_file = None
+    if args.control:
+        control_file = os.path.join(work_dir, "control.bam")
+        generate_chip_bam(
+            control_file, args.contigs, args.contig_length, args.reads, args.paired,
+            peak_fraction=0.0, seed=args.seed + 1)
+
+    wall_start = time.time()
+    profile = _run_tool(args, work_dir, bam_file, control_file)
+    wall = time.time() - wall_start
+
+    return {
+        "benchmark": "mg_process_macs2",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "pysam": pysam.__version__,
+        "config": {
+            "contigs": args.contigs,
+            "contig_length": args.contig_length,
+            "reads_per_contig": args.reads,
+            "paired": args.paired,
+            "control": args.control,
+            "batch_size": args.batch_size,
+            "strategy": args.strategy,
+            "seed": args.seed,
+            "reads": generated["reads"]
+        },
+        "wall": wall,
+        "tasks": profile["summary"].get("callpeak", {}).get("count", 0),
+        "stages": profile["summary"]
+    }
+
+
+def compare_results(results, previous):
+    """
+    Print the change in the wall time of the whole run and of each stage
+    from a previous run.
+
+    Parameters
+    ----------
+    results : dict
+        Results of this run from `run_benchmark`
+    previous : dict
+        Results of the previous run
+    """
+    if results["config"] != previous["config"]:
+        print("Warning: the benchmarks were run with different configurations")
+
+    walls = [("total", results.get("wall"), previous.get("wall"))] + [
+        (stage, results["stages"][stage]["wall"],
+         previous["stages"][stage]["wall"] if stage in previous["stages"] else None)
+        for stage in sorted(results["stages"])
+    ]
+
+    print("{:<20}{:>12}{:>12}{:>10}".format("stage", "previous", "current", "ratio"))
+    for stage, current, before in walls:
+        if before is None:
+            print("{:<20}{:>12}{:>12.3f}{:>10}".format(stage, "-", current, "-"))
+            continue
+        print("{:<20}{:>12.3f}{:>12.3f}{:>10.2f}".format(
+            stage, before, current, current / before if before else float("inf")))
+
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    PARSER = argparse.ArgumentParser(
+        description="Benchmark the MACS2 peak calling on synthetic data")
+    PARSER.add_argument("--contigs", type=int, default=4, help="Number of contigs")
+    PARSER.add_argument("--contig_length", type=int, default=1000000, help="Length of each contig")
+    PARSER.add_argument("--reads", type=int, default=100000, help="Fragments on each contig")
+    PARSER.add_argument("--paired", action="store_true", help="Generate paired end reads")
+    PARSER.add_argument("--control", action="store_true", help="Generate a control bam file")
+    PARSER.add_argument("--batch_size", type=int, default=0, help="macs2_batch_size (reads)")
+    PARSER.add_argument("--seed", type=int, default=1, help="Random seed")
+    PARSER.add_argument(
+        "--strategy", help="macs2_strategy for the run, --batch_size is used if not set")
+    PARSER.add_argument("--trace", help="Also save the run as a Chrome trace file")
+    PARSER.add_argument(
+        "--work_dir", help="Directory for the data, a temporary directory by default")
+    PARSER.add_argument("--output", default="benchmark_macs2.json", help="JSON results file")
+    PARSER.add_argument("--compare", help="JSON results of a previous run to compare with")
+
+    ARGS = PARSER.parse_args()
+
+    # Run against the checkout that the script is in
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    WORK_DIR = ARGS.work_dir or tempfile.mkdtemp(prefix="macs2_benchmark_")
+    try:
+        RESULTS = run_benchmark(ARGS, WORK_DIR)
+    finally:
+        if ARGS.work_dir is None:
+            shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    with open(ARGS.output, "w") as OUTPUT_HANDLE:
+        json.dump(RESULTS, OUTPUT_HANDLE, indent=4, sort_keys=True)
+
+    if ARGS.compare:
+        with open(ARGS.compare, "r") as COMPARE_HANDLE:
+            compare_results(RESULTS, json.load(COMPARE_HANDLE))
+    else:
+        print(json.dumps(RESULTS["stages"], indent=4, sort_keys=True))
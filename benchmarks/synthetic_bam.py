@@ -0,0 +1,132 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Generate synthetic ChIP-seq like BAM files for the benchmarks.
+"""
+from __future__ import print_function
+
+import numpy as np
+import pysam
+
+
+# ------------------------------------------------------------------------------
+
+def generate_chip_bam(  # pylint: disable=too-many-arguments,too-many-locals
+        bam_file, contig_count=4, contig_length=1000000, reads_per_contig=100000,
+        paired=False, peaks_per_contig=50, peak_fraction=0.2, fragment_size=200,
+        read_length=50, seed=1):
+    """
+    Write a coordinate sorted BAM file of reads from fragments
+    that are enriched around a set of binding sites, as in a ChIP-seq
+    experiment. Setting `peak_fraction` to 0 generates a control with the
+    reads spread evenly over the contigs.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the output bam file
+    contig_count : int
+        Number of contigs, named chr1, chr2, ...
+    contig_length : int
+        Length of each contig
+    reads_per_contig : int
+        Number of fragments on each contig. Each fragment is a read, or a pair
+        of reads if `paired` is True
+    paired : bool
+        Generate paired end rather than single end reads
+    peaks_per_contig : int
+        Number of binding sites on each contig
+    peak_fraction : float
+        Fraction of the fragments that come from the binding sites
+    fragment_size : int
+        Mean fragment length
+    read_length : int
+        Length of each read
+    seed : int
+        Seed for the random number generator
+
+    Returns
+    -------
+    dict
+        The "contigs", with the "sites" on each of them, and the number of
+        "reads" written
+    """
+    rng = np.random.RandomState(seed)
+    contigs = ["chr" + str(index + 1) for index in range(contig_count)]
+    header = {
+        "HD": {"VN": "1.0", "SO": "coordinate"},
+        "SQ": [{"SN": contig, "LN": contig_length} for contig in contigs]
+    }
+
+    sequence = "A" * read_length
+    qualities = pysam.qualitystring_to_array("I" * read_length)
+
+    sites = {}
+    read_count = 0
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as bam_handle:
+        for contig_id, contig in enumerate(contigs):
+            contig_sites = np.sort(rng.randint(
+                fragment_size, contig_length - fragment_size, size=peaks_per_contig))
+            sites[contig] = contig_sites.tolist()
+
+            site_fragments = int(reads_per_contig * peak_fraction) if peaks_per_contig else 0
+            lengths = np.clip(
+                rng.normal(fragment_size, fragment_size / 10.0, reads_per_contig).astype(int),
+                read_length, 2 * fragment_size)
+            centres = np.concatenate([
+                rng.choice(contig_sites, site_fragments) + rng.randint(
+                    -fragment_size // 4, fragment_size // 4 + 1, site_fragments)
+                if site_fragments else np.zeros(0, dtype=int),
+                rng.randint(0, contig_length, reads_per_contig - site_fragments)
+            ])
+            starts = np.clip(centres - lengths // 2, 0, contig_length - lengths)
+            reverse = rng.randint(0, 2, reads_per_contig).astype(bool)
+
+            if paired:
+                positions = np.concatenate([starts, starts + lengths - read_length])
+                fragments = np.tile(np.arange(reads_per_contig), 2)
+                second_reads = np.repeat([False, True], reads_per_contig)
+            else:
+                # Reads on the reverse strand come from the end of the fragment
+                positions = np.where(reverse, starts + lengths - read_length, starts)
+                fragments = np.arange(reads_per_contig)
+                second_reads = np.zeros(reads_per_contig, dtype=bool)
+
+            for index in np.argsort(positions, kind="mergesort"):
+                fragment = fragments[index]
+                read = pysam.AlignedSegment()
+                read.query_name = "{}_{}".format(contig, fragment)
+                read.query_sequence = sequence
+                read.query_qualities = qualities
+                read.reference_id = contig_id
+                read.reference_start = int(positions[index])
+                read.mapping_quality = 60
+                read.cigartuples = [(0, read_length)]
+                if paired:
+                    first = not second_reads[index]
+                    mate_start = starts[fragment] + lengths[fragment] - read_length
+                    read.flag = 0x1 | 0x2 | (0x40 if first else 0x80) | (0x20 if first else 0x10)
+                    read.next_reference_id = contig_id
+                    read.next_reference_start = int(mate_start if first else starts[fragment])
+                    read.template_length = int(lengths[fragment]) * (1 if first else -1)
+                else:
+                    read.flag = 0x10 if reverse[fragment] else 0
+                bam_handle.write(read)
+                read_count += 1
+
+    return {"contigs": contigs, "sites": sites, "reads": read_count}
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,357 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+
+from mg_process_macs2.tool.peak_set import PEAK_SET_SUFFIX, PeakSet
+
+# Suffix added to the location of a peak file for its saved index
+PEAK_INDEX_SUFFIX = ".peakidx.npz"
+
+
+# ------------------------------------------------------------------------------
+
+class PeakIndex(object):
+    """
+    Sorted interval index over the peaks from a MACS2 output file.
+
+    The peaks on each contig are sorted by their start, along with the running
+    maximum of their ends. A region [start, end) then overlaps the peaks
+    between the first peak whose running maximum end is after the start of
+    the region and the last peak that starts before the end of the region, so
+    both bounds are found by binary search. The queries take arrays of
+    regions and are answered with NumPy for all of the regions on a contig
+    at once.
+
+    The results refer to the peaks by their position in the `PeakSet` that
+    the index was built from.
+
+    The peaks on each contig are held in start order as their `starts`,
+    `ends`, running maximum ends (`max_ends`) and position in the `PeakSet`
+    (`order`). `contig_ranges` gives the first and last positions of the
+    peaks for each contig. `end_order` sorts the peaks on each contig by their
+    end and `sorted_ends` holds the ends in that order, for finding the peaks
+    upstream of a region.
+    """
+
+    def __init__(self, peak_set):
+        """
+        Init function
+
+        Parameters
+        ----------
+        peak_set : PeakSet
+            Peaks to index
+        """
+        peaks = peak_set.peaks
+
+        self.order = np.lexsort((peaks["start"], peaks["contig"])).astype(np.int64)
+        self.starts = np.asarray(peaks["start"][self.order], dtype=np.int64)
+        self.ends = np.asarray(peaks["end"][self.order], dtype=np.int64)
+        self.max_ends = np.empty_like(self.ends)
+        self.end_order = np.empty_like(self.ends)
+
+        contig_codes = np.asarray(peaks["contig"][self.order])
+        offsets = np.searchsorted(
+            contig_codes, np.arange(len(peak_set.contigs) + 1), side="left").astype(np.int64)
+        self.contig_ranges = self._contig_ranges(peak_set.contigs, offsets)
+        for first, last in self.contig_ranges.values():
+            self.max_ends[first:last] = np.maximum.accumulate(self.ends[first:last])
+            self.end_order[first:last] = first + np.argsort(
+                self.ends[first:last], kind="mergesort")
+        self.sorted_ends = self.ends[self.end_order]
+
+    @classmethod
+    def from_peak_file(cls, peak_file, peak_format):
+        """
+        Build the index for a MACS2 output file. The binary sidecar file
+        written by `write_peak_set` is used if it exists, otherwise the file
+        is parsed.
+
+        Parameters
+        ----------
+        peak_file : str
+            Location of the MACS2 output file
+        peak_format : str
+            One of "narrow_peak", "broad_peak", "gapped_peak" or "summits"
+
+        Returns
+        -------
+        PeakIndex
+        """
+        if os.path.isfile(peak_file + PEAK_SET_SUFFIX):
+            return cls(PeakSet.load(peak_file + PEAK_SET_SUFFIX))
+
+        return cls(PeakSet.from_bed(peak_file, peak_format))
+
+    def save(self, index_file):
+        """
+        Save the index so that it can be loaded without sorting the peaks.
+
+        Parameters
+        ----------
+        index_file : str
+            Location of the index file. The name needs to end in ".npz"
+        """
+        tmp_file = index_file[:-len(".npz")] + ".tmp.npz"
+        np.savez(
+            tmp_file,
+            contig_ranges=np.array(json.dumps(self.contig_ranges)),
+            order=self.order, starts=self.starts, ends=self.ends,
+            max_ends=self.max_ends, end_order=self.end_order)
+        os.rename(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file):
+        """
+        Load an index saved by `save`.
+
+        Parameters
+        ----------
+        index_file : str
+            Location of the index file
+
+        Returns
+        -------
+        PeakIndex
+        """
+        peak_index = cls.__new__(cls)
+        with np.load(index_file) as index_data:
+            peak_index.contig_ranges = dict([
+                (contig, tuple(contig_range))
+                for contig, contig_range in json.loads(str(index_data["contig_ranges"])).items()
+            ])
+            for array in ["order", "starts", "ends", "max_ends", "end_order"]:
+                setattr(peak_index, array, index_data[array])
+        peak_index.sorted_ends = peak_index.ends[peak_index.end_order]
+
+        return peak_index
+
+    @staticmethod
+    def _contig_ranges(contigs, offsets):
+        """
+        Get the first and last positions of the peaks on each contig in the
+        sorted arrays from the offset of the first peak of each contig.
+        """
+        return dict([
+            (str(contig), (int(offsets[code]), int(offsets[code + 1])))
+            for code, contig in enumerate(contigs)
+        ])
+
+    def _contig_regions(self, contigs):
+        """
+        Group the regions by contig.
+
+        Returns
+        -------
+        list
+            List of tuples of the form (first, last, regions) where first and
+            last bound the peaks on the contig in the sorted arrays and
+            regions are the positions of the regions on the contig
+        """
+        contigs = np.asarray(contigs)
+        groups = []
+        for contig in np.unique(contigs):
+            regions = np.nonzero(contigs == contig)[0]
+            first, last = self.contig_ranges.get(str(contig), (0, 0))
+            groups.append((first, last, regions))
+
+        return groups
+
+    def count(self, contigs, starts, ends):
+        """
+        Count the peaks that overlap each of a set of regions.
+
+        Parameters
+        ----------
+        contigs : list
+            Contig of each region
+        starts : list
+            Start of each region (0 based)
+        ends : list
+            End of each region (exclusive)
+
+        Returns
+        -------
+        numpy.ndarray
+            Number of peaks that overlap each region
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        counts = np.zeros(len(starts), dtype=np.int64)
+        for first, last, regions in self._contig_regions(contigs):
+            # Every peak that ends before the region also starts before it
+            starting = np.searchsorted(self.starts[first:last], ends[regions], side="left")
+            ended = np.searchsorted(self.sorted_ends[first:last], starts[regions], side="right")
+            counts[regions] = np.maximum(starting - ended, 0)
+
+        return counts
+
+    def overlap(self, contigs, starts, ends):
+        """
+        Find the peaks that overlap each of a set of regions.
+
+        Parameters
+        ----------
+        contigs : list
+            Contig of each region
+        starts : list
+            Start of each region (0 based)
+        ends : list
+            End of each region (exclusive)
+
+        Returns
+        -------
+        offsets : numpy.ndarray
+            The peaks for region i are peaks[offsets[i]:offsets[i + 1]]
+        peaks : numpy.ndarray
+            Positions of the overlapping peaks in the peak set, in order of
+            their start within each region
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        region_hits = []
+        peak_hits = []
+        for first, last, regions in self._contig_regions(contigs):
+            lower = first + np.searchsorted(
+                self.max_ends[first:last], starts[regions], side="right")
+            upper = first + np.searchsorted(self.starts[first:last], ends[regions], side="left")
+            counts = np.maximum(upper - lower, 0)
+            if counts.sum() == 0:
+                continue
+
+            # Expand each region into the candidate peaks between its bounds
+            candidate_regions = np.repeat(regions, counts)
+            candidates = np.arange(counts.sum()) + np.repeat(
+                lower - np.cumsum(counts) + counts, counts)
+            overlapping = self.ends[candidates] > starts[candidate_regions]
+            region_hits.append(candidate_regions[overlapping])
+            peak_hits.append(candidates[overlapping])
+
+        if not region_hits:
+            return np.zeros(len(starts) + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        region_hits = np.concatenate(region_hits)
+        peak_hits = np.concatenate(peak_hits)
+        by_region = np.argsort(region_hits, kind="mergesort")
+
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(region_hits, minlength=len(starts)))
+
+        return offsets, self.order[peak_hits[by_region]]
+
+    def nearest(self, contigs, starts, ends):
+        """
+        Find the nearest peak to each of a set of regions. A peak that
+        overlaps the region is at a distance of 0, otherwise the distance is
+        the number of bases from the end of one to the start of the other plus
+        one, so a peak next to the region is at a distance of 1.
+
+        Parameters
+        ----------
+        contigs : list
+            Contig of each region
+        starts : list
+            Start of each region (0 based)
+        ends : list
+            End of each region (exclusive)
+
+        Returns
+        -------
+        peaks : numpy.ndarray
+            Position of the nearest peak in the peak set, -1 if there are no
+            peaks on the contig
+        distances : numpy.ndarray
+            Distance to the nearest peak, -1 if there are no peaks on the
+            contig
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        nearest_peaks = np.full(len(starts), -1, dtype=np.int64)
+        distances = np.full(len(starts), -1, dtype=np.int64)
+        no_peak = np.iinfo(np.int64).max
+        for first, last, regions in self._contig_regions(contigs):
+            if first == last:
+                continue
+            region_starts, region_ends = starts[regions], ends[regions]
+
+            # The running maximum of the ends only increases at a peak that
+            # ends there, so the peak at the lower bound of the overlapping
+            # peaks ends after the start of the region
+            lower = np.minimum(
+                first + np.searchsorted(
+                    self.max_ends[first:last], region_starts, side="right"), last - 1)
+            overlaps = (self.starts[lower] < region_ends) & (self.ends[lower] > region_starts)
+
+            # Closest peak that ends at or before the start of the region
+            upstream = first + np.searchsorted(
+                self.sorted_ends[first:last], region_starts, side="right") - 1
+            has_upstream = upstream >= first
+            upstream = np.maximum(upstream, first)
+            upstream_distance = np.where(
+                has_upstream, region_starts - self.sorted_ends[upstream] + 1, no_peak)
+
+            # Closest peak that starts at or after the end of the region
+            downstream = first + np.searchsorted(
+                self.starts[first:last], region_ends, side="left")
+            has_downstream = downstream < last
+            downstream = np.minimum(downstream, last - 1)
+            downstream_distance = np.where(
+                has_downstream, self.starts[downstream] - region_ends + 1, no_peak)
+
+            use_upstream = upstream_distance <= downstream_distance
+            region_peaks = np.where(use_upstream, self.end_order[upstream], downstream)
+            region_distances = np.where(use_upstream, upstream_distance, downstream_distance)
+
+            region_peaks = np.where(overlaps, lower, region_peaks)
+            region_distances = np.where(overlaps, 0, region_distances)
+
+            nearest_peaks[regions] = self.order[region_peaks]
+            distances[regions] = region_distances
+
+        return nearest_peaks, distances
+
+
+def write_peak_index(peak_file, peak_format):
+    """
+    Build the index for a MACS2 output file and save it next to the file.
+
+    Parameters
+    ----------
+    peak_file : str
+        Location of the MACS2 output file
+    peak_format : str
+        One of "narrow_peak", "broad_peak", "gapped_peak" or "summits"
+
+    Returns
+    -------
+    str
+        Location of the index file
+    """
+    index_file = peak_file + PEAK_INDEX_SUFFIX
+    PeakIndex.from_peak_file(peak_file, peak_format).save(index_file)
+
+    return index_file
+
+# ------------------------------------------------------------------------------
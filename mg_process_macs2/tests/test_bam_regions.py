@@ -0,0 +1,190 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import pytest
+import pysam
+
+from mg_process_macs2.tool.bam_regions import (
+    build_bam_profile, profile_mapped_reads, bam_split_batches, bam_split_contigs, output_threads)
+
+
+@pytest.mark.chipseq
+def test_bam_profile():
+    """
+    Test that the profile of the bam file is generated from the index
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+    bai_file = bam_file + ".profile_test.bai"
+    pysam.index(bam_file, bai_file)
+
+    bam_profile = build_bam_profile(bam_file, bai_file)
+
+    assert bam_profile["paired"] is False
+    assert bam_profile["contigs"] == [("chr22", 2100, 500, 0)]
+    assert bam_profile["header"]["SQ"][0]["SN"] == "chr22"
+    assert profile_mapped_reads(bam_profile, ["chr22"]) == 500
+    assert profile_mapped_reads(bam_profile, ["chr1"]) == 0
+    assert profile_mapped_reads(bam_profile, [None]) == 500
+
+    os.remove(bai_file)
+
+
+@pytest.mark.chipseq
+def test_bam_split_contigs():
+    """
+    Test that the reads for a set of contigs are extracted
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+    bai_file = bam_file + ".split_test.bai"
+    bam_out = resource_path + "macs2.Human.DRR000150.22_aln_filtered.split_test.bam"
+    pysam.index(bam_file, bai_file)
+
+    assert bam_split_contigs(bam_file, bai_file, ["chr22"], bam_out) == 500
+    assert os.path.getsize(bam_out) > 0
+
+    os.remove(bam_out)
+    os.remove(bai_file)
+
+
+@pytest.mark.chipseq
+def test_bam_split_batches():
+    """
+    Test that a single pass split matches extracting each batch from the
+    indexed file, including reads that overlap two tiles
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+    bai_file = bam_file + ".split_batches_test.bai"
+    pysam.index(bam_file, bai_file)
+
+    batches = [
+        ["chr22"],
+        [("chr22", 0, 1200, 0, 1000)],
+        [("chr22", 800, 2100, 1000, 2100)]
+    ]
+    bam_files_out = [
+        resource_path + "split_batches_test." + str(index) + ".bam"
+        for index in range(len(batches))
+    ]
+
+    counts = bam_split_batches(bam_file, batches, bam_files_out, threads=2)
+
+    for batch, bam_file_out, count in zip(batches, bam_files_out, counts):
+        assert count == bam_split_contigs(bam_file, bai_file, batch, bam_file_out)
+        os.remove(bam_file_out)
+    assert counts[0] == 500
+    assert counts[1] + counts[2] > 500
+
+    os.remove(bai_file)
+
+
+class _TrackedAlignmentFile(object):
+    """
+    Wrapper of pysam.AlignmentFile that records the largest number of output
+    files that are open at once
+    """
+    alignment_file = pysam.AlignmentFile
+    open_outputs = 0
+    max_open_outputs = 0
+
+    def __init__(self, file_name, mode, **kwargs):
+        if isinstance(kwargs.get("template"), _TrackedAlignmentFile):
+            kwargs["template"] = kwargs["template"].handle
+        self.handle = self.alignment_file(file_name, mode, **kwargs)
+        self.output = mode == "wb"
+        if self.output:
+            _TrackedAlignmentFile.open_outputs += 1
+            _TrackedAlignmentFile.max_open_outputs = max(
+                _TrackedAlignmentFile.max_open_outputs, _TrackedAlignmentFile.open_outputs)
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def close(self):
+        """
+        Close the file
+        """
+        if self.output:
+            _TrackedAlignmentFile.open_outputs -= 1
+        self.handle.close()
+
+
+@pytest.mark.chipseq
+def test_bam_split_batches_max_open(monkeypatch):
+    """
+    Test that the split keeps no more than the maximum number of output files
+    open, including batches that cover the same contigs, and writes empty bam
+    files for the batches without reads
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+    contig_bam_file = resource_path + "split_max_open_test.bam"
+
+    # Copy the reads to the first, second and fourth of five contigs
+    contigs = ["chrA", "chrB", "chrC", "chrD", "chrE"]
+    bam_handle = pysam.AlignmentFile(bam_file, "rb")
+    reads = list(bam_handle.fetch(until_eof=True))
+    bam_out_handle = pysam.AlignmentFile(
+        contig_bam_file, "wb", reference_names=contigs, reference_lengths=[2100] * 5)
+    for reference_id in [0, 1, 3]:
+        for read in reads:
+            read_out = pysam.AlignedSegment.from_dict(read.to_dict(), bam_out_handle.header)
+            read_out.reference_id = reference_id
+            bam_out_handle.write(read_out)
+    bam_out_handle.close()
+    bam_handle.close()
+
+    batches = [
+        ["chrA"], ["chrB"], ["chrC"], ["chrD"], ["chrE"], ["chrA", "chrD"],
+        [("chrB", 0, 1200, 0, 1000)], ["chrX"]
+    ]
+    bam_files_out = [
+        resource_path + "split_max_open_test." + str(index) + ".bam"
+        for index in range(len(batches))
+    ]
+
+    _TrackedAlignmentFile.max_open_outputs = 0
+    monkeypatch.setattr(pysam, "AlignmentFile", _TrackedAlignmentFile)
+    counts = bam_split_batches(contig_bam_file, batches, bam_files_out, max_open=1)
+    monkeypatch.undo()
+
+    assert _TrackedAlignmentFile.max_open_outputs == 1
+    assert counts[:6] == [500, 500, 0, 500, 0, 1000]
+    assert 0 < counts[6] < 500
+    assert counts[7] == 0
+    for bam_file_out, count in zip(bam_files_out, counts):
+        bam_handle = pysam.AlignmentFile(bam_file_out, "rb")
+        assert len(list(bam_handle.fetch(until_eof=True))) == count
+        bam_handle.close()
+        os.remove(bam_file_out)
+
+    os.remove(contig_bam_file)
+
+
+@pytest.mark.chipseq
+def test_output_threads():
+    """
+    Test that the compression threads go to the largest outputs
+    """
+    assert output_threads(8, [1000, 100, 100]) == [6, 1, 1]
+    assert output_threads(4, [0, 0]) == [2, 2]
+    assert output_threads(2, [10, 10, 10, 10]) == [1, 1, 1, 1]
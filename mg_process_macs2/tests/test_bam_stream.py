@@ -0,0 +1,88 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import shutil
+import tempfile
+import pytest
+import pysam
+
+from mg_process_macs2.tool.bam_stream import BamFifo, bam_read_length
+from mg_process_macs2.tool.supervisor import ProcessSupervisor
+
+
+def _callpeak(treatment_file, control_file, tsize, output_dir):
+    """
+    Run MACS2 and get the read counts it reported and the peaks it called
+    """
+    supervisor = ProcessSupervisor()
+    assert supervisor.run([
+        "macs2", "callpeak", "--format", "BAM", "--nomodel", "--extsize", "100",
+        "--tsize", str(tsize), "-p", "0.5", "-t", treatment_file, "-c", control_file,
+        "-n", "bam_stream_test", "--outdir", output_dir
+    ]) is True, supervisor.error_report()
+
+    counts = {}
+    for event in supervisor.progress:
+        for sample in ("treatment", "control"):
+            if sample in event:
+                counts[sample] = event[sample]
+
+    with open(os.path.join(output_dir, "bam_stream_test_peaks.narrowPeak"), "r") as peak_handle:
+        peaks = peak_handle.read()
+
+    return counts, peaks
+
+
+@pytest.mark.chipseq
+def test_bam_fifo():
+    """
+    Test that MACS2 reads all of the reads streamed through the pipes and
+    calls the same peaks as it does from the bam file
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+    bai_file = bam_file + ".fifo_test.bai"
+    pysam.index(bam_file, bai_file)
+    tsize = bam_read_length(bam_file, bai_file, ["chr22"])
+
+    bam_dir = tempfile.mkdtemp()
+    bam_counts, bam_peaks = _callpeak(bam_file, bam_file, tsize, bam_dir)
+
+    fifo_dir = tempfile.mkdtemp()
+    fifo_streams = [
+        BamFifo(os.path.join(fifo_dir, sample + ".bam"), bam_file, bai_file, ["chr22"])
+        for sample in ("treatment", "control")
+    ]
+    for fifo_stream in fifo_streams:
+        fifo_stream.start()
+    fifo_counts, fifo_peaks = _callpeak(
+        fifo_streams[0].fifo_file, fifo_streams[1].fifo_file, tsize, fifo_dir)
+    for fifo_stream in fifo_streams:
+        fifo_stream.stop()
+        assert fifo_stream.error is None
+
+    assert bam_counts == {"treatment": 500, "control": 500}
+    assert fifo_counts == bam_counts
+    assert fifo_peaks == bam_peaks
+    assert len(bam_peaks) > 0
+
+    shutil.rmtree(bam_dir)
+    shutil.rmtree(fifo_dir)
+    os.remove(bai_file)
@@ -0,0 +1,87 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import pytest
+
+from mg_process_macs2.tool.cutoff_sweep import (
+    build_sweep, read_macs2_xls_sizes, run_cutoff_sweep, sweep_file_name)
+
+
+@pytest.mark.chipseq
+def test_build_sweep():
+    """
+    Test the generation of the sweep settings from the MACS2 parameters
+    """
+    sweep = build_sweep("qvalue", "0.01, 0.05,0.1", ["--nomodel"])
+    assert sweep["cutoffs"] == [("q0.01", 0.01), ("q0.05", 0.05), ("q0.1", 0.1)]
+    assert sweep["score"] == "q"
+    assert sweep["broad"] is False
+
+    sweep = build_sweep(
+        "broad-cutoff", [0.1, 0.2], ["--broad", "--pvalue", "0.001"])
+    assert sweep["cutoffs"] == [("bc0.1", 0.1), ("bc0.2", 0.2)]
+    assert sweep["score"] == "p"
+    assert sweep["peak_cutoff"] == 0.001
+
+    with pytest.raises(ValueError):
+        build_sweep("broad-cutoff", [0.1], ["--nomodel"])
+
+    assert sweep_file_name("/tmp/test_peaks.narrowPeak", "q0.01") == \
+        "/tmp/test_peaks.q0.01.narrowPeak"
+
+
+@pytest.mark.chipseq
+def test_read_macs2_xls_sizes():
+    """
+    Test that the fragment and tag sizes are read from the MACS2 xls header
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    xls_file = resource_path + "sweep_test_peaks.xls"
+    with open(xls_file, "w") as file_handle:
+        file_handle.write("# This file is generated by MACS version 2.1.4\n")
+        file_handle.write("# tag size is determined as 36 bps\n")
+        file_handle.write("# total tags in treatment: 500\n")
+        file_handle.write("# d = 147\n")
+        file_handle.write("chr\tstart\tend\n")
+
+    assert read_macs2_xls_sizes(xls_file) == (147, 36)
+
+    os.remove(xls_file)
+
+
+@pytest.mark.chipseq
+def test_run_cutoff_sweep_failure():
+    """
+    Test that a failed MACS2 command is reported with the end of its log
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    output_prefix = resource_path + "sweep_failure_test"
+    with open(output_prefix + "_peaks.xls", "w") as file_handle:
+        file_handle.write("# d = 147\n")
+
+    sweep = build_sweep("qvalue", "0.01", ["--nomodel"])
+    with pytest.raises(OSError) as error:
+        run_cutoff_sweep(
+            output_prefix, sweep, {"q0.01": output_prefix + "_peaks.q0.01.narrowPeak"},
+            {"time": 60})
+    assert "macs2 bdgcmp failed" in str(error.value)
+    assert "lines of stderr" in str(error.value)
+
+    os.remove(output_prefix + "_peaks.xls")
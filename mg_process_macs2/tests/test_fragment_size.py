@@ -0,0 +1,68 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import random
+import pysam
+import pytest
+
+from mg_process_macs2.tool.fragment_size import cross_correlation_fragment_size
+
+
+@pytest.mark.chipseq
+def test_cross_correlation_fragment_size():
+    """
+    Test the cross correlation estimate on reads simulated from fragments of
+    180bp around a set of binding sites
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "fragment_size_test.bam"
+
+    random.seed(1)
+    reads = []
+    for i in range(20000):
+        if i % 2:
+            start = random.randint(0, 400) * 490 + random.randint(-60, 60) + 210
+        else:
+            start = random.randint(0, 199000)
+        fragment_size = int(random.gauss(180, 15))
+        reverse = random.random() < 0.5
+        reads.append((start + fragment_size - 36 if reverse else start, reverse))
+    reads.sort()
+
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"}, "SQ": [{"SN": "chrA", "LN": 200000}]}
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as bam_handle:
+        for index, (position, reverse) in enumerate(reads):
+            read = pysam.AlignedSegment()
+            read.query_name = "read" + str(index)
+            read.query_sequence = "A" * 36
+            read.flag = 16 if reverse else 0
+            read.reference_id = 0
+            read.reference_start = position
+            read.mapping_quality = 30
+            read.cigar = [(0, 36)]
+            bam_handle.write(read)
+    pysam.index(bam_file)
+
+    fragment_size = cross_correlation_fragment_size(
+        bam_file, bam_file + ".bai", [("chrA", 200000, 20000)])
+    assert 170 <= fragment_size <= 190
+
+    os.remove(bam_file)
+    os.remove(bam_file + ".bai")
@@ -0,0 +1,90 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+import signal
+import pytest
+
+from mg_process_macs2.tool.local_executor import LocalExecutor
+
+
+def _square(value):
+    """
+    Job that completes
+    """
+    return value * value
+
+
+def _fail(value):
+    """
+    Job that raises an exception for one of the values
+    """
+    if value == 2:
+        raise ValueError("bad value")
+    return value
+
+
+def _kill(value):
+    """
+    Job that kills the worker process that runs it for one of the values
+    """
+    if value == 2:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return value
+
+
+@pytest.mark.chipseq
+def test_local_executor():
+    """
+    Test that the jobs are run and the results passed back to the master
+    """
+    completed = []
+    results, error = LocalExecutor(2, 100).run(
+        _square, [((value,), 60) for value in range(5)],
+        lambda index, result: completed.append(index))
+
+    assert error is None
+    assert results == [0, 1, 4, 9, 16]
+    assert sorted(completed) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.chipseq
+def test_local_executor_failure():
+    """
+    Test that a job that raises an exception and a worker process that dies
+    stop the run rather than leaving it waiting for the job
+    """
+    failed = []
+    results, error = LocalExecutor(1).run(
+        _fail, [((value,), 0) for value in range(5)],
+        on_error=lambda index, message: failed.append(index))
+
+    assert "ValueError" in error
+    assert failed == [2]
+    assert results[:2] == [0, 1]
+    assert results[2:] == [None, None, None]
+
+    failed = []
+    results, error = LocalExecutor(2).run(
+        _kill, [((value,), 0) for value in range(5)],
+        on_error=lambda index, message: failed.append(index))
+
+    assert "exited with code" in error
+    assert 2 in failed
+    assert results[2] is None
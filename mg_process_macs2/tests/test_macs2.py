@@ -18,10 +18,17 @@
 from __future__ import print_function
 
 import os.path
+import shutil
+import sys
 import pytest
+import pysam
 
 from basic_modules.metadata import Metadata
+from mg_process_macs2.tool import macs2, treatment_run
 from mg_process_macs2.tool.macs2 import Macs2
+from mg_process_macs2.tool.macs2_tasks import Macs2Tasks
+from mg_process_macs2.tool.peak_set import PeakSet
+from mg_process_macs2.tool.treatment_run import TreatmentRun
 
 
 @pytest.mark.chipseq
@@ -57,15 +64,437 @@ def test_macs2():
     assert os.path.isfile(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed") is True
     assert os.path.getsize(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed") > 0
 
+    # The intermediate files are removed by the tool
+    assert os.path.isfile(
+        resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22.bam") is False
+    assert os.path.isfile(
+        resource_path + "macs2.Human.DRR000150.22_peaks.narrowPeak.chr22") is False
+
     os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.narrowPeak")
     os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22.bam")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22_peaks.narrowPeak")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22_peaks.xls")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22_summits.bed")
     os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam.bai")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam_tmp.bai")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.broadPeak.chr22")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.gappedPeak.chr22")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.narrowPeak.chr22")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed.chr22")
+
+
+def _write_control_bam(bam_file, control_file):
+    """
+    Write a background bam file with the reads from a bam file spread evenly
+    over the chromosome
+    """
+    bam_handle = pysam.AlignmentFile(bam_file, "rb")
+    control_handle = pysam.AlignmentFile(control_file, "wb", template=bam_handle)
+    for index, read in enumerate(bam_handle.fetch(until_eof=True)):
+        read.reference_start = index * 4
+        control_handle.write(read)
+    control_handle.close()
+    bam_handle.close()
+
+
+@pytest.mark.chipseq
+def test_macs2_batch_shared_control():
+    """
+    Test the peak calling for two treatment bam files that share a background
+    bam file, which is split by chromosome once for both of them
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+
+    treatments = [
+        resource_path + "macs2.batch_test_" + str(index) + ".bam" for index in range(2)]
+    for treatment in treatments:
+        shutil.copy(bam_file, treatment)
+    control = resource_path + "macs2.batch_test_control.bam"
+    _write_control_bam(bam_file, control)
+
+    input_files = {
+        "bam": treatments,
+        "bam_bg": control
+    }
+
+    metadata = {
+        "bam": [
+            Metadata(
+                "data_chipseq", "bam", treatment, None,
+                {'assembly': 'test'})
+            for treatment in treatments
+        ],
+        "bam_bg": Metadata(
+            "data_chipseq", "bam", control, None,
+            {'assembly': 'test'}),
+    }
+
+    macs_handle = Macs2({"macs_nomodel_param": True, "execution": resource_path})
+    output_files, output_metadata = macs_handle.run_batch(input_files, metadata, {})
+
+    assert output_files["narrow_peak"] == [
+        resource_path + "macs2.batch_test_" + str(index) + "_narrow_peak.bed"
+        for index in range(2)]
+    for index, narrow_peak in enumerate(output_files["narrow_peak"]):
+        assert os.path.getsize(narrow_peak) > 0
+        assert output_metadata["narrow_peak"][index].sources == [treatments[index], control]
+
+    # The background is split once and the split files are removed
+    assert os.path.isfile(resource_path + "macs2.batch_test_control.chr22.control.bam") is False
+
+    # Every list has an entry for each treatment
+    for output_type in output_files:
+        assert len(output_files[output_type]) == len(treatments)
+        assert len(output_metadata[output_type]) == len(treatments)
+
+    for output_type in output_files:
+        for output_file in output_files[output_type]:
+            if output_file is not None:
+                os.remove(output_file)
+    for bam_file_in in treatments + [control]:
+        os.remove(bam_file_in)
+        os.remove(bam_file_in + ".bai")
+
+
+@pytest.mark.chipseq
+def test_macs2_batch_missing_output(monkeypatch):
+    """
+    Test that the lists of outputs from a batch stay matched to the
+    treatments when a treatment does not generate one of the outputs
+    """
+    def _run(self, input_metadata, output_files, command_params):  # pylint: disable=unused-argument
+        """
+        Only the first treatment generates broad peaks
+        """
+        bam_file = self.input_files["bam"]
+        result_files = {"narrow_peak": bam_file + ".narrowPeak"}
+        if bam_file.endswith("0.bam"):
+            result_files["broad_peak"] = bam_file + ".broadPeak"
+        return (result_files, dict([
+            (output_type, input_metadata["bam"]) for output_type in result_files]))
+
+    monkeypatch.setattr(TreatmentRun, "run", _run)
+
+    treatments = ["treatment_0.bam", "treatment_1.bam"]
+    metadata = {
+        "bam": [
+            Metadata("data_chipseq", "bam", treatment, None, {'assembly': 'test'})
+            for treatment in treatments
+        ]
+    }
+
+    output_files, output_metadata = Macs2({}).run_batch({"bam": treatments}, metadata, {})
+
+    assert output_files == {
+        "broad_peak": ["treatment_0.bam.broadPeak", None],
+        "narrow_peak": ["treatment_0.bam.narrowPeak", "treatment_1.bam.narrowPeak"]
+    }
+    assert output_metadata["broad_peak"] == [metadata["bam"][0], None]
+
+
+@pytest.mark.chipseq
+@pytest.mark.parametrize("background", [True, False])
+def test_macs2_distributed(background):
+    """
+    Test the distributed input mode, where the master splits the bam files
+    and each task is only given the slices for its batch. The chromosome is
+    tiled so that the results of several tasks are merged on the workers
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.distributed_test.bam"
+    shutil.copy(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam", bam_file)
+
+    input_files = {"bam": bam_file}
+    metadata = {
+        "bam": Metadata(
+            "data_chipseq", "bam", bam_file, None,
+            {'assembly': 'test'}),
+    }
+    if background:
+        input_files["bam_bg"] = resource_path + "macs2.distributed_test_control.bam"
+        _write_control_bam(bam_file, input_files["bam_bg"])
+        metadata["bam_bg"] = Metadata(
+            "data_chipseq", "bam", input_files["bam_bg"], None,
+            {'assembly': 'test'})
+
+    output_files = {
+        "narrow_peak": resource_path + "macs2.distributed_test_peaks.narrowPeak",
+        "summits": resource_path + "macs2.distributed_test_peaks.summits.bed",
+        "broad_peak": resource_path + "macs2.distributed_test_peaks.broadPeak",
+        "gapped_peak": resource_path + "macs2.distributed_test_peaks.gappedPeak"
+    }
+
+    # The tiles are too short for a local background so the peaks are
+    # called against the background for the whole of the control
+    macs_handle = Macs2({
+        "macs_nomodel_param": True,
+        "macs_nolambda_param": True,
+        "macs2_input_mode": "distributed",
+        "macs2_tile_reads": 200,
+        "macs2_tile_overlap": 100
+    })
+    output_files_created, output_metadata = macs_handle.run(input_files, metadata, output_files)
+
+    assert output_metadata["narrow_peak"].meta_data["strategy"]["tasks"] > 1
+    assert os.path.getsize(output_files_created["narrow_peak"]) > 0
+    assert os.path.getsize(output_files_created["summits"]) > 0
+
+    # The peaks from the tiles are in order and the slices have been removed
+    with open(output_files_created["narrow_peak"], "r") as file_handle:
+        starts = [int(line.split("\t")[1]) for line in file_handle]
+    assert starts == sorted(starts)
+    slices = [
+        file_name for file_name in os.listdir(resource_path)
+        if file_name.startswith("macs2.distributed_test") and file_name.endswith(".bam")
+    ]
+    assert sorted(slices) == sorted([
+        os.path.basename(input_file) for input_file in input_files.values()])
+
+    for output_file in output_files_created.values():
+        os.remove(output_file)
+    for input_file in input_files.values():
+        os.remove(input_file)
+        os.remove(input_file + ".bai")
+
+
+@pytest.mark.chipseq
+def test_macs2_merge_on_workers(monkeypatch):
+    """
+    Test that the results of the COMPSs tasks are merged on the workers, so
+    that the master only opens the file at the root of each merge tree and
+    none of the files for the batches
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.merge_test.bam"
+    shutil.copy(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam", bam_file)
+
+    input_files = {"bam": bam_file}
+    metadata = {
+        "bam": Metadata(
+            "data_chipseq", "bam", bam_file, None,
+            {'assembly': 'test'}),
+    }
+    output_files = {
+        "narrow_peak": resource_path + "macs2.merge_test_peaks.narrowPeak",
+        "summits": resource_path + "macs2.merge_test_peaks.summits.bed",
+        "broad_peak": resource_path + "macs2.merge_test_peaks.broadPeak",
+        "gapped_peak": resource_path + "macs2.merge_test_peaks.gappedPeak"
+    }
+
+    opened_files = []
+    compss_open = treatment_run.compss_open
+
+    def _compss_open(file_name, *args):
+        """
+        Record the files that the master opens
+        """
+        opened_files.append(file_name)
+        return compss_open(file_name, *args)
+
+    monkeypatch.setattr(treatment_run, "compss_open", _compss_open)
+    monkeypatch.delattr(sys, "_run_from_cmdl")
+
+    macs_handle = Macs2({
+        "macs_nomodel_param": True,
+        "macs_nolambda_param": True,
+        "macs2_tile_reads": 200,
+        "macs2_tile_overlap": 100
+    })
+    output_files_created, output_metadata = macs_handle.run(input_files, metadata, output_files)
+
+    assert output_metadata["narrow_peak"].meta_data["strategy"]["tasks"] > 1
+    assert os.path.getsize(output_files_created["narrow_peak"]) > 0
+
+    # Only the root of each of the merge trees reaches the master
+    assert len(opened_files) == len(treatment_run.PEAK_OUTPUTS)
+    for output_type in treatment_run.PEAK_OUTPUTS:
+        assert len([
+            opened_file for opened_file in opened_files
+            if opened_file.startswith(output_files[output_type] + ".merge")
+        ]) == 1
+
+    leftover = [
+        file_name for file_name in os.listdir(resource_path)
+        if file_name.startswith("macs2.merge_test")
+    ]
+    assert sorted(leftover) == sorted([
+        "macs2.merge_test.bam", "macs2.merge_test.bam.bai"] + [
+            os.path.basename(output_file) for output_file in output_files_created.values()])
+
+    for output_file in output_files_created.values():
+        os.remove(output_file)
+    os.remove(bam_file)
+    os.remove(bam_file + ".bai")
+
+
+@pytest.mark.chipseq
+def test_macs2_cached_run(monkeypatch):
+    """
+    Test that a second run with the same inputs takes the fragment size and
+    the peaks from the result cache without running any tasks
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.cache_test.bam"
+    shutil.copy(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam", bam_file)
+    cache_dir = resource_path + "macs2.cache_test_cache"
+
+    input_files = {"bam": bam_file}
+    metadata = {
+        "bam": Metadata(
+            "data_chipseq", "bam", bam_file, None,
+            {'assembly': 'test'}),
+    }
+    output_files = {
+        "narrow_peak": resource_path + "macs2.cache_test_peaks.narrowPeak",
+        "summits": resource_path + "macs2.cache_test_peaks.summits.bed",
+        "broad_peak": resource_path + "macs2.cache_test_peaks.broadPeak",
+        "gapped_peak": resource_path + "macs2.cache_test_peaks.gappedPeak"
+    }
+    configuration = {
+        "macs_nolambda_param": True,
+        "macs2_fragment_model": "xcor",
+        "macs2_cache_dir": cache_dir
+    }
+
+    output_files_created, output_metadata = Macs2(configuration).run(
+        input_files, metadata, dict(output_files))
+    fragment_size = output_metadata["narrow_peak"].meta_data["fragment_size"]
+    assert fragment_size > 0
+    with open(output_files_created["narrow_peak"], "r") as file_handle:
+        narrow_peaks = file_handle.read()
+    for output_file in output_files_created.values():
+        os.remove(output_file)
+
+    def _not_run(*args):
+        """
+        Fail if the fragment size is estimated or a task is run again
+        """
+        raise AssertionError("Not taken from the cache: {}".format(args[0]))
+
+    monkeypatch.setattr(Macs2Tasks, "macs2_fragment_size", _not_run)
+    monkeypatch.setattr(treatment_run, "macs2_runner", _not_run)
+
+    output_files_created, output_metadata = Macs2(configuration).run(
+        input_files, metadata, dict(output_files))
+    assert output_metadata["narrow_peak"].meta_data["fragment_size"] == fragment_size
+    with open(output_files_created["narrow_peak"], "r") as file_handle:
+        assert file_handle.read() == narrow_peaks
+
+    for output_file in output_files_created.values():
+        os.remove(output_file)
+    shutil.rmtree(cache_dir)
+    for input_file in [bam_file, bam_file + ".bai", bam_file + ".sha256"]:
+        os.remove(input_file)
+
+
+@pytest.mark.chipseq
+def test_macs2_compressed_outputs():
+    """
+    Test that the peak sets for compressed outputs are built from, and named
+    after, the sorted and compressed files
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.compress_test.bam"
+    shutil.copy(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam", bam_file)
+
+    input_files = {"bam": bam_file}
+    metadata = {
+        "bam": Metadata(
+            "data_chipseq", "bam", bam_file, None,
+            {'assembly': 'test'}),
+    }
+    output_files = {
+        "narrow_peak": resource_path + "macs2.compress_test_peaks.narrowPeak",
+        "summits": resource_path + "macs2.compress_test_peaks.summits.bed",
+        "broad_peak": resource_path + "macs2.compress_test_peaks.broadPeak",
+        "gapped_peak": resource_path + "macs2.compress_test_peaks.gappedPeak"
+    }
+
+    macs_handle = Macs2({
+        "macs_nomodel_param": True,
+        "macs2_compress_outputs": True,
+        "macs2_peak_sets": True
+    })
+    output_files_created, output_metadata = macs_handle.run(input_files, metadata, output_files)
+
+    narrow_peak = output_files_created["narrow_peak"]
+    assert narrow_peak == output_files["narrow_peak"] + ".gz"
+    assert output_metadata["narrow_peak"].meta_data["peak_set"] == narrow_peak + ".peakset"
+    peak_set = PeakSet.load(narrow_peak + ".peakset")
+    assert len(peak_set) > 0
+    tabix_handle = pysam.TabixFile(narrow_peak)
+    assert peak_set.peaks["start"].tolist() == [
+        int(line.split("\t")[1]) for line in tabix_handle.fetch()]
+    tabix_handle.close()
+    del peak_set
+
+    leftover = [
+        file_name for file_name in os.listdir(resource_path)
+        if file_name.startswith("macs2.compress_test_peaks")
+    ]
+    assert sorted(leftover) == sorted([
+        os.path.basename(output_file) + suffix
+        for output_file in output_files_created.values()
+        for suffix in ["", ".tbi", ".peakset"]
+    ])
+
+    for file_name in leftover:
+        os.remove(resource_path + file_name)
+    os.remove(bam_file)
+    os.remove(bam_file + ".bai")
+
+
+@pytest.mark.chipseq
+def test_macs2_merge_peak_pair():
+    """
+    Test that a step of the merge tree concatenates the pair of peak files
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_files = [
+        resource_path + "macs2.merge_pair_test." + str(index) + ".narrowPeak"
+        for index in range(3)
+    ]
+    with open(peak_files[0], "w") as file_handle:
+        file_handle.write("chr1\t100\t200\n")
+    with open(peak_files[1], "w") as file_handle:
+        file_handle.write("chr2\t300\t400\n")
+
+    macs2_tasks = Macs2Tasks()
+    records = macs2_tasks.macs2_merge_peak_pair(peak_files[0], peak_files[1], peak_files[2])
+
+    assert [record["stage"] for record in records] == ["merge"]
+    with open(peak_files[2], "r") as file_handle:
+        assert file_handle.read() == "chr1\t100\t200\nchr2\t300\t400\n"
+
+    for peak_file in peak_files:
+        if os.path.isfile(peak_file):
+            os.remove(peak_file)
+
+
+@pytest.mark.chipseq
+def test_macs2_deprecated_methods(monkeypatch):
+    """
+    Test that the peak calling methods left on Macs2 delegate to Macs2Tasks
+    and macs2_runner
+    """
+    calls = []
+
+    def _record(name):
+        def _call(*args):
+            calls.append((name, tuple(
+                arg for arg in args if not isinstance(arg, Macs2Tasks))))
+            return []
+        return _call
+
+    monkeypatch.setattr(Macs2Tasks, "macs2_peak_calling", _record("bgd"))
+    monkeypatch.setattr(Macs2Tasks, "macs2_peak_calling_nobgd", _record("nobgd"))
+    monkeypatch.setattr(macs2, "macs2_runner", _record("runner"))
+
+    macs2_handle = Macs2()
+    outputs = ["a.narrowPeak", "a.summits.bed", "a.broadPeak", "a.gappedPeak"]
+    macs2_handle.macs2_peak_calling(
+        "a", "a.bam", "a.bam.bai", "b.bam", "b.bam.bai", [], *(outputs + ["chr1"]))
+    macs2_handle.macs2_peak_calling_nobgd(
+        "a", "a.bam", "a.bam.bai", [], *(outputs + ["chr1"]))
+    Macs2._macs2_runner(  # pylint: disable=protected-access
+        "a", "a.bam", "a.bam.bai", [], *(outputs + ["chr1", "b.bam", "b.bam.bai"]))
+
+    assert calls == [
+        ("bgd", tuple(["a", "a.bam", "a.bam.bai", "b.bam", "b.bam.bai", []] + outputs + ["chr1"])),
+        ("nobgd", tuple(["a", "a.bam", "a.bam.bai", []] + outputs + ["chr1"])),
+        ("runner", tuple(["a", "a.bam", "a.bam.bai", []] + outputs + [
+            "chr1", "b.bam", "b.bam.bai"])),
+    ]
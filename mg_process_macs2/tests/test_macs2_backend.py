@@ -0,0 +1,47 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import pytest
+
+from mg_process_macs2.tool.macs2_backend import callpeak_in_process
+
+
+@pytest.mark.chipseq
+def test_callpeak_in_process():
+    """
+    Test that MACS2 can be run from the worker process
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+
+    returncode, message = callpeak_in_process([
+        "callpeak", "--nomodel", "-t", bam_file, "-n", "macs2_backend_test",
+        "--outdir", resource_path
+    ])
+
+    assert returncode == 0, message
+    assert os.path.isfile(resource_path + "macs2_backend_test_peaks.narrowPeak") is True
+
+    returncode, message = callpeak_in_process(["callpeak", "--not-a-macs2-param"])
+    assert returncode != 0
+
+    os.remove(resource_path + "macs2_backend_test_peaks.narrowPeak")
+    os.remove(resource_path + "macs2_backend_test_peaks.xls")
+    os.remove(resource_path + "macs2_backend_test_summits.bed")
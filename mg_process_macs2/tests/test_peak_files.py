@@ -0,0 +1,169 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import pysam
+import pytest
+
+from mg_process_macs2.tool.peak_files import (
+    OrderedPeakMerger, compress_peak_file, filter_peaks_to_tiles, merge_peak_files,
+    merge_tree_steps)
+
+
+@pytest.mark.chipseq
+def test_merge_peak_files():
+    """
+    Test that the per chromosome files are merged in the given order
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+
+    merge_jobs = []
+    for output_type in ["narrowPeak", "summits.bed"]:
+        input_files = []
+        for chromosome in ["chr2", "chr10", "chr1"]:
+            input_file = resource_path + "merge_test." + output_type + "." + chromosome
+            with open(input_file, "w") as file_handle:
+                file_handle.write(chromosome + "\t100\t200\t" + output_type + "\n")
+            input_files.append(input_file)
+        merge_jobs.append((resource_path + "merge_test." + output_type, input_files))
+
+    merge_peak_files(merge_jobs, delete_func=os.remove)
+
+    for output_file, input_files in merge_jobs:
+        with open(output_file, "r") as file_handle:
+            contigs = [line.split("\t")[0] for line in file_handle]
+        assert contigs == ["chr2", "chr10", "chr1"]
+        for input_file in input_files:
+            assert os.path.isfile(input_file) is False
+        os.remove(output_file)
+
+
+@pytest.mark.chipseq
+def test_ordered_peak_merger():
+    """
+    Test that inputs completed out of order are merged in the given order
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+
+    input_files = []
+    for chromosome in ["chr2", "chr10", "chr1"]:
+        input_file = resource_path + "merge_test.narrowPeak." + chromosome
+        with open(input_file, "w") as file_handle:
+            file_handle.write(chromosome + "\t100\t200\n")
+        input_files.append(input_file)
+    output_file = resource_path + "merge_test.narrowPeak"
+
+    merger = OrderedPeakMerger([(output_file, input_files)], delete_func=os.remove)
+    merger.add(2)
+    merger.add(0)
+    assert os.path.isfile(input_files[2]) is True
+    merger.add(1)
+    assert merger.close() is True
+
+    with open(output_file, "r") as file_handle:
+        contigs = [line.split("\t")[0] for line in file_handle]
+    assert contigs == ["chr2", "chr10", "chr1"]
+    for input_file in input_files:
+        assert os.path.isfile(input_file) is False
+    os.remove(output_file)
+
+
+@pytest.mark.chipseq
+def test_merge_tree_steps():
+    """
+    Test that running the steps of a merge tree keeps the files in order
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+
+    chromosomes = ["chr2", "chr10", "chr1", "chr5", "chrX"]
+    input_files = []
+    for chromosome in chromosomes:
+        input_file = resource_path + "merge_test.narrowPeak." + chromosome
+        with open(input_file, "w") as file_handle:
+            file_handle.write(chromosome + "\t100\t200\n")
+        input_files.append(input_file)
+    output_file = resource_path + "merge_test.narrowPeak"
+
+    steps, root_file = merge_tree_steps(input_files, output_file)
+    assert len(steps) == len(input_files) - 1
+
+    for step_inputs, step_output in steps:
+        assert len(step_inputs) == 2
+        merge_peak_files([(step_output, step_inputs)], delete_func=os.remove)
+
+    with open(root_file, "r") as file_handle:
+        contigs = [line.split("\t")[0] for line in file_handle]
+    assert contigs == chromosomes
+    os.remove(root_file)
+
+    assert merge_tree_steps(input_files[:1], output_file) == ([], input_files[0])
+    assert merge_tree_steps([], output_file) == ([], None)
+    for input_file in input_files:
+        assert os.path.isfile(input_file) is False
+
+
+@pytest.mark.chipseq
+def test_filter_peaks_to_tiles():
+    """
+    Test that peaks are only kept by the tile that contains their summit
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "tile_test.narrowPeak"
+
+    with open(peak_file, "w") as file_handle:
+        file_handle.write("chr1\t800\t1200\tpeak_1\t10\t.\t2\t3\t4\t250\n")
+        file_handle.write("chr1\t900\t1300\tpeak_2\t10\t.\t2\t3\t4\t50\n")
+        file_handle.write("chr1\t1900\t2200\tpeak_3\t10\t.\t2\t3\t4\t-1\n")
+        file_handle.write("chr2\t100\t200\tpeak_4\t10\t.\t2\t3\t4\t50\n")
+
+    filter_peaks_to_tiles(peak_file, [("chr1", 0, 2000, 1000, 2000)], 9)
+
+    with open(peak_file, "r") as file_handle:
+        peaks = [line.split("\t")[3] for line in file_handle]
+    assert peaks == ["peak_1", "peak_4"]
+
+    os.remove(peak_file)
+
+
+@pytest.mark.chipseq
+def test_compress_peak_file():
+    """
+    Test that a peak file is sorted, compressed and indexed for region queries
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "compress_test.narrowPeak"
+
+    with open(peak_file, "w") as file_handle:
+        file_handle.write("chr2\t500\t600\tpeak_1\t10\n")
+        file_handle.write("chr2\t100\t200\tpeak_2\t10\n")
+        file_handle.write("chr1\t50\t60\tpeak_3\t10\n")
+
+    compressed_file, index_file = compress_peak_file(peak_file)
+    assert compressed_file == peak_file + ".gz"
+    assert os.path.isfile(index_file) is True
+    assert os.path.isfile(peak_file) is False
+
+    tabix_handle = pysam.TabixFile(compressed_file)
+    peaks = [line.split("\t")[3] for line in tabix_handle.fetch("chr2", 150, 550)]
+    assert peaks == ["peak_2", "peak_1"]
+    assert len(list(tabix_handle.fetch("chr1"))) == 1
+    tabix_handle.close()
+
+    os.remove(compressed_file)
+    os.remove(index_file)
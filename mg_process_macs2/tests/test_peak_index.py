@@ -0,0 +1,93 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import random
+import pytest
+
+from mg_process_macs2.query.peak_index import PeakIndex, write_peak_index
+
+
+def _write_peaks(peak_file):
+    """
+    Write a summits style file of random peaks, some of which are nested or
+    overlapping, on two contigs
+    """
+    rng = random.Random(7)
+    peaks = []
+    for contig in ["chr2", "chr1"]:
+        for _ in range(200):
+            start = rng.randint(0, 100000)
+            peaks.append((contig, start, start + rng.choice([50, 300, 5000])))
+    rng.shuffle(peaks)
+
+    with open(peak_file, "w") as file_handle:
+        for index, (contig, start, end) in enumerate(peaks):
+            file_handle.write("{}\t{}\t{}\tpeak_{}\t1.0\n".format(contig, start, end, index))
+
+    return peaks
+
+
+@pytest.mark.chipseq
+def test_peak_index():
+    """
+    Test the overlap, count and nearest queries against a scan of the peaks
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "peak_index_test.summits.bed"
+    peaks = _write_peaks(peak_file)
+
+    index_file = write_peak_index(peak_file, "summits")
+    peak_index = PeakIndex.load(index_file)
+
+    rng = random.Random(11)
+    contigs, starts, ends = [], [], []
+    for _ in range(500):
+        start = rng.randint(0, 110000)
+        contigs.append(rng.choice(["chr1", "chr2", "chr3"]))
+        starts.append(start)
+        ends.append(start + rng.randint(1, 2000))
+
+    offsets, overlaps = peak_index.overlap(contigs, starts, ends)
+    counts = peak_index.count(contigs, starts, ends)
+    nearest, distances = peak_index.nearest(contigs, starts, ends)
+
+    for region, (contig, start, end) in enumerate(zip(contigs, starts, ends)):
+        expected = set([
+            index for index, peak in enumerate(peaks)
+            if peak[0] == contig and peak[1] < end and peak[2] > start
+        ])
+        assert set(overlaps[offsets[region]:offsets[region + 1]].tolist()) == expected
+        assert counts[region] == len(expected)
+
+        if contig == "chr3":
+            assert nearest[region] == -1 and distances[region] == -1
+            continue
+
+        expected_distance = min([
+            max(0, peak[1] - end + 1, start - peak[2] + 1)
+            for peak in peaks if peak[0] == contig
+        ])
+        assert distances[region] == expected_distance
+        peak = peaks[nearest[region]]
+        assert peak[0] == contig
+        assert max(0, peak[1] - end + 1, start - peak[2] + 1) == expected_distance
+
+    os.remove(peak_file)
+    os.remove(index_file)
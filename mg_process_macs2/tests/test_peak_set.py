@@ -0,0 +1,127 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import gzip
+import os.path
+import numpy as np
+import pytest
+
+from mg_process_macs2.tool.peak_set import PeakSet, write_peak_set
+
+
+@pytest.mark.chipseq
+def test_peak_set():
+    """
+    Test that a narrow peak file is parsed and that the sidecar file loads
+    the same peaks
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "peak_set_test.narrowPeak"
+
+    with open(peak_file, "w") as file_handle:
+        file_handle.write("chr2\t100\t300\tpeak_1\t52\t.\t4.1\t7.25\t5.2\t120\n")
+        file_handle.write("chr10\t500\t900\tpeak_2\t104\t+\t8.5\t12.5\t10.4\t60\n")
+        file_handle.write("chr2\t1000\t1400\tpeak_3\t33\t-\t3.0\t5.5\t3.3\t-1\n")
+
+    peak_set = PeakSet.from_bed(peak_file, "narrow_peak")
+    assert len(peak_set) == 3
+    assert peak_set.contigs == ["chr2", "chr10"]
+    assert peak_set.peaks["contig"].tolist() == [0, 1, 0]
+    assert peak_set.peaks["start"].tolist() == [100, 500, 1000]
+    assert peak_set.peaks["strand"].tolist() == [0, 1, -1]
+    assert peak_set.peaks["summit"].tolist() == [120, 60, -1]
+    assert peak_set.peaks["start"].dtype == np.int32
+    assert peak_set.peaks["p_value"].dtype == np.float32
+    assert peak_set.contig_peaks("chr2")["end"].tolist() == [300, 1400]
+    assert len(peak_set.contig_peaks("chr1")) == 0
+
+    sidecar_file = write_peak_set(peak_file, "narrow_peak")
+    loaded = PeakSet.load(sidecar_file)
+    assert isinstance(loaded.peaks, np.memmap)
+    assert loaded.contigs == peak_set.contigs
+    assert loaded.peak_format == "narrow_peak"
+    assert loaded.peaks.tolist() == peak_set.peaks.tolist()
+    del loaded
+
+    os.remove(peak_file)
+    os.remove(sidecar_file)
+
+
+@pytest.mark.chipseq
+def test_peak_set_empty():
+    """
+    Test that an empty peak file gives an empty peak set
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "peak_set_test.summits.bed"
+
+    open(peak_file, "w").close()
+
+    sidecar_file = write_peak_set(peak_file, "summits")
+    loaded = PeakSet.load(sidecar_file)
+    assert len(loaded) == 0
+    assert loaded.contigs == []
+
+    os.remove(peak_file)
+    os.remove(sidecar_file)
+
+
+@pytest.mark.chipseq
+def test_peak_set_track_line():
+    """
+    Test that track lines are skipped and that a line without all of the
+    columns of the format is rejected
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "peak_set_test.broadPeak"
+
+    with open(peak_file, "w") as file_handle:
+        file_handle.write("track type=broadPeak name=\"track_peaks\"\n")
+        file_handle.write("chr1\t100\t300\ttrack_peak_1\t52\t.\t4.1\t7.25\t5.2\n")
+
+    peak_set = PeakSet.from_bed(peak_file, "broad_peak")
+    assert peak_set.contigs == ["chr1"]
+    assert peak_set.peaks["q_value"].tolist() == [np.float32(5.2)]
+
+    with open(peak_file, "a") as file_handle:
+        file_handle.write("chr1\t500\t900\ttrack_peak_2\t104\t.\n")
+
+    with pytest.raises(ValueError):
+        PeakSet.from_bed(peak_file, "broad_peak")
+
+    os.remove(peak_file)
+
+
+@pytest.mark.chipseq
+def test_peak_set_compressed():
+    """
+    Test that a gzip compressed peak file is parsed
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    peak_file = resource_path + "peak_set_test.summits.bed.gz"
+
+    with gzip.open(peak_file, "wb") as file_handle:
+        file_handle.write(b"chr1\t119\t120\tpeak_1\t5.2\n")
+        file_handle.write(b"chr2\t59\t60\tpeak_2\t10.4\n")
+
+    peak_set = PeakSet.from_bed(peak_file, "summits")
+    assert peak_set.contigs == ["chr1", "chr2"]
+    assert peak_set.peaks["start"].tolist() == [119, 59]
+
+    os.remove(peak_file)
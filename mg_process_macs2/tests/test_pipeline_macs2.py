@@ -63,15 +63,12 @@ def test_test_pipeline():
     assert os.path.isfile(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed") is True
     assert os.path.getsize(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed") > 0
 
+    # The intermediate files are removed by the tool
+    assert os.path.isfile(
+        resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22.bam") is False
+    assert os.path.isfile(
+        resource_path + "macs2.Human.DRR000150.22_peaks.narrowPeak.chr22") is False
+
     os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.narrowPeak")
     os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22.bam")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22_peaks.narrowPeak")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22_peaks.xls")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.chr22_summits.bed")
     os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam.bai")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam_tmp.bai")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.broadPeak.chr22")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.gappedPeak.chr22")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.narrowPeak.chr22")
-    os.remove(resource_path + "macs2.Human.DRR000150.22_peaks.summits.bed.chr22")
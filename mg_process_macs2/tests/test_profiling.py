@@ -0,0 +1,116 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import os.path
+import subprocess
+import sys
+import pytest
+
+from mg_process_macs2.tool.profiling import StageProfiler
+
+
+@pytest.mark.chipseq
+def test_stage_profiler():
+    """
+    Test that the stages record the resources used and that the records from
+    a task are included in the summary
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    output_file = resource_path + "profiling_test.txt"
+    profile_file = resource_path + "profiling_test.json"
+
+    profiler = StageProfiler()
+    with profiler.stage("write"):
+        with open(output_file, "w") as file_handle:
+            file_handle.write("x" * 100000)
+
+    task_profiler = StageProfiler()
+    with task_profiler.stage("callpeak", "chr1", reads=10):
+        subprocess.check_call([sys.executable, "-c", "sum(range(2000000))"])
+    with task_profiler.stage("callpeak", "chr2", reads=20):
+        pass
+    profiler.add(task_profiler.records)
+    profiler.add(False)
+
+    assert len(profiler.records) == 3
+    assert profiler.records[0]["chromosome"] is None
+    assert profiler.records[0]["pid"] == os.getpid()
+    if profiler.records[0]["io_write"] is not None:
+        assert profiler.records[0]["io_write"] >= 100000
+    assert profiler.records[1]["reads"] == 10
+    assert profiler.records[1]["cpu"] > 0
+    assert profiler.records[1]["child_max_rss"] > 0
+
+    summary = profiler.summary()
+    assert sorted(summary) == ["callpeak", "write"]
+    assert summary["callpeak"]["count"] == 2
+    assert summary["callpeak"]["slowest"] == "chr1"
+    assert summary["write"]["slowest"] is None
+
+    profiler.save(profile_file)
+    with open(profile_file, "r") as file_handle:
+        profile = json.load(file_handle)
+    assert profile["summary"]["callpeak"]["count"] == 2
+    assert len(profile["records"]) == 3
+
+    os.remove(output_file)
+    os.remove(profile_file)
+
+
+@pytest.mark.chipseq
+def test_stage_profiler_trace():
+    """
+    Test that the records are written as Chrome trace events with a process
+    for each host and a thread for each process id
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    trace_file = resource_path + "profiling_test.trace.json"
+
+    profiler = StageProfiler()
+    with profiler.stage("peak_calling"):
+        pass
+    profiler.add([
+        {
+            "stage": "callpeak", "chromosome": "chr1", "start": profiler.records[0]["start"] + 1,
+            "wall": 2.5, "cpu": 2.0, "child_max_rss": 0, "io_read": 0, "io_write": 0,
+            "host": "worker1", "pid": 123, "reads": 1000
+        }
+    ])
+    profiler.save_trace(trace_file)
+
+    with open(trace_file, "r") as file_handle:
+        trace = json.load(file_handle)
+    os.remove(trace_file)
+
+    process_names = dict([
+        (event["pid"], event["args"]["name"]) for event in trace["traceEvents"]
+        if event["name"] == "process_name"
+    ])
+    assert sorted(process_names.values()) == sorted([profiler.host, "worker1"])
+
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [span["name"] for span in spans] == ["peak_calling", "callpeak chr1"]
+    assert spans[0]["ts"] == 0
+    assert spans[1]["ts"] == 1000000
+    assert spans[1]["dur"] == 2500000
+    assert process_names[spans[1]["pid"]] == "worker1"
+    assert spans[1]["tid"] == 123
+    assert spans[1]["args"]["reads"] == 1000
+    assert spans[1]["args"]["chromosome"] == "chr1"
@@ -0,0 +1,100 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os.path
+import shutil
+import pytest
+
+from mg_process_macs2.tool.result_cache import DIGEST_SUFFIX, ResultCache, file_digest
+
+
+@pytest.mark.chipseq
+def test_result_cache():
+    """
+    Test that results are reused for the same key and that the least recently
+    used entries are removed when the cache is over the size limit
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    cache_dir = resource_path + "result_cache_test"
+
+    key = ResultCache.key("bam", None, ["--gsize", "hs", "--nomodel"], ["chr22"])
+    assert key == ResultCache.key("bam", None, ["--nomodel", "--gsize", "hs"], ["chr22"])
+    assert key != ResultCache.key("bam", "bgd", ["--gsize", "hs", "--nomodel"], ["chr22"])
+    assert key != ResultCache.key("bam", None, ["--gsize", "hs", "--nomodel"], ["chr21"])
+
+    peak_file = resource_path + "result_cache_test.narrowPeak"
+    with open(peak_file, "w") as file_handle:
+        file_handle.write("chr22\t100\t200\n")
+
+    result_cache = ResultCache(cache_dir, 20)
+    assert result_cache.fetch(key, {"narrowPeak": peak_file}) is False
+    result_cache.store(key, {"narrowPeak": peak_file})
+    os.remove(peak_file)
+    assert result_cache.fetch(key, {"narrowPeak": peak_file}) is True
+    with open(peak_file, "r") as file_handle:
+        assert file_handle.read() == "chr22\t100\t200\n"
+
+    # The second entry takes the cache over the limit so the first is removed
+    os.utime(os.path.join(cache_dir, key), (0, 0))
+    key_2 = ResultCache.key("bam", None, ["--gsize", "hs"], ["chr22"])
+    result_cache.store(key_2, {"narrowPeak": peak_file})
+    assert result_cache.fetch(key, {"narrowPeak": peak_file}) is False
+    assert result_cache.fetch(key_2, {"narrowPeak": peak_file}) is True
+
+    # Values are stored in entries of their own
+    value_key = ResultCache.value_key("fragment_size.predictd", "bam", ["--gsize", "hs"], ["chr22"])
+    assert value_key != key_2
+    assert result_cache.fetch_value(value_key) is None
+    result_cache.store_value(value_key, 180)
+    assert result_cache.fetch_value(value_key) == 180
+
+    os.remove(peak_file)
+    shutil.rmtree(cache_dir)
+
+
+@pytest.mark.chipseq
+def test_file_digest():
+    """
+    Test that the digest of a file is saved next to it and only generated
+    again when the file changes
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    data_file = resource_path + "file_digest_test.bam"
+    with open(data_file, "wb") as file_handle:
+        file_handle.write(b"reads")
+
+    assert file_digest(data_file) == hashlib.sha256(b"reads").hexdigest()
+    assert os.path.isfile(data_file + DIGEST_SUFFIX) is True
+
+    # The saved digest is used while the size and modification time match
+    with open(data_file + DIGEST_SUFFIX, "r") as file_handle:
+        saved_state = json.load(file_handle)
+    saved_state["sha256"] = "saved"
+    with open(data_file + DIGEST_SUFFIX, "w") as file_handle:
+        json.dump(saved_state, file_handle)
+    assert file_digest(data_file) == "saved"
+
+    with open(data_file, "wb") as file_handle:
+        file_handle.write(b"more reads")
+    assert file_digest(data_file) == hashlib.sha256(b"more reads").hexdigest()
+
+    os.remove(data_file)
+    os.remove(data_file + DIGEST_SUFFIX)
@@ -0,0 +1,66 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import pytest
+
+from mg_process_macs2.tool.run_manifest import RunManifest
+
+
+@pytest.mark.chipseq
+def test_run_manifest():
+    """
+    Test that completed tasks are remembered between runs with the same
+    inputs and parameters
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    bam_file = resource_path + "macs2.Human.DRR000150.22_aln_filtered.bam"
+    manifest_file = resource_path + "manifest_test.json"
+    output_file = resource_path + "manifest_test.narrowPeak.chr22"
+
+    run_key = RunManifest.run_key([bam_file], ["--gsize", "hs"])
+    manifest = RunManifest(manifest_file, run_key)
+    assert manifest.use_batches([["chr22"], ["chr21"]]) == [["chr22"], ["chr21"]]
+    assert manifest.is_complete("chr22") is False
+    assert manifest.use_value("fragment_size", lambda: 180) == 180
+
+    with open(output_file, "w") as file_handle:
+        file_handle.write("chr22\t100\t200\n")
+    manifest.mark("chr22", "complete", [output_file])
+    manifest.mark("chr21", "failed", message="MACS2 failed")
+
+    # The resumed run uses the batches of the first run
+    manifest = RunManifest(manifest_file, run_key)
+    assert manifest.use_batches([["chr21", "chr22"]]) == [["chr22"], ["chr21"]]
+    assert manifest.use_value("fragment_size", lambda: 250) == 180
+    assert manifest.is_complete("chr22") is True
+    assert manifest.is_complete("chr21") is False
+
+    # A change to the parameters starts a new run
+    manifest = RunManifest(
+        manifest_file,
+        RunManifest.run_key([bam_file], ["--gsize", "mm"]))
+    assert manifest.is_complete("chr22") is False
+
+    # Missing outputs mean that the task needs to be run again
+    manifest = RunManifest(manifest_file, run_key)
+    os.remove(output_file)
+    assert manifest.is_complete("chr22") is False
+
+    os.remove(manifest_file)
@@ -0,0 +1,141 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import pytest
+
+from mg_process_macs2.tool.scheduling import (
+    batch_contigs, batch_label, choose_strategy, order_longest_first, tile_batches)
+
+CONTIG_STATS = [
+    ("chr1", 248956422, 5000),
+    ("chr2", 242193529, 4000),
+    ("chr1_KI270706v1_random", 175055, 20),
+    ("chr1_KI270707v1_random", 32032, 10),
+    ("chrUn_KI270302v1", 2274, 0),
+    ("chrUn_KI270304v1", 2165, 5),
+    ("chrEBV", 171823, 990)
+]
+
+
+@pytest.mark.chipseq
+def test_batch_contigs_reads():
+    """
+    Test that small contigs are grouped by read count in header order
+    """
+    batches = batch_contigs(CONTIG_STATS, 1000, "reads")
+
+    assert batches == [
+        ["chr1"],
+        ["chr2"],
+        ["chr1_KI270706v1_random", "chr1_KI270707v1_random", "chrUn_KI270302v1",
+         "chrUn_KI270304v1"],
+        ["chrEBV"]
+    ]
+    assert [c for batch in batches for c in batch] == [c[0] for c in CONTIG_STATS]
+
+
+@pytest.mark.chipseq
+def test_batch_contigs_length():
+    """
+    Test that small contigs are grouped by length
+    """
+    batches = batch_contigs(CONTIG_STATS, 200000, "length")
+
+    assert batches == [
+        ["chr1"],
+        ["chr2"],
+        ["chr1_KI270706v1_random"],
+        ["chr1_KI270707v1_random", "chrUn_KI270302v1", "chrUn_KI270304v1"],
+        ["chrEBV"]
+    ]
+
+
+@pytest.mark.chipseq
+def test_batch_contigs_off():
+    """
+    Test that a batch size of 0 gives a batch per contig
+    """
+    batches = batch_contigs(CONTIG_STATS, 0)
+
+    assert batches == [[c[0]] for c in CONTIG_STATS]
+    assert batch_label(batches[0]) == "chr1"
+    assert batch_label(["chrUn_KI270302v1", "chrEBV"]) == "chrUn_KI270302v1..chrEBV"
+
+
+@pytest.mark.chipseq
+def test_tile_batches():
+    """
+    Test that only the large contigs in their own batch are split into
+    overlapping tiles that cover the whole contig
+    """
+    batches = tile_batches(batch_contigs(CONTIG_STATS, 1000, "reads"), CONTIG_STATS, 2000, 10000)
+
+    chr1_tiles = [batch[0] for batch in batches if batch[0][0] == "chr1"]
+    assert len(chr1_tiles) == 3
+    assert chr1_tiles[0][1] == 0 and chr1_tiles[0][3] == 0
+    assert chr1_tiles[-1][2] == 248956422 and chr1_tiles[-1][4] == 248956422
+    for tile, next_tile in zip(chr1_tiles[:-1], chr1_tiles[1:]):
+        assert tile[4] == next_tile[3]
+        assert tile[2] == tile[4] + 10000
+        assert next_tile[1] == next_tile[3] - 10000
+
+    assert len([batch for batch in batches if batch[0][0] == "chr2"]) == 2
+    assert batches[-1] == ["chrEBV"]
+    assert batch_label([chr1_tiles[1]]) == "chr1.82985474-165970948"
+
+
+@pytest.mark.chipseq
+def test_order_longest_first():
+    """
+    Test that the tasks with the most reads are started first
+    """
+    assert order_longest_first([0, 1, 2, 3, 4], [10, 50, 10, 5, 80]) == [4, 1, 0, 2, 3]
+    assert order_longest_first([0, 2, 3], [10, 50, 10, 5]) == [0, 2, 3]
+
+
+@pytest.mark.chipseq
+def test_choose_strategy():
+    """
+    Test that the strategy is chosen from the number of reads, contigs and
+    workers
+    """
+    small = choose_strategy(CONTIG_STATS, 16)
+    assert small["strategy"] == "whole_genome"
+    assert small["reads"] == 10025
+    assert len(batch_contigs(CONTIG_STATS, small["batch_size"])) == 1
+
+    genome = [("chr" + str(index), 100000000, 4000000) for index in range(1, 21)]
+    assert choose_strategy(genome, 1)["strategy"] == "whole_genome"
+    assert choose_strategy(genome, 10)["strategy"] == "per_chromosome"
+    assert choose_strategy(genome, 10)["batch_size"] == 0
+
+    batched = choose_strategy(genome + [("chrUn", 50000, 1000)] * 10, 2)
+    assert batched["strategy"] == "batched"
+    assert batched["batch_size"] == 20002500
+
+    tiled = choose_strategy([("chr1", 248956422, 50000000)], 8)
+    assert tiled["strategy"] == "tiled"
+    assert tiled["tile_reads"] == 3125000
+
+    forced = choose_strategy(genome, 10, "tiled")
+    assert forced["strategy"] == "tiled"
+    assert forced["tile_reads"] == 4000000
+
+    with pytest.raises(ValueError):
+        choose_strategy(genome, 10, "per_contig")
@@ -0,0 +1,71 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import pytest
+
+from mg_process_macs2.tool.scratch import ScratchSpace, scratch_location
+
+
+@pytest.mark.chipseq
+def test_scratch_space():
+    """
+    Test that the results are moved out of the scratch space and that the
+    intermediate and tracked files are removed, even if the task fails
+    """
+    resource_path = os.path.join(os.path.dirname(__file__), "data/")
+    output_file = resource_path + "scratch_test.narrowPeak"
+    empty_file = resource_path + "scratch_test.broadPeak"
+    tracked_file = resource_path + "scratch_test.chr1.bam"
+
+    with ScratchSpace(resource_path) as scratch:
+        assert os.path.dirname(scratch.path) == os.path.dirname(resource_path)
+        intermediate_file = scratch.file("/shared/data/sample.chr1.bam")
+        assert intermediate_file == os.path.join(scratch.path, "sample.chr1.bam")
+
+        with open(intermediate_file, "w") as file_handle:
+            file_handle.write("reads\n")
+        with open(scratch.file("sample_peaks.narrowPeak"), "w") as file_handle:
+            file_handle.write("chr1\t10\t20\n")
+        with open(tracked_file, "w") as file_handle:
+            file_handle.write("reads\n")
+        scratch.track(tracked_file)
+
+        scratch.place(scratch.file("sample_peaks.narrowPeak"), output_file)
+        scratch.place(scratch.file("sample_peaks.broadPeak"), empty_file)
+
+    assert not os.path.isdir(scratch.path)
+    assert not os.path.isfile(tracked_file)
+    with open(output_file, "r") as file_handle:
+        assert file_handle.read() == "chr1\t10\t20\n"
+    assert os.path.getsize(empty_file) == 0
+
+    with pytest.raises(ValueError):
+        with ScratchSpace(resource_path) as scratch:
+            with open(scratch.file("sample.chr1.bam"), "w") as file_handle:
+                file_handle.write("reads\n")
+            raise ValueError("MACS2 failed")
+    assert not os.path.isdir(scratch.path)
+
+    assert scratch_location(None, resource_path, 0) == resource_path
+    assert scratch_location("/tmp", resource_path, 1024) == "/tmp"
+    assert scratch_location("/tmp", resource_path, 1024 ** 6) == resource_path
+
+    os.remove(output_file)
+    os.remove(empty_file)
@@ -0,0 +1,87 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import time
+import pytest
+
+from mg_process_macs2.tool.supervisor import ProcessSupervisor, parse_macs2_progress
+
+
+@pytest.mark.chipseq
+def test_parse_macs2_progress():
+    """
+    Test that the progress lines of the MACS2 log are parsed
+    """
+    assert parse_macs2_progress(
+        "INFO  @ Mon, 02 Jul 2018 10:11:12: #1 read tag files... ") == {
+            "step": "1", "message": "read tag files..."}
+    assert parse_macs2_progress(
+        "INFO  @ Mon, 02 Jul 2018 10:11:13: #1  total tags in treatment: 123456 ") == {
+            "step": "1", "message": "total tags in treatment: 123456", "treatment": 123456}
+    assert parse_macs2_progress("INFO  @ Mon, 02 Jul 2018 10:11:14: 1000000") is None
+
+
+@pytest.mark.chipseq
+def test_process_supervisor():
+    """
+    Test that the output is streamed, that only the tail of stderr is kept
+    and that failures are reported
+    """
+    supervisor = ProcessSupervisor(tail_lines=3, poll_interval=0.05)
+    assert supervisor.run([
+        sys.executable, "-c",
+        "import sys\n"
+        "for i in range(10): sys.stderr.write('#%d step %d\\n' % (i, i))\n"
+        "print('done')"
+    ])
+    assert supervisor.returncode == 0
+    assert supervisor.failure is None
+    assert list(supervisor.tail) == ["#7 step 7", "#8 step 8", "#9 step 9"]
+    assert [event["step"] for event in supervisor.progress] == [str(i) for i in range(10)]
+
+    supervisor = ProcessSupervisor(poll_interval=0.05)
+    assert not supervisor.run([
+        sys.executable, "-c", "import sys; sys.stderr.write('bad input\\n'); sys.exit(3)"])
+    assert supervisor.returncode == 3
+    assert supervisor.failure == "exited with code 3"
+    assert "bad input" in supervisor.error_report()
+
+
+@pytest.mark.chipseq
+def test_process_supervisor_limits():
+    """
+    Test that a process is stopped when it goes over the time or memory limit
+    """
+    supervisor = ProcessSupervisor({"time": 0.5}, poll_interval=0.05)
+    start = time.time()
+    assert not supervisor.run([sys.executable, "-c", "import time; time.sleep(30)"])
+    assert time.time() - start < 10
+    assert supervisor.failure.startswith("exceeded the time limit")
+    assert supervisor.returncode != 0
+
+    if not os.path.isdir("/proc"):
+        return
+
+    supervisor = ProcessSupervisor({"memory": 100 * 1024 ** 2}, poll_interval=0.05)
+    assert not supervisor.run([
+        sys.executable, "-c", "import time; data = b'x' * (400 * 1024 ** 2); time.sleep(30)"])
+    assert supervisor.failure.startswith("exceeded the memory limit")
+    assert supervisor.max_rss > 100 * 1024 ** 2
@@ -0,0 +1,391 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import pysam
+
+# Maximum number of output bam files that `bam_split_batches` keeps open at
+# once, each of which holds a file descriptor and the BGZF buffers
+MAX_OPEN_WRITERS = 64
+
+
+# ------------------------------------------------------------------------------
+
+def build_bam_profile(bam_file, bai_file, paired_sample_size=100):
+    """
+    Collect the information about a BAM file that is needed to plan and run
+    the peak calling, so that the tasks do not need to read the file again.
+
+    The read counts are taken from the BAM index so the reads do not need to
+    be read from the file.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the bam file
+    bai_file : str
+        Location of the bam index file
+    paired_sample_size : int
+        Number of reads from the start of the file that are checked for
+        paired end reads
+
+    Returns
+    -------
+    dict
+        paired : bool
+            True if the file contains paired end reads
+        contigs : list
+            List of tuples of the form (contig, length, mapped_reads,
+            unmapped_reads) in the order of the BAM header
+        header : dict
+            The BAM header
+    """
+    bam_handle = pysam.AlignmentFile(bam_file, "rb", index_filename=bai_file)
+
+    index_stats = {}
+    for stat in bam_handle.get_index_statistics():
+        index_stats[stat.contig] = (stat.mapped, stat.unmapped)
+
+    contigs = []
+    for contig, length in zip(bam_handle.references, bam_handle.lengths):
+        mapped, unmapped = index_stats.get(contig, (0, 0))
+        contigs.append((contig, length, mapped, unmapped))
+
+    paired = False
+    for read_count, read in enumerate(bam_handle.fetch(until_eof=True)):
+        if read.is_paired:
+            paired = True
+            break
+        if read_count >= paired_sample_size:
+            break
+
+    header = bam_handle.header
+    if hasattr(header, "to_dict"):
+        header = header.to_dict()
+
+    bam_handle.close()
+
+    return {
+        "paired": paired,
+        "contigs": contigs,
+        "header": header
+    }
+
+
+def contig_region(item):
+    """
+    Get the region of the bam file for an item in a batch of contigs.
+
+    Parameters
+    ----------
+    item : str or tuple
+        Either the name of a contig or a tile of a contig of the form
+        (contig, start, end, core_start, core_end) as generated by
+        `tile_batches`
+
+    Returns
+    -------
+    contig : str
+    start : int
+        Start of the region, None for the whole contig
+    end : int
+        End of the region, None for the whole contig
+    """
+    if isinstance(item, (list, tuple)):
+        return item[0], item[1], item[2]
+
+    return item, None, None
+
+
+def profile_mapped_reads(profile, chromosomes):
+    """
+    Get the number of aligned reads in a set of contigs from a BAM profile.
+
+    Parameters
+    ----------
+    profile : dict
+        BAM profile as generated by `build_bam_profile`
+    chromosomes : list
+        List of contig names or tiles, see `contig_region`. If the list is
+        [None] then the count is for the whole file
+
+    Returns
+    -------
+    int
+        Number of aligned reads
+    """
+    if chromosomes == [None]:
+        return sum([contig[2] for contig in profile["contigs"]])
+
+    contigs = dict([(contig[0], contig) for contig in profile["contigs"]])
+
+    mapped = 0
+    for chromosome in chromosomes:
+        contig, start, end = contig_region(chromosome)
+        if contig not in contigs:
+            continue
+        _contig, length, contig_mapped = contigs[contig][:3]
+        if start is None:
+            mapped += contig_mapped
+        else:
+            # Tiles are assumed to have the same read density as the contig
+            mapped += int(contig_mapped * float(end - start) / max(length, 1))
+
+    return mapped
+
+
+def bam_split_contigs(bam_file, bai_file, chromosomes, bam_file_out):
+    """
+    Extract the alignments for a set of contigs, or tiles of contigs, into a
+    single bam file.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the bam file
+    bai_file : str
+        Location of the bam index file
+    chromosomes : list
+        List of the contig names or tiles to extract, see `contig_region`
+    bam_file_out : str
+        Location of the output bam file
+
+    Returns
+    -------
+    int
+        Number of alignments that were written
+    """
+    bam_handle = pysam.AlignmentFile(bam_file, "rb", index_filename=bai_file)
+    bam_out_handle = pysam.AlignmentFile(bam_file_out, "wb", template=bam_handle)
+
+    count = 0
+    for chromosome in chromosomes:
+        for read in bam_handle.fetch(*contig_region(chromosome)):
+            bam_out_handle.write(read)
+            count += 1
+
+    bam_out_handle.close()
+    bam_handle.close()
+
+    return count
+
+
+def output_threads(threads, batch_reads):
+    """
+    Share the compression threads between the output files of a split. The
+    threads are given to the outputs in proportion to the number of reads that
+    they are expected to hold, so that the largest outputs, which take the
+    longest to compress, get the most. Every output has at least 1 thread.
+
+    Parameters
+    ----------
+    threads : int
+        Number of threads available for the compression
+    batch_reads : list
+        Expected number of reads in each of the outputs
+
+    Returns
+    -------
+    list
+        Number of threads for each of the outputs
+    """
+    total = sum(batch_reads)
+    if total <= 0:
+        return [max(1, threads // max(len(batch_reads), 1))] * len(batch_reads)
+
+    return [max(1, int(threads * reads / float(total))) for reads in batch_reads]
+
+
+def _split_passes(spans, max_open):
+    """
+    Group the batches into passes over a bam file so that no more than
+    `max_open` of the batches in a pass cover any one contig.
+
+    Parameters
+    ----------
+    spans : list
+        Index of the first and last contig of each batch in the bam header
+    max_open : int
+        Maximum number of batches in a pass that cover a contig
+
+    Returns
+    -------
+    list
+        List of the indexes of the batches in each pass
+    """
+    passes = []
+    for batch_index in sorted(range(len(spans)), key=lambda index: spans[index]):
+        first = spans[batch_index][0]
+        for batch_pass in passes:
+            if len([index for index in batch_pass if spans[index][1] >= first]) < max_open:
+                batch_pass.append(batch_index)
+                break
+        else:
+            passes.append([batch_index])
+
+    return passes
+
+
+def _split_pass(bam_file, threads, targets, spans, bam_files_out, batch_threads):
+    """
+    Write the output bam files for a pass of `bam_split_batches`. The reads
+    are sorted by contig so the output file for a batch is opened with its
+    first read and closed once the reads have passed its last contig.
+
+    Parameters
+    ----------
+    targets : dict
+        Regions of each contig for the batches in the pass as tuples of the
+        form (start, end, batch_index)
+    spans : dict
+        Index of the first and last contig of each batch in the pass
+
+    See `bam_split_batches` for the other parameters.
+
+    Returns
+    -------
+    dict
+        Number of alignments written for each batch in the pass
+    """
+    counts = dict([(batch_index, 0) for batch_index in spans])
+    remaining = sorted(spans, key=lambda index: spans[index][1])
+    last_contig = spans[remaining[-1]][1]
+    bam_out_handles = {}
+
+    bam_handle = pysam.AlignmentFile(bam_file, "rb", threads=threads)
+
+    def _close_batches(reference_id):
+        """
+        Close the output files for the batches that end before a contig.
+        Batches without any reads get a bam file with just the header.
+        """
+        while remaining and spans[remaining[0]][1] < reference_id:
+            batch_index = remaining.pop(0)
+            bam_out_handle = bam_out_handles.pop(batch_index, None)
+            if bam_out_handle is None:
+                bam_out_handle = pysam.AlignmentFile(
+                    bam_files_out[batch_index], "wb", template=bam_handle)
+            bam_out_handle.close()
+
+    try:
+        reference_id = None
+        reference_targets = []
+        for read in bam_handle.fetch(until_eof=True):
+            if read.reference_id != reference_id:
+                reference_id = read.reference_id
+                if reference_id < 0 or reference_id > last_contig:
+                    break
+                _close_batches(reference_id)
+                reference_targets = targets.get(bam_handle.get_reference_name(reference_id), [])
+
+            for start, end, batch_index in reference_targets:
+                if start is not None:
+                    read_end = read.reference_end or read.reference_start + 1
+                    if read.reference_start >= end or read_end <= start:
+                        continue
+                if batch_index not in bam_out_handles:
+                    bam_out_handles[batch_index] = pysam.AlignmentFile(
+                        bam_files_out[batch_index], "wb", template=bam_handle,
+                        threads=batch_threads[batch_index])
+                bam_out_handles[batch_index].write(read)
+                counts[batch_index] += 1
+
+        _close_batches(last_contig + 1)
+    finally:
+        for bam_out_handle in bam_out_handles.values():
+            bam_out_handle.close()
+        bam_handle.close()
+
+    return counts
+
+
+def bam_split_batches(bam_file, batches, bam_files_out, threads=1, max_open=MAX_OPEN_WRITERS):
+    """
+    Split a bam file into a bam file for each batch of contigs in a single
+    sequential pass over the file.
+
+    This matches extracting each batch with `bam_split_contigs`, but the file
+    is only read once and from start to end, which is much cheaper than a set
+    of random reads on network file systems. Reads that overlap more than one
+    tile of a contig are written to the file for each of the tiles.
+
+    The output file for a batch is only open while the pass is over its
+    contigs, so a split into a file per contig only has one output open at a
+    time. If more than `max_open` batches cover the same contig then the
+    batches are split over several passes.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the bam file
+    batches : list
+        List of batches, each of which is a list of contig names or tiles, see
+        `contig_region`
+    bam_files_out : list
+        Location of the output bam file for each batch
+    threads : int
+        Number of threads used for the BGZF decompression of the input and
+        shared between the outputs for the compression. If the bam file is
+        indexed then the threads go to the outputs with the most reads, see
+        `output_threads`
+    max_open : int
+        Maximum number of output files that are open at once
+
+    Returns
+    -------
+    list
+        Number of alignments written to each output file
+    """
+    bam_handle = pysam.AlignmentFile(bam_file, "rb")
+
+    batch_reads = [0] * len(bam_files_out)
+    if bam_handle.has_index():
+        profile = {"contigs": [
+            (stat.contig, bam_handle.get_reference_length(stat.contig), stat.mapped)
+            for stat in bam_handle.get_index_statistics()
+        ]}
+        batch_reads = [profile_mapped_reads(profile, batch) for batch in batches]
+
+    # Batches that hold none of the contigs in the header cover the position
+    # before the first contig so that their empty files are written first
+    spans = []
+    for batch in batches:
+        reference_ids = [
+            bam_handle.get_tid(contig_region(chromosome)[0]) for chromosome in batch]
+        reference_ids = [reference_id for reference_id in reference_ids if reference_id >= 0]
+        spans.append((min(reference_ids or [-1]), max(reference_ids or [-1])))
+    bam_handle.close()
+
+    batch_threads = output_threads(threads, batch_reads)
+    counts = [0] * len(bam_files_out)
+    for batch_pass in _split_passes(spans, max_open):
+        targets = {}
+        for batch_index in batch_pass:
+            for chromosome in batches[batch_index]:
+                contig, start, end = contig_region(chromosome)
+                targets.setdefault(contig, []).append((start, end, batch_index))
+
+        pass_counts = _split_pass(
+            bam_file, threads, targets,
+            dict([(batch_index, spans[batch_index]) for batch_index in batch_pass]),
+            bam_files_out, batch_threads)
+        for batch_index in pass_counts:
+            counts[batch_index] = pass_counts[batch_index]
+
+    return counts
+
+# ------------------------------------------------------------------------------
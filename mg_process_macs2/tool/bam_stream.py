@@ -0,0 +1,169 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import threading
+
+import pysam
+
+from utils import logger
+
+from mg_process_macs2.tool.bam_regions import contig_region
+
+
+# ------------------------------------------------------------------------------
+
+def bam_read_length(bam_file, bai_file, chromosomes, sample_size=10):
+    """
+    Get the mean read length from the first aligned reads in a set of
+    chromosomes. This matches how MACS2 estimates the tag size.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the bam file
+    bai_file : str
+        Location of the bam index file
+    chromosomes : list
+        List of the chromosome names or tiles to sample from
+    sample_size : int
+        Number of reads to sample
+
+    Returns
+    -------
+    int
+        Mean read length, 0 if there are no aligned reads
+    """
+    bam_handle = pysam.AlignmentFile(bam_file, "rb", index_filename=bai_file)
+
+    lengths = []
+    for chromosome in chromosomes:
+        for read in bam_handle.fetch(*contig_region(chromosome)):
+            if read.is_unmapped or read.query_length == 0:
+                continue
+            lengths.append(read.query_length)
+            if len(lengths) >= sample_size:
+                break
+        if len(lengths) >= sample_size:
+            break
+    bam_handle.close()
+
+    if not lengths:
+        return 0
+
+    return int(sum(lengths) / len(lengths))
+
+
+class BamFifo(threading.Thread):
+    """
+    Stream the alignments for a set of chromosomes to MACS2 as an
+    uncompressed BAM through a named pipe so that the reads do not have to be
+    written to a temporary bam file.
+
+    MACS2 opens each input file twice. The first time it reads the first few
+    bytes to test if the file is gzipped and then closes it, the second time it
+    reads the whole file. Once the first reader has opened the pipe a new pipe
+    is moved into its place, so the second open always gets a fresh pipe. The
+    first pipe is closed without any data, which the gzip test accepts, and
+    the alignments are written to the second.
+
+    The stream is a BAM rather than BED as the MACS2 BED parsers seek back
+    after skipping the comment lines, which fails on a pipe and loses the
+    first read. `--format` has to be set to BAM or BAMPE and, for single end
+    reads, `--tsize` has to be given, see `bam_read_length`, as MACS2 would
+    otherwise rewind the file to measure the reads.
+    """
+
+    def __init__(self, fifo_file, bam_file, bai_file, chromosomes):
+        """
+        Init function
+
+        Parameters
+        ----------
+        fifo_file : str
+            Location of the named pipe to create
+        bam_file : str
+            Location of the bam file
+        bai_file : str
+            Location of the bam index file
+        chromosomes : list
+            List of the chromosome names or tiles to stream
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.fifo_file = fifo_file
+        self.bam_file = bam_file
+        self.bai_file = bai_file
+        self.chromosomes = chromosomes
+        self.error = None
+        self._stop_event = threading.Event()
+
+        os.mkfifo(self.fifo_file)
+
+    def run(self):
+        """
+        Serve the gzip test and then the alignments on the pipe
+        """
+        try:
+            # Blocks until MACS2 opens the file for the gzip test
+            with open(self.fifo_file, "wb"):
+                stream_fifo = self.fifo_file + ".stream"
+                os.mkfifo(stream_fifo)
+                os.rename(stream_fifo, self.fifo_file)
+
+            with open(self.fifo_file, "wb") as fifo_handle:
+                self._write_stream(fifo_handle)
+        except (IOError, OSError) as msg:
+            if self._stop_event.is_set():
+                return
+            self.error = msg
+            logger.fatal("MACS2 FIFO ERROR: {}: {}".format(self.fifo_file, msg))
+
+    def _write_stream(self, fifo_handle):
+        """
+        Write the alignments for the chromosomes to an open pipe
+        """
+        bam_handle = pysam.AlignmentFile(self.bam_file, "rb", index_filename=self.bai_file)
+        try:
+            bam_out_handle = pysam.AlignmentFile(fifo_handle, "wbu", template=bam_handle)
+            for chromosome in self.chromosomes:
+                for read in bam_handle.fetch(*contig_region(chromosome)):
+                    bam_out_handle.write(read)
+            bam_out_handle.close()
+        finally:
+            bam_handle.close()
+
+    def stop(self):
+        """
+        Stop serving the stream and remove the named pipe. A writer that is
+        still waiting for MACS2 to open the pipe is released by opening it
+        for reading.
+        """
+        self._stop_event.set()
+        while self.is_alive():
+            try:
+                os.close(os.open(self.fifo_file, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            self.join(0.1)
+
+        if os.path.exists(self.fifo_file):
+            os.remove(self.fifo_file)
+
+# ------------------------------------------------------------------------------
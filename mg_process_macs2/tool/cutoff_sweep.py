@@ -0,0 +1,263 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import math
+import os
+import re
+
+from mg_process_macs2.tool.supervisor import ProcessSupervisor
+
+# MACS2 parameters that can be swept and the default value used by MACS2
+SWEEP_PARAMS = {
+    "qvalue": 0.05,
+    "pvalue": None,
+    "broad-cutoff": 0.1
+}
+
+
+# ------------------------------------------------------------------------------
+
+def build_sweep(sweep_param, cutoffs, macs_params):
+    """
+    Generate the description of a cutoff sweep that is passed to the peak
+    calling tasks.
+
+    Parameters
+    ----------
+    sweep_param : str
+        The MACS2 parameter that is swept, one of "qvalue", "pvalue" or
+        "broad-cutoff"
+    cutoffs : list or str
+        List of the cutoff values, or a comma separated string of the values
+    macs_params : list
+        List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+
+    Returns
+    -------
+    dict
+        param : str
+            The swept parameter
+        cutoffs : list
+            List of (tag, cutoff) tuples. The tag is used to name the output
+            files for the cutoff
+        score : str
+            "q" or "p" for the score used to call the peaks
+        broad : bool
+            True if broad peaks are called
+        peak_cutoff : float
+            Cutoff for the broad peaks when the linking cutoff is swept
+        link_cutoff : float
+            Cutoff for linking the broad peaks when the peak cutoff is swept
+    """
+    if sweep_param not in SWEEP_PARAMS:
+        raise ValueError("Unknown MACS2 sweep parameter: " + str(sweep_param))
+
+    broad = "--broad" in macs_params
+    if sweep_param == "broad-cutoff" and not broad:
+        raise ValueError("The broad-cutoff can only be swept when calling broad peaks")
+
+    if not isinstance(cutoffs, list):
+        cutoffs = [cutoff for cutoff in str(cutoffs).split(",") if cutoff.strip()]
+    cutoffs = [float(cutoff) for cutoff in cutoffs]
+
+    def _param_value(param):
+        """
+        Get the value of a parameter from the MACS2 parameters
+        """
+        flag = "--" + param
+        if flag in macs_params:
+            return float(macs_params[macs_params.index(flag) + 1])
+        return SWEEP_PARAMS[param]
+
+    if sweep_param == "broad-cutoff":
+        score = "p" if "--pvalue" in macs_params else "q"
+    else:
+        score = sweep_param[0]
+
+    return {
+        "param": sweep_param,
+        "cutoffs": [(sweep_tag(sweep_param, cutoff), cutoff) for cutoff in cutoffs],
+        "score": score,
+        "broad": broad,
+        "peak_cutoff": _param_value("pvalue" if score == "p" else "qvalue"),
+        "link_cutoff": _param_value("broad-cutoff")
+    }
+
+
+def sweep_tag(sweep_param, cutoff):
+    """
+    Generate the tag used to name the output files for a cutoff.
+
+    Parameters
+    ----------
+    sweep_param : str
+        The MACS2 parameter that is swept
+    cutoff : float
+        The cutoff value
+
+    Returns
+    -------
+    str
+        For example "q0.01" for a qvalue cutoff of 0.01
+    """
+    prefix = {"qvalue": "q", "pvalue": "p", "broad-cutoff": "bc"}[sweep_param]
+    return "{}{:g}".format(prefix, cutoff)
+
+
+def sweep_file_name(file_name, tag):
+    """
+    Generate the name of the output file for a cutoff by adding the tag before
+    the file extension.
+
+    Parameters
+    ----------
+    file_name : str
+        Location of the output file
+    tag : str
+        Tag for the cutoff generated by `sweep_tag`
+
+    Returns
+    -------
+    str
+    """
+    root, ext = os.path.splitext(file_name)
+    return root + "." + tag + ext
+
+
+def read_macs2_xls_sizes(xls_file):
+    """
+    Get the fragment size (d) and the tag size from the header of the MACS2
+    peaks xls file. These are used as the minimum length and the maximum gap
+    by MACS2 when calling the peaks.
+
+    Parameters
+    ----------
+    xls_file : str
+        Location of the MACS2 peaks xls file
+
+    Returns
+    -------
+    fragment_size : int
+    tag_size : int
+    """
+    fragment_size = 200
+    tag_size = 30
+    with open(xls_file, "r") as file_handle:
+        for line in file_handle:
+            if not line.startswith("#"):
+                break
+            match = re.match(r"# d = (\d+)", line)
+            if match:
+                fragment_size = int(match.group(1))
+            match = re.match(r"# (?:tag|fragment) size is determined as (\d+) bps", line)
+            if match:
+                tag_size = int(match.group(1))
+
+    return fragment_size, tag_size
+
+
+def _score(cutoff):
+    """
+    Convert a p or q value into the -log10 score used by the bedGraph files
+    """
+    return -math.log10(cutoff)
+
+
+def _run_macs2(args, limits):
+    """
+    Run a MACS2 sub command, raising an OSError if it fails
+    """
+    supervisor = ProcessSupervisor(limits)
+    if not supervisor.run(args, "MACS2 " + args[1]):
+        raise OSError(
+            supervisor.returncode,
+            "{} failed: {}".format(" ".join(args[:2]), supervisor.error_report()))
+
+
+def _remove_track_lines(peak_file):
+    """
+    Remove the UCSC track lines so that the files can be concatenated
+    """
+    with open(peak_file, "r") as file_handle:
+        lines = [line for line in file_handle if not line.startswith("track")]
+    with open(peak_file, "w") as file_handle:
+        file_handle.writelines(lines)
+
+
+def run_cutoff_sweep(output_prefix, sweep, sweep_files, limits=None):
+    """
+    Call the peaks for each cutoff in a sweep from the bedGraph files written
+    by `macs2 callpeak --bdg`. The score track is generated once with
+    `macs2 bdgcmp` and the peaks for each cutoff are then called from it with
+    `macs2 bdgpeakcall` or, for broad peaks, `macs2 bdgbroadcall`.
+
+    Parameters
+    ----------
+    output_prefix : str
+        Location and name used for the MACS2 callpeak output files
+    sweep : dict
+        Description of the sweep generated by `build_sweep`
+    sweep_files : dict
+        Location of the output file for each of the cutoff tags
+    limits : dict
+        Maximum "time" in seconds and "memory" in bytes for each of the MACS2
+        commands, see `ProcessSupervisor`
+    """
+    fragment_size, tag_size = read_macs2_xls_sizes(output_prefix + "_peaks.xls")
+
+    score_file = output_prefix + "_" + sweep["score"] + "score.bdg"
+    _run_macs2([
+        "macs2", "bdgcmp",
+        "-t", output_prefix + "_treat_pileup.bdg",
+        "-c", output_prefix + "_control_lambda.bdg",
+        "-m", sweep["score"] + "pois",
+        "-o", score_file
+    ], limits)
+
+    try:
+        for tag, cutoff in sweep["cutoffs"]:
+            if sweep["broad"]:
+                if sweep["param"] == "broad-cutoff":
+                    peak_cutoff, link_cutoff = sweep["peak_cutoff"], cutoff
+                else:
+                    peak_cutoff, link_cutoff = cutoff, sweep["link_cutoff"]
+                _run_macs2([
+                    "macs2", "bdgbroadcall",
+                    "-i", score_file,
+                    "-c", str(_score(peak_cutoff)),
+                    "-C", str(_score(link_cutoff)),
+                    "-l", str(fragment_size),
+                    "-g", str(tag_size),
+                    "-G", str(4 * fragment_size),
+                    "-o", sweep_files[tag]
+                ], limits)
+            else:
+                _run_macs2([
+                    "macs2", "bdgpeakcall",
+                    "-i", score_file,
+                    "-c", str(_score(cutoff)),
+                    "-l", str(fragment_size),
+                    "-g", str(tag_size),
+                    "--no-trackline",
+                    "-o", sweep_files[tag]
+                ], limits)
+            _remove_track_lines(sweep_files[tag])
+    finally:
+        os.remove(score_file)
+
+# ------------------------------------------------------------------------------
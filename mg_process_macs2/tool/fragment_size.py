@@ -0,0 +1,181 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pysam
+
+from utils import logger
+
+from mg_process_macs2.tool.supervisor import ProcessSupervisor
+
+# Parameters from callpeak that are also used by macs2 predictd
+PREDICTD_PARAMS = ["--gsize", "--tsize", "--bw", "--mfold"]
+
+# Smallest fragment size that is accepted, matching the MACS2 default
+MIN_FRAGMENT_SIZE = 20
+
+# Smallest number of +/- strand read pairs needed for the cross correlation
+MIN_READ_PAIRS = 1000
+
+
+# ------------------------------------------------------------------------------
+
+def predictd_fragment_size(bam_file, macs_params, limits=None):
+    """
+    Estimate the fragment size for the whole of a bam file using
+    `macs2 predictd`, which builds the same model as `macs2 callpeak`.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the bam file
+    macs_params : list
+        List of MACS2 parameters as generated by `Macs2.get_macs2_params`. The
+        parameters that are used to build the model are passed to predictd
+    limits : dict
+        Maximum "time" in seconds and "memory" in bytes for predictd, see
+        `ProcessSupervisor`
+
+    Returns
+    -------
+    int
+        The fragment size, None if MACS2 could not build a model
+    """
+    args = ["macs2", "predictd", "-i", bam_file, "-f", "BAM"]
+    for param in PREDICTD_PARAMS:
+        if param in macs_params:
+            args += [param] + str(macs_params[macs_params.index(param) + 1]).split()
+
+    supervisor = ProcessSupervisor(limits)
+    output_dir = tempfile.mkdtemp(prefix="macs2_predictd_")
+    try:
+        args += ["--outdir", output_dir]
+        completed = supervisor.run(args, "MACS2 predictd")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    if not completed:
+        logger.warn("MACS2 predictd " + supervisor.error_report())
+        return None
+
+    # The fragment size is reported at the end of the log
+    for line in supervisor.tail:
+        match = re.search(r"predicted fragment length is (\d+) bps", line)
+        if match is not None:
+            return int(match.group(1))
+
+    return None
+
+
+def cross_correlation_fragment_size(  # pylint: disable=too-many-locals
+        bam_file, bai_file, contigs, max_reads=1000000, max_shift=600):
+    """
+    Estimate the fragment size from the cross correlation of the 5' ends of
+    the reads on the forward and reverse strands.
+
+    The reads are sampled from the start of each contig in proportion to the
+    number of reads on the contig, so that the sampled regions have the same
+    read density as the whole file. The correlation at each shift is the
+    number of forward and reverse read pairs that are that distance apart. The
+    peak at the read length caused by mappability is ignored.
+
+    Parameters
+    ----------
+    bam_file : str
+        Location of the bam file
+    bai_file : str
+        Location of the bam index file
+    contigs : list
+        List of tuples of the form (contig, length, mapped_reads)
+    max_reads : int
+        Maximum number of reads to sample
+    max_shift : int
+        Largest fragment size that is considered
+
+    Returns
+    -------
+    int
+        The fragment size, None if there are not enough reads
+    """
+    total_reads = sum([contig[2] for contig in contigs])
+    if total_reads == 0:
+        return None
+
+    bam_handle = pysam.AlignmentFile(bam_file, "rb", index_filename=bai_file)
+
+    correlation = np.zeros(max_shift + 1, dtype=np.int64)
+    read_lengths = []
+    for contig, _length, mapped in contigs:
+        sample_size = int(max_reads * float(mapped) / total_reads)
+        if sample_size == 0:
+            continue
+
+        forward = []
+        reverse = []
+        for read in bam_handle.fetch(contig):
+            if read.is_unmapped or read.is_secondary or read.is_supplementary \
+                    or read.is_qcfail:
+                continue
+            if read.is_reverse:
+                reverse.append(read.reference_end - 1)
+            else:
+                forward.append(read.reference_start)
+            if len(read_lengths) < 1000:
+                read_lengths.append(read.query_alignment_length)
+            if len(forward) + len(reverse) >= sample_size:
+                break
+
+        if not forward or not reverse:
+            continue
+
+        forward = np.array(forward, dtype=np.int64)
+        reverse = np.sort(np.array(reverse, dtype=np.int64))
+
+        # Distances between each forward read and the reverse reads downstream
+        # of it that are within the maximum shift
+        first = np.searchsorted(reverse, forward, side="left")
+        last = np.searchsorted(reverse, forward + max_shift, side="right")
+        counts = last - first
+        if counts.sum() == 0:
+            continue
+        starts = np.repeat(first - np.cumsum(counts) + counts, counts)
+        reverse_index = np.arange(counts.sum()) + starts
+        distances = reverse[reverse_index] - np.repeat(forward, counts)
+        correlation += np.bincount(distances, minlength=max_shift + 1)[:max_shift + 1]
+
+    bam_handle.close()
+
+    if correlation.sum() < MIN_READ_PAIRS:
+        return None
+
+    # A distance of n between the 5' ends is a fragment of n + 1 bases
+    fragment_sizes = np.arange(1, max_shift + 2)
+    smoothed = np.convolve(correlation, np.ones(11) / 11.0, mode="same")
+
+    read_length = int(np.median(read_lengths))
+    excluded = (fragment_sizes < MIN_FRAGMENT_SIZE) | (
+        np.abs(fragment_sizes - read_length) <= 10)
+    smoothed[excluded] = -1
+
+    return int(fragment_sizes[np.argmax(smoothed)])
+
+# ------------------------------------------------------------------------------
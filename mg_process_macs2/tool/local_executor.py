@@ -0,0 +1,200 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import traceback
+
+# Seconds between the checks for completed jobs and lost worker processes
+POLL_INTERVAL = 0.1
+
+
+# ------------------------------------------------------------------------------
+
+def _call_job(func, args):
+    """
+    Run a job in the worker, returning any exception as a traceback so that
+    it can be passed back to the master process.
+    """
+    try:
+        return (True, func(*args))
+    except Exception:  # pylint: disable=broad-except
+        return (False, traceback.format_exc())
+
+
+class LocalExecutor(object):
+    """
+    Run jobs concurrently on the local machine in a pool of worker processes.
+
+    Used in place of the COMPSs runtime when the pipeline is run with
+    `--local`. The number of jobs that run at once is limited by the number
+    of workers and by the sum of the memory estimates of the running jobs.
+    The memory budget only controls which jobs are started, based on their
+    estimates; the memory that the jobs actually use is not checked.
+
+    If a worker process dies, for example because it was killed by the out of
+    memory killer, the run fails rather than waiting for the jobs that were
+    lost with it.
+    """
+
+    def __init__(self, workers=None, memory_budget=0):
+        """
+        Init function
+
+        Parameters
+        ----------
+        workers : int
+            Maximum number of jobs to run at once. Defaults to the number of
+            CPUs
+        memory_budget : int
+            Maximum total memory estimate, in bytes, of the jobs that are
+            running at once. A job is always started if nothing else is
+            running. 0 for no limit
+        """
+        if not workers:
+            workers = multiprocessing.cpu_count()
+
+        self.workers = int(workers)
+        self.memory_budget = int(memory_budget)
+
+    def _start_jobs(self, pool, func, jobs, next_job, running):
+        """
+        Start the next jobs while there are free workers and the memory
+        estimates fit in the budget.
+
+        Returns
+        -------
+        int
+            Index of the next job to start
+        """
+        while next_job < len(jobs) and len(running) < self.workers:
+            args, memory = jobs[next_job]
+            if running and self.memory_budget and \
+                    sum([job[0] for job in running.values()]) + memory > self.memory_budget:
+                break
+            running[next_job] = (memory, pool.apply_async(_call_job, (func, args)))
+            next_job += 1
+
+        return next_job
+
+    @staticmethod
+    def _wait_for_job(running, workers):
+        """
+        Wait for one of the running jobs to finish or for a worker process to
+        die.
+
+        Returns
+        -------
+        index : int
+            Index of the job that finished, None if a worker died
+        success : bool
+            True if the job returned a value
+        result
+            The value returned by the job, or the description of the error
+        """
+        while True:
+            for index in sorted(running):
+                if running[index][1].ready():
+                    async_result = running.pop(index)[1]
+                    try:
+                        success, result = async_result.get()
+                    except Exception:  # pylint: disable=broad-except
+                        success, result = False, traceback.format_exc()
+                    return index, success, result
+
+            # The pool replaces a worker that dies, but the job that it was
+            # running is lost and would never complete
+            for worker in workers:
+                if worker.exitcode is not None:
+                    return None, False, "Worker process {} exited with code {}".format(
+                        worker.pid, worker.exitcode)
+
+            running[min(running)][1].wait(POLL_INTERVAL)
+
+    def run(self, func, jobs, on_complete=None, on_error=None):
+        """
+        Run a set of jobs. The jobs are started in the order given.
+
+        If a job raises an exception or returns False, or a worker process
+        dies, then no more jobs are started and the jobs that are running are
+        stopped.
+
+        Parameters
+        ----------
+        func : function
+            Module level function that is run for each job
+        jobs : list
+            List of tuples of the form (args, memory) where args is the tuple
+            of arguments for `func` and memory is the estimate of the memory
+            in bytes required by the job
+        on_complete : function
+            Called in the master process with the index of the job and the
+            value returned by `func` as each job completes successfully
+        on_error : function
+            Called in the master process with the index of the job and the
+            description of the error when a job fails. If a worker process
+            dies then it is called for each of the jobs that were running
+
+        Returns
+        -------
+        list
+            The value returned by `func` for each job, None for jobs that did
+            not complete
+        error : str
+            Description of the first failure, None if all of the jobs completed
+        """
+        results = [None] * len(jobs)
+        if not jobs:
+            return results, None
+
+        pool = multiprocessing.Pool(processes=min(self.workers, len(jobs)))
+        workers = list(pool._pool)  # pylint: disable=protected-access
+
+        next_job = 0
+        running = {}
+        error = None
+        try:
+            while error is None and (next_job < len(jobs) or running):
+                next_job = self._start_jobs(pool, func, jobs, next_job, running)
+                index, success, result = self._wait_for_job(running, workers)
+
+                if index is None:
+                    error = result
+                    failed = sorted(running)
+                elif success is False or result is False:
+                    error = "Job {} failed:\n{}".format(index, result) if success is False \
+                        else "Job {} returned False".format(index)
+                    failed = [index]
+                else:
+                    results[index] = result
+                    if on_complete is not None:
+                        on_complete(index, result)
+                    continue
+
+                if on_error is not None:
+                    for failed_index in failed:
+                        on_error(failed_index, error)
+        finally:
+            if error is None:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+        return results, error
+
+# ------------------------------------------------------------------------------
@@ -17,8 +17,6 @@
 from __future__ import print_function
 
 import os
-import shlex
-import subprocess
 import sys
 
 from utils import logger
@@ -26,22 +24,20 @@ from utils import logger
 try:
     if hasattr(sys, '_run_from_cmdl') is True:
         raise ImportError
-    from pycompss.api.parameter import FILE_IN, FILE_OUT, IN
-    from pycompss.api.task import task
-    from pycompss.api.constraint import constraint
-    from pycompss.api.api import compss_wait_on, compss_open, compss_delete_file
+    from pycompss.api.api import compss_wait_on
 except ImportError:
     logger.warn("[Warning] Cannot import \"pycompss\" API packages.")
     logger.warn("          Using mock decorators.")
 
-    from utils.dummy_pycompss import FILE_IN, FILE_OUT, IN  # pylint: disable=ungrouped-imports
-    from utils.dummy_pycompss import task, constraint  # pylint: disable=ungrouped-imports
-    from utils.dummy_pycompss import compss_wait_on, compss_open, compss_delete_file  # pylint: disable=ungrouped-imports
+    from utils.dummy_pycompss import compss_wait_on  # pylint: disable=ungrouped-imports
 
-from basic_modules.metadata import Metadata
 from basic_modules.tool import Tool
 from mg_common.tool.bam_utils import bamUtilsTask
-from mg_common.tool.common import common
+
+from mg_process_macs2.tool.macs2_tasks import Macs2Tasks
+from mg_process_macs2.tool.macs2_runner import macs2_runner
+from mg_process_macs2.tool.result_cache import file_digest
+from mg_process_macs2.tool.treatment_run import PEAK_OUTPUTS, TreatmentRun
 
 
 # ------------------------------------------------------------------------------
@@ -49,6 +45,151 @@ from mg_common.tool.common import common
 class Macs2(Tool):
     """
     Tool for peak calling for ChIP-seq data
+
+    Along with the MACS2 parameters (see `get_macs2_params`) the following
+    configuration options control how the peak calling is run:
+
+    macs2_strategy : str
+        How the chromosomes are split into tasks. "configured" (default) uses
+        the batching and tiling options below. "auto" chooses from the number
+        of aligned reads, the number of chromosomes and the number of
+        workers, see `choose_strategy`. Bam files with few reads are run as a
+        single "whole_genome" MACS2 task without splitting the bam file,
+        otherwise the chromosomes are run "per_chromosome", in "batched"
+        groups of small chromosomes or with the large chromosomes "tiled".
+        Any of these can be given to use it whatever the size of the bam
+        file. "auto" uses the configured batching if any of the options below
+        are set. The choice is recorded as "strategy" in the metadata
+    macs2_workers : int
+        Number of tasks that can run at the same time, used by the strategies
+        other than "configured". Required when run with COMPSs, as the
+        resources of the workers are not known on the master. When run with
+        `--local` it defaults to `macs2_local_workers` or the number of CPUs
+    macs2_whole_genome_reads : int
+        Bam files with up to this number of aligned reads are run as a single
+        task by the "auto" strategy. Defaults to WHOLE_GENOME_READS
+    macs2_batch_by : str
+        Balance the batches of chromosomes run by a single MACS2 task by the
+        number of aligned "reads" (default) or the chromosome "length". If
+        this is set without `macs2_batch_size` then the batches hold up to
+        1,000,000 reads or 50,000,000 bases
+    macs2_batch_size : int
+        Target size of each batch of chromosomes. Chromosomes larger than this
+        are run as a task of their own. If neither this nor `macs2_batch_by`
+        is set, or it is 0, then each chromosome is run as a task of its own.
+        Batched chromosomes are peak called together by MACS2, which shares
+        its background lambda and model across the batch, so the peaks can
+        differ from those called for each chromosome on its own
+    macs2_input_mode : str
+        "split" (default) to write the reads for each task to a temporary bam
+        file, "presplit" to write the temporary bam files for all of the tasks
+        in a single pass over the bam file before the tasks are run or "fifo"
+        to stream them to MACS2 through a named pipe. "distributed" splits the
+        bam files on the master and passes each task only the files for its
+        batch, so that the whole bam file is not copied to every worker
+    macs2_backend : str
+        "subprocess" (default) to run the macs2 command line tool for each
+        task or "inprocess" to run MACS2 from Python in a long lived worker
+        process
+    macs2_time_limit : float
+        Maximum wall time in seconds of each macs2 process. A process that
+        runs for longer is stopped and its task fails. 0 (default) for no
+        limit. Applies to macs2 predictd and to the commands of the cutoff
+        sweep, and to macs2 callpeak with the "subprocess" backend
+    macs2_memory_limit : float
+        Maximum resident set size in GB of each macs2 process, checked while
+        it runs. 0 (default) for no limit. Applies to the same processes as
+        macs2_time_limit
+    macs2_scratch_dir : str
+        Directory for the intermediate files of each task, such as the split
+        bam files and the MACS2 output, ideally on node local storage or
+        tmpfs. Each task uses a private directory within it that is removed
+        when the task finishes. If it is not set, or does not have enough
+        free space for a task, then the directory of the bam file is used
+    macs2_local_workers : int
+        Number of tasks run at once when run with `--local`. Defaults to the
+        number of CPUs
+    macs2_local_memory : float
+        Memory budget in GB for the tasks that are running at once when run
+        with `--local`. 0 (default) for no limit
+    macs2_cache_dir : str
+        Directory used to cache the peak files for each batch of chromosomes
+        so that they are reused when the same bam files are run with the same
+        parameters. If not set then the results are not cached. The bam files
+        are identified by their SHA-256 digest, which is saved next to each
+        bam file with the suffix ".sha256" so that it is only generated again
+        when the file changes
+    macs2_cache_size : float
+        Maximum size of the cache in GB, the least recently used results are
+        removed first. 0 (default) for no limit
+    macs2_manifest : str
+        Location of the file recording the state of each task. Defaults to
+        the narrow peak output file with the suffix ".manifest.json". The file
+        is removed once the run has completed
+    macs2_resume : bool
+        If True then the tasks that completed in a previous failed run with
+        the same inputs and parameters are not run again, and the chromosomes
+        are batched and the fragment size is used as they were in that run.
+        Defaults to False
+    macs2_sweep_cutoffs : list
+        List, or comma separated string, of cutoffs to call peaks for in
+        addition to the main run. The pileup from the main run is reused so
+        MACS2 is only run once for each chromosome. Each cutoff generates a
+        narrow peak file, or for broad peaks a gapped peak file, with the
+        cutoff in the file name
+    macs2_sweep_param : str
+        The parameter that is swept, "qvalue" (default), "pvalue" or
+        "broad-cutoff"
+    macs2_fragment_model : str
+        How the fragment size is estimated for single end reads when the
+        model is not turned off with `macs_nomodel_param`. "predictd"
+        (default) runs the MACS2 model once over the whole bam file, "xcor"
+        uses the strand cross correlation of a sample of the reads and "task"
+        builds a model in each task. The estimated size is passed to the tasks
+        as `--nomodel --extsize` and recorded as "fragment_size" in the
+        metadata. It is kept in the result cache, if there is one, so that a
+        run whose peaks are all in the cache does not estimate it again
+    macs2_tile_reads : int
+        Chromosomes with more than this number of aligned reads are split
+        into overlapping tiles that are peak called as separate tasks. 0
+        (default) turns off tiling
+    macs2_tile_overlap : int
+        Number of bases that each tile overlaps its neighbours by. Peaks in
+        the overlap are kept by the tile that contains their summit. Defaults
+        to 10000
+    macs2_high_memory_threshold : float
+        Tasks with an estimated memory use above this (GB) request
+        HIGH_MEMORY_TASK_SIZE GB of memory and HIGH_MEMORY_TASK_CPUS CPUs from
+        COMPSs. Defaults to 4. The COMPSs constraints are fixed for each task
+        so there are only these two sizes of task: tasks estimated to need
+        more than HIGH_MEMORY_TASK_SIZE still request that much, and are
+        logged as they may run out of memory, while tasks just over the
+        threshold request more than they need. The tasks are started in order
+        of decreasing number of reads. This is not used in the "distributed"
+        input mode
+    macs2_peak_sets : bool
+        If True then a binary sidecar file with the suffix ".peakset" is
+        written next to each of the output files so that the peaks can be
+        loaded with `PeakSet.load` without parsing the BED file. For
+        compressed outputs it is built from, and named after, the compressed
+        file. The location is recorded as "peak_set" in the metadata.
+        Defaults to False
+    macs2_compress_outputs : bool
+        If True then the merged output files are sorted, compressed with BGZF
+        and indexed with tabix, adding the suffix ".gz". The metadata records
+        "compressed" as "gzip" and the location of the index as
+        "tabix_index". Defaults to False
+    macs2_profile : str
+        Location of a JSON file for the wall time, CPU time, peak memory of
+        MACS2 and the bytes read and written by each stage of the run and
+        each task. A summary for each stage is always recorded as "profile"
+        in the metadata of the output files
+    macs2_trace : str
+        Location of a JSON file for a timeline of the stages of the run and of
+        each task in the Chrome trace event format, which can be loaded into
+        chrome://tracing or https://ui.perfetto.dev to see how the tasks
+        overlapped on each worker. The location is recorded as "trace_file"
+        in the metadata. Not written by default
     """
 
     def __init__(self, configuration=None):
@@ -63,255 +204,6 @@ class Macs2(Tool):
 
         self.configuration.update(configuration)
 
-    @staticmethod
-    def _macs2_runner(  # pylint: disable=too-many-locals,too-many-statements,too-many-statements,too-many-arguments
-            name, bam_file, bai_file, macs_params,
-            narrowpeak, summits_bed, broadpeak, gappedpeak,
-            chromosome=None, bam_file_bgd=None, bai_file_bgd=None):
-        """
-        Function to run MACS2 for peak calling on aligned sequence files and
-        normalised against a provided background set of alignments.
-
-        Parameters
-        ----------
-        name : str
-            Name to be used to identify the files
-        bam_file : str
-            Location of the aligned FASTQ files as a bam file
-        bai_file : str
-            Location of the bam index file
-        narrowpeak : str
-            Location of the output narrowpeak file
-        summits_bed : str
-            Location of the output summits bed file
-        broadpeak : str
-            Location of the output broadpeak file
-        gappedpeak : str
-            Location of the output gappedpeak file
-        chromosome : str
-            If the tool is to be run over a single chromosome the matching
-            chromosome name should be specified. If None then the whole bam file
-            is analysed
-        bam_file_bgd : str
-            Location of the aligned FASTQ files as a bam file representing
-            background values for the cell
-        bai_file_bgd : str
-            Location of the background bam index file
-
-        Returns
-        -------
-        narrowPeak : file
-            BED6+4 file - ideal for transcription factor binding site
-            identification
-        summitPeak : file
-            BED4+1 file - Contains the peak summit locations for everypeak
-        broadPeak : file
-            BED6+3 file - ideal for histone binding site identification
-        gappedPeak : file
-            BED12+3 file - Contains a merged set of the broad and narrow peak
-            files
-
-        Definitions defined for each of these files have come from the MACS2
-        documentation described in the docs at https://github.com/taoliu/MACS
-        """
-        od_list = bam_file.split("/")
-        output_dir = "/".join(od_list[0:-1])
-
-        from mg_common.tool.bam_utils import bamUtils
-
-        bam_tmp_file = bam_file.replace(".bam", "." + str(chromosome) + ".bam")
-        bam_utils_handle = bamUtils()
-        bam_utils_handle.bam_split(bam_file, bai_file, chromosome, bam_tmp_file)
-        common_handle = common()
-
-        # Test to see if the bam file contains paired end reads
-        if bam_utils_handle.bam_paired_reads(bam_file):
-            macs_params.append(["--format", "BAMPE"])
-
-        command_param = [
-            'macs2 callpeak',
-            " ".join(macs_params),
-            '-t', bam_tmp_file,
-            '-n', name
-        ]
-        if bam_file_bgd is not None:
-            bam_bgd_tmp_file = bam_file_bgd.replace(".bam", "." + str(chromosome) + ".bam")
-            bam_utils_handle.bam_split(bam_file_bgd, bai_file_bgd, chromosome, bam_bgd_tmp_file)
-
-            bgd_command = '-c ' + bam_bgd_tmp_file
-            command_param.append(bgd_command)
-
-        command_param.append('--outdir ' + output_dir)
-        command_line = ' '.join(command_param)
-
-        if int(bam_utils_handle.bam_count_reads(bam_tmp_file, aligned=True)) > 0:
-            try:
-                args = shlex.split(command_line)
-                process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                proc_out, proc_err = process.communicate()
-            except (IOError, OSError) as msg:
-                logger.fatal("I/O error({0}): {1}\n{2}".format(
-                    msg.errno, msg.strerror, command_line))
-                return False
-
-            if process.returncode is not 0:
-                logger.fatal("MACS2 ERROR: " + str(process.returncode))
-                logger.fatal(
-                    "MACS2 ERROR: BAM counts: " + str(
-                        bam_utils_handle.bam_count_reads(bam_tmp_file, aligned=True)
-                    )
-                )
-                logger.fatal("\n\nMACS2 ERROR - out:\n\t" + str(proc_out))
-                logger.fatal("\n\nMACS2 ERROR - err:\n\t" + str(proc_err))
-
-            logger.info('Process Results 1:', process)
-
-        logger.info('LIST DIR 1:', os.listdir(output_dir))
-
-        output_tmp = output_dir + '/{}_{}'
-        common_handle.to_output_file(output_tmp.format(name, 'peaks.narrowPeak'), narrowpeak)
-        common_handle.to_output_file(output_tmp.format(name, 'peaks.broadPeak'), broadpeak)
-        common_handle.to_output_file(output_tmp.format(name, 'peaks.gappedPeak'), gappedpeak)
-        common_handle.to_output_file(output_tmp.format(name, 'summits.bed'), summits_bed)
-
-        return True
-
-    @constraint(ComputingUnits="1")
-    @task(
-        returns=bool,
-        name=IN,
-        bam_file=FILE_IN,
-        bai_file=FILE_IN,
-        bam_file_bgd=FILE_IN,
-        bai_file_bgd=FILE_IN,
-        macs_params=IN,
-        narrowpeak=FILE_OUT,
-        summits_bed=FILE_OUT,
-        broadpeak=FILE_OUT,
-        gappedpeak=FILE_OUT,
-        chromosome=IN,
-        isModifier=False)
-    def macs2_peak_calling(  # pylint: disable=no-self-use,too-many-arguments
-            self, name, bam_file, bai_file, bam_file_bgd, bai_file_bgd, macs_params,
-            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome):  # pylint: disable=unused-argument
-        """
-        Function to run MACS2 for peak calling on aligned sequence files and
-        normalised against a provided background set of alignments.
-
-        Parameters
-        ----------
-        name : str
-            Name to be used to identify the files
-        bam_file : str
-            Location of the aligned FASTQ files as a bam file
-        bai_file : str
-            Location of the bam index file
-        bam_file_bgd : str
-            Location of the aligned FASTQ files as a bam file representing
-            background values for the cell
-        bai_file_bgd : str
-            Location of the background bam index file
-        narrowpeak : str
-            Location of the output narrowpeak file
-        summits_bed : str
-            Location of the output summits bed file
-        broadpeak : str
-            Location of the output broadpeak file
-        gappedpeak : str
-            Location of the output gappedpeak file
-        chromosome : str
-            If the tool is to be run over a single chromosome the matching
-            chromosome name should be specified. If None then the whole bam file
-            is analysed
-
-        Returns
-        -------
-        narrowPeak : file
-            BED6+4 file - ideal for transcription factor binding site
-            identification
-        summitPeak : file
-            BED4+1 file - Contains the peak summit locations for everypeak
-        broadPeak : file
-            BED6+3 file - ideal for histone binding site identification
-        gappedPeak : file
-            BED12+3 file - Contains a merged set of the broad and narrow peak
-            files
-
-        Definitions defined for each of these files have come from the MACS2
-        documentation described in the docs at https://github.com/taoliu/MACS
-        """
-
-        self._macs2_runner(
-            name, bam_file, bai_file, macs_params,
-            narrowpeak, summits_bed, broadpeak, gappedpeak,
-            chromosome, bam_file_bgd, bai_file_bgd)
-
-        return True
-
-    @constraint(ComputingUnits="1")
-    @task(
-        returns=bool,
-        name=IN,
-        bam_file=FILE_IN,
-        bai_file=FILE_IN,
-        macs_params=IN,
-        narrowpeak=FILE_OUT,
-        summits_bed=FILE_OUT,
-        broadpeak=FILE_OUT,
-        gappedpeak=FILE_OUT,
-        chromosome=IN,
-        isModifier=False)
-    def macs2_peak_calling_nobgd(  # pylint: disable=too-many-arguments,no-self-use,too-many-branches
-            self, name, bam_file, bai_file, macs_params,
-            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome):  # pylint: disable=unused-argument
-        """
-        Function to run MACS2 for peak calling on aligned sequence files without
-        a background dataset for normalisation.
-
-        Parameters
-        ----------
-        name : str
-            Name to be used to identify the files
-        bam_file : str
-            Location of the aligned FASTQ files as a bam file
-        bai_file : str
-            Location of the bam index file
-        narrowpeak : str
-            Location of the output narrowpeak file
-        summits_bed : str
-            Location of the output summits bed file
-        broadpeak : str
-            Location of the output broadpeak file
-        gappedpeak : str
-            Location of the output gappedpeak file
-        chromosome : str
-            If the tool is to be run over a single chromosome the matching
-            chromosome name should be specified. If None then the whole bam file
-            is analysed
-
-        Returns
-        -------
-        narrowPeak : file
-            BED6+4 file - ideal for transcription factor binding site
-            identification
-        summitPeak : file
-            BED4+1 file - Contains the peak summit locations for everypeak
-        broadPeak : file
-            BED6+3 file - ideal for histone binding site identification
-        gappedPeak : file
-            BED12+3 file - Contains a merged set of the broad and narrow peak
-            files
-
-        Definitions defined for each of these files have come from the MACS2
-        documentation described in the docs at https://github.com/taoliu/MACS
-        """
-        self._macs2_runner(
-            name, bam_file, bai_file, macs_params,
-            narrowpeak, summits_bed, broadpeak, gappedpeak,
-            chromosome)
-
-        return True
-
     @staticmethod
     def get_macs2_params(params):
         """
@@ -365,7 +257,116 @@ class Macs2(Tool):
 
         return command_params
 
-    def run(self, input_files, input_metadata, output_files):  # pylint: disable=too-many-locals,too-many-statements,too-many-branches
+    @staticmethod
+    def _macs2_runner(  # pylint: disable=too-many-arguments
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome=None, bam_file_bgd=None, bai_file_bgd=None):
+        """
+        Deprecated, use `mg_process_macs2.tool.macs2_runner.macs2_runner`.
+
+        Returns
+        -------
+        list
+            Profile records of the stages of the run, see `macs2_runner`
+        """
+        logger.warn("MACS2: Macs2._macs2_runner is deprecated, use macs2_runner")
+        return macs2_runner(
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_file_bgd, bai_file_bgd)
+
+    def macs2_peak_calling(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_file, bai_file, bam_file_bgd, bai_file_bgd, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome):
+        """
+        Deprecated, use `Macs2Tasks.macs2_peak_calling`.
+
+        Returns
+        -------
+        list
+            Profile records of the stages of the task, see `macs2_runner`
+        """
+        logger.warn("MACS2: Macs2.macs2_peak_calling is deprecated, use Macs2Tasks")
+        return Macs2Tasks().macs2_peak_calling(
+            name, bam_file, bai_file, bam_file_bgd, bai_file_bgd, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome)
+
+    def macs2_peak_calling_nobgd(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome):
+        """
+        Deprecated, use `Macs2Tasks.macs2_peak_calling_nobgd`.
+
+        Returns
+        -------
+        list
+            Profile records of the stages of the task, see `macs2_runner`
+        """
+        logger.warn("MACS2: Macs2.macs2_peak_calling_nobgd is deprecated, use Macs2Tasks")
+        return Macs2Tasks().macs2_peak_calling_nobgd(
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome)
+
+    def _prepare_control(self, bam_file_bgd, split=False):
+        """
+        Prepare a background bam file so that it can be shared by the peak
+        calling for several treatment bam files. The file is indexed and
+        profiled once, and if `split` is True then it is split into a bam file
+        per chromosome that each of the peak calling tasks reuse.
+
+        Parameters
+        ----------
+        bam_file_bgd : str
+            Location of the background bam file
+        split : bool
+            Split the file into a bam file per chromosome. This is not done
+            when the "fifo" input mode is used
+
+        Returns
+        -------
+        dict
+            bam : str
+                Location of the background bam file
+            bai : str
+                Location of the background bam index file
+            profile : dict
+                Profile of the background bam file, see `build_bam_profile`
+            slices : dict
+                Location of the bam file for each chromosome, None if the file
+                was not split
+            digest : str
+                Digest of the file if the results are being cached
+        """
+        bai_file_bgd = bam_file_bgd + '.bai'
+
+        bam_utils_handle = bamUtilsTask()
+        bam_utils_handle.bam_index(bam_file_bgd, bai_file_bgd)
+
+        macs2_tasks = Macs2Tasks()
+        control = {
+            "bam": bam_file_bgd,
+            "bai": bai_file_bgd,
+            "profile": compss_wait_on(macs2_tasks.macs2_bam_profile(bam_file_bgd, bai_file_bgd)),
+            "slices": None,
+            "digest": None
+        }
+
+        if split and self.configuration.get("macs2_input_mode", "split") in (
+                "split", "presplit", "distributed"):
+            control["slices"] = dict([
+                (contig, bam_file_bgd.replace(".bam", "." + contig + ".control.bam"))
+                for contig, _length, mapped, _unmapped in control["profile"]["contigs"]
+                if mapped > 0
+            ])
+            compss_wait_on(macs2_tasks.macs2_split_control(bam_file_bgd, control["slices"]))
+
+        if self.configuration.get("macs2_cache_dir"):
+            control["digest"] = file_digest(bam_file_bgd)
+
+        return control
+
+    def run(self, input_files, input_metadata, output_files):
         """
         The main function to run MACS 2 for peak calling over a given BAM file
         and matching background BAM file.
@@ -386,138 +387,105 @@ class Macs2(Tool):
             List of matching metadata dict objects
 
         """
-        root_name = os.path.split(input_files['bam'])
-        name = root_name[1].replace('.bam', '')
-
-        # input and output share most metadata
-        output_bed_types = {
-            'narrow_peak': "bed4+1",
-            'summits': "bed6+4",
-            'broad_peak': "bed6+3",
-            'gapped_peak': "bed12+3"
-        }
+        control = None
+        if 'bam_bg' in input_files:
+            control = self._prepare_control(input_files['bam_bg'])
+
+        treatment_run = TreatmentRun(self.configuration, input_files, control)
+        return treatment_run.run(
+            input_metadata, output_files, self.get_macs2_params(self.configuration))
 
-        for k in output_bed_types:
-            if output_files[k] is None:
-                output_files[k] = os.path.join(
-                    self.configuration['execution'], name + "_" + k + ".bed")
+    def run_batch(self, input_files, input_metadata, output_files):
+        """
+        Run MACS 2 for peak calling over a set of treatment BAM files that
+        share background BAM files.
 
-        command_params = self.get_macs2_params(self.configuration)
+        Each background BAM file is indexed, profiled and, if it is used by
+        more than one treatment, split by chromosome once. The peak calling
+        for each of the treatments then reuses these files.
 
-        bam_utils_handle = bamUtilsTask()
-        bam_utils_handle.bam_index(
-            input_files['bam'],
-            input_files['bam'] + '.bai'
-        )
-        if 'bam_bg' in input_files:
-            bam_utils_handle.bam_index(
-                input_files['bam_bg'],
-                input_files['bam_bg'] + '.bai'
-            )
-
-        chr_list = bam_utils_handle.bam_list_chromosomes(input_files['bam'])
-        chr_list = compss_wait_on(chr_list)
-
-        logger.info("MACS2 COMMAND PARAMS: " + ", ".join(command_params))
-
-        chr_dict = {}
-        for chromosome in chr_list:
-            chr_dict[chromosome] = chromosome.replace("|", "_")
-
-        for chromosome in chr_dict:
-            if 'bam_bg' in input_files:
-                result = self.macs2_peak_calling(
-                    name + "." + str(chromosome),
-                    str(input_files['bam']), str(input_files['bam']) + '.bai',
-                    str(input_files['bam_bg']), str(input_files['bam_bg']) + '.bai',
-                    command_params,
-                    str(output_files['narrow_peak']) + "." + str(chr_dict[chromosome]),
-                    str(output_files['summits']) + "." + str(chr_dict[chromosome]),
-                    str(output_files['broad_peak']) + "." + str(chr_dict[chromosome]),
-                    str(output_files['gapped_peak']) + "." + str(chr_dict[chromosome]),
-                    chromosome)
-            else:
-                result = self.macs2_peak_calling_nobgd(
-                    name + "." + str(chromosome),
-                    str(input_files['bam']), str(input_files['bam']) + '.bai',
-                    command_params,
-                    str(output_files['narrow_peak']) + "." + str(chr_dict[chromosome]),
-                    str(output_files['summits']) + "." + str(chr_dict[chromosome]),
-                    str(output_files['broad_peak']) + "." + str(chr_dict[chromosome]),
-                    str(output_files['gapped_peak']) + "." + str(chr_dict[chromosome]),
-                    chromosome)
-
-            if result is False:
-                logger.fatal("MACS2: Something went wrong with the peak calling")
-
-        # Merge the results files into single files.
-        with open(output_files['narrow_peak'], 'wb') as file_np_handle:
-            with open(output_files['summits'], 'wb') as file_s_handle:
-                with open(output_files['broad_peak'], 'wb') as file_bp_handle:
-                    with open(output_files['gapped_peak'], 'wb') as file_gp_handle:
-                        for chromosome in chr_dict:
-                            np_file_chr = "{}.{}".format(
-                                output_files['narrow_peak'], chr_dict[chromosome])
-                            s_file_chr = "{}.{}".format(
-                                output_files['summits'], chr_dict[chromosome])
-                            bp_file_chr = "{}.{}".format(
-                                output_files['broad_peak'], chr_dict[chromosome])
-                            gp_file_chr = "{}.{}".format(
-                                output_files['gapped_peak'], chr_dict[chromosome])
-                            if hasattr(sys, '_run_from_cmdl') is True:
-                                with open(np_file_chr, 'rb') as file_in_handle:
-                                    file_np_handle.write(file_in_handle.read())
-                                with open(s_file_chr, 'rb') as file_in_handle:
-                                    file_s_handle.write(file_in_handle.read())
-                                with open(bp_file_chr, 'rb') as file_in_handle:
-                                    file_bp_handle.write(file_in_handle.read())
-                                with open(gp_file_chr, 'rb') as file_in_handle:
-                                    file_gp_handle.write(file_in_handle.read())
-                            else:
-                                with compss_open(np_file_chr, 'rb') as file_in_handle:
-                                    file_np_handle.write(file_in_handle.read())
-                                with compss_open(s_file_chr, 'rb') as file_in_handle:
-                                    file_s_handle.write(file_in_handle.read())
-                                with compss_open(bp_file_chr, 'rb') as file_in_handle:
-                                    file_bp_handle.write(file_in_handle.read())
-                                with compss_open(gp_file_chr, 'rb') as file_in_handle:
-                                    file_gp_handle.write(file_in_handle.read())
-                                compss_delete_file(np_file_chr)
-                                compss_delete_file(s_file_chr)
-                                compss_delete_file(bp_file_chr)
-                                compss_delete_file(gp_file_chr)
-
-        output_files_created = {}
-        output_metadata = {}
-        for result_file in output_files:
-            if (
-                    os.path.isfile(output_files[result_file]) is True
-                    and os.path.getsize(output_files[result_file]) > 0
-            ):
-                output_files_created[result_file] = output_files[result_file]
-
-                sources = [input_metadata["bam"].file_path]
-                if 'bam_bg' in input_files:
-                    sources.append(input_metadata["bam_bg"].file_path)
-
-                output_metadata[result_file] = Metadata(
-                    data_type="data_chip_seq",
-                    file_type="BED",
-                    file_path=output_files[result_file],
-                    sources=sources,
-                    taxon_id=input_metadata["bam"].taxon_id,
-                    meta_data={
-                        "assembly": input_metadata["bam"].meta_data["assembly"],
-                        "tool": "macs2",
-                        "bed_type": output_bed_types[result_file],
-                        "parameters": command_params
-                    }
-                )
-            else:
-                os.remove(output_files[result_file])
-
-        logger.info('MACS2: GENERATED FILES: ', ' '.join(output_files))
-
-        return (output_files_created, output_metadata)
+        Parameters
+        ----------
+        input_files : dict
+            bam : list
+                List of the treatment bam file locations
+            bam_bg : str or list
+                Location of the background bam file shared by all of the
+                treatments, or a list with the background bam file for each
+                treatment. Optional
+        input_metadata : dict
+            bam : list
+                List of the matching metadata for the treatment bam files
+            bam_bg : Metadata or list
+                Matching metadata for the background bam files
+        output_files : dict
+            Lists of the output file locations for each of the treatments
+            indexed by output type. If a list is not given for an output type
+            then the files are named after the treatment bam files
+
+        Returns
+        -------
+        output_files : dict
+            Lists of the locations of the output files indexed by output type.
+            Each list has an entry for each of the treatments, which is None if
+            the peak calling for the treatment did not generate that output
+        output_metadata : dict
+            Lists of the matching metadata indexed by output type, None where
+            there is no output file
+        """
+        treatments = input_files['bam']
+        controls = input_files.get('bam_bg')
+        controls_metadata = input_metadata.get('bam_bg')
+        if not isinstance(controls, list):
+            controls = [controls] * len(treatments)
+            controls_metadata = [controls_metadata] * len(treatments)
+
+        prepared_controls = {}
+        for control in controls:
+            if control is not None and control not in prepared_controls:
+                prepared_controls[control] = self._prepare_control(
+                    control, split=controls.count(control) > 1)
+
+        treatment_results = []
+        for index, treatment in enumerate(treatments):
+            treatment_files = {'bam': treatment}
+            treatment_metadata = {'bam': input_metadata['bam'][index]}
+            if controls[index] is not None:
+                treatment_files['bam_bg'] = controls[index]
+                treatment_metadata['bam_bg'] = controls_metadata[index]
+
+            treatment_outputs = {}
+            for output_type in PEAK_OUTPUTS:
+                treatment_outputs[output_type] = None
+                if isinstance(output_files.get(output_type), list):
+                    treatment_outputs[output_type] = output_files[output_type][index]
+
+            treatment_run = TreatmentRun(
+                self.configuration, treatment_files, prepared_controls.get(controls[index]))
+            treatment_results.append(treatment_run.run(
+                treatment_metadata, treatment_outputs,
+                self.get_macs2_params(self.configuration)))
+
+        for control in prepared_controls.values():
+            for control_slice in (control["slices"] or {}).values():
+                if os.path.isfile(control_slice):
+                    os.remove(control_slice)
+
+        # Each list has an entry for every treatment, in the order of the
+        # treatments, so that the outputs can be matched to their treatment
+        output_types = sorted(set([
+            output_type for result_files, _ in treatment_results for output_type in result_files
+        ]))
+        batch_files = dict([
+            (output_type, [result_files.get(output_type) for result_files, _ in treatment_results])
+            for output_type in output_types
+        ])
+        batch_metadata = dict([
+            (output_type, [
+                result_metadata.get(output_type) for _, result_metadata in treatment_results])
+            for output_type in output_types
+        ])
+
+        return (batch_files, batch_metadata)
 
 # ------------------------------------------------------------------------------
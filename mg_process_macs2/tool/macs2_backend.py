@@ -0,0 +1,180 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import atexit
+import multiprocessing
+import os
+import runpy
+import sys
+import sysconfig
+import threading
+import traceback
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which  # pylint: disable=ungrouped-imports
+
+# MACS2 argument parser and callpeak function, loaded once per process
+_MACS2 = {}
+
+# Worker process that runs the MACS2 jobs for this process
+_WORKER = {}
+_WORKER_LOCK = threading.Lock()
+
+
+# ------------------------------------------------------------------------------
+
+def _macs2_script_parser():
+    """
+    Get the `prepare_argparser` function from the `macs2` script.
+
+    MACS2 2.x defines the parser in the script rather than in the package. The
+    script installed with the package for the current interpreter is used
+    first, and the one on the PATH only if it is the MACS2 script itself
+    rather than a wrapper, such as a console_scripts entry point or a conda
+    shim, which cannot be loaded.
+
+    Returns
+    -------
+    function
+        The MACS2 `prepare_argparser` function
+    """
+    candidates = [
+        os.path.join(sysconfig.get_path("scripts"), "macs2"),
+        os.path.join(os.path.dirname(sys.executable), "macs2"),
+        which("macs2")
+    ]
+    for macs2_script in candidates:
+        if macs2_script is None or not os.path.isfile(macs2_script):
+            continue
+        with open(macs2_script, "rb") as script_handle:
+            if b"def prepare_argparser" not in script_handle.read():
+                continue
+        return runpy.run_path(macs2_script, run_name="macs2_cli")["prepare_argparser"]
+
+    raise OSError("Cannot find the MACS2 command line parser")
+
+
+def _load_macs2():
+    """
+    Load the MACS2 command line parser and the callpeak function.
+
+    The callpeak function is imported from the MACS2 package, as is the parser
+    if the package provides it. Otherwise the parser is loaded from the
+    `macs2` script without running it, see `_macs2_script_parser`. Either way
+    the parameters are handled exactly as they are by the command line tool.
+
+    Returns
+    -------
+    argparser : ArgumentParser
+        The MACS2 command line parser
+    run : function
+        The MACS2 callpeak function
+    """
+    if not _MACS2:
+        from MACS2.callpeak_cmd import run  # pylint: disable=import-error
+
+        try:
+            from MACS2.__main__ import prepare_argparser  # pylint: disable=import-error
+        except ImportError:
+            prepare_argparser = _macs2_script_parser()
+
+        _MACS2["argparser"] = prepare_argparser()
+        _MACS2["run"] = run
+
+    return _MACS2["argparser"], _MACS2["run"]
+
+
+def _callpeak(args):
+    """
+    Run MACS2 callpeak in the current process.
+
+    Parameters
+    ----------
+    args : list
+        The arguments that would be given to the `macs2` command line tool,
+        starting with "callpeak"
+
+    Returns
+    -------
+    returncode : int
+        0 if MACS2 completed, otherwise the exit code from MACS2 or 1
+    message : str
+        Description of the error
+    """
+    try:
+        argparser, run = _load_macs2()
+        options = argparser.parse_args(args)
+        if options.outdir and not os.path.exists(options.outdir):
+            os.makedirs(options.outdir)
+        run(options)
+    except SystemExit as msg:
+        if msg.code is None or msg.code == 0:
+            return (0, "")
+        if isinstance(msg.code, int):
+            return (msg.code, "MACS2 exited with code " + str(msg.code))
+        return (1, str(msg.code))
+    except Exception:  # pylint: disable=broad-except
+        return (1, traceback.format_exc())
+
+    return (0, "")
+
+
+def _get_worker():
+    """
+    Get the worker process for the current process, starting it if required.
+    The worker is started once and then used for all of the MACS2 jobs so that
+    MACS2 is only imported once.
+    """
+    with _WORKER_LOCK:
+        if _WORKER.get("pid") != os.getpid():
+            _WORKER["pool"] = multiprocessing.Pool(processes=1)
+            _WORKER["pid"] = os.getpid()
+            atexit.register(_WORKER["pool"].terminate)
+
+    return _WORKER["pool"]
+
+
+def callpeak_in_process(args):
+    """
+    Run MACS2 callpeak using the MACS2 Python package in a long lived worker
+    process rather than starting the `macs2` command line tool.
+
+    Daemonic processes, such as pool workers, are not able to start a worker
+    so the job is run in the current process instead.
+
+    Parameters
+    ----------
+    args : list
+        The arguments that would be given to the `macs2` command line tool,
+        starting with "callpeak"
+
+    Returns
+    -------
+    returncode : int
+        0 if MACS2 completed, otherwise the exit code from MACS2 or 1
+    message : str
+        Description of the error
+    """
+    if multiprocessing.current_process().daemon:
+        return _callpeak(args)
+
+    return _get_worker().apply(_callpeak, (args,))
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,510 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import shlex
+import tempfile
+
+from utils import logger
+
+from mg_process_macs2.tool.bam_regions import (
+    build_bam_profile, contig_region, profile_mapped_reads, bam_split_contigs)
+from mg_process_macs2.tool.bam_stream import BamFifo, bam_read_length
+from mg_process_macs2.tool.cutoff_sweep import run_cutoff_sweep
+from mg_process_macs2.tool.macs2_backend import callpeak_in_process
+from mg_process_macs2.tool.peak_files import filter_peaks_to_tiles
+from mg_process_macs2.tool.profiling import StageProfiler
+from mg_process_macs2.tool.result_cache import ResultCache
+from mg_process_macs2.tool.scheduling import batch_label
+from mg_process_macs2.tool.scratch import ScratchSpace, scratch_location
+from mg_process_macs2.tool.supervisor import ProcessSupervisor
+
+
+# ------------------------------------------------------------------------------
+
+def set_macs2_param(macs_params, param, value):
+    """
+    Set the value of a MACS2 parameter, replacing any value that is
+    already in the list of parameters.
+
+    Parameters
+    ----------
+    macs_params : list
+        List of MACS2 parameters and values as generated by
+        `Macs2.get_macs2_params`
+    param : str
+        Name of the MACS2 parameter
+    value : str
+        Value for the parameter
+
+    Returns
+    -------
+    list
+        New list of MACS2 parameters
+    """
+    new_params = []
+    skip_value = False
+    for macs_param in macs_params:
+        if skip_value:
+            skip_value = False
+            continue
+        if macs_param == param:
+            skip_value = True
+            continue
+        new_params.append(macs_param)
+
+    return new_params + [param, value]
+
+
+def control_slice_files(control_slices, chromosomes):
+    """
+    Get the shared background bam files for a batch of chromosomes.
+
+    Parameters
+    ----------
+    control_slices : dict
+        Location of the background bam file for each chromosome as
+        generated by `Macs2Tasks.macs2_split_control`
+    chromosomes : list
+        List of the chromosomes or tiles in the batch
+
+    Returns
+    -------
+    list
+        Locations of the background bam files for the batch. None if the
+        files do not cover the batch, for example for a tile of a
+        chromosome
+    """
+    if control_slices is None:
+        return None
+
+    for chromosome in chromosomes:
+        if contig_region(chromosome)[1] is not None or chromosome not in control_slices:
+            return None
+
+    return [control_slices[chromosome] for chromosome in chromosomes]
+
+
+def order_by_contig(peak_file, chromosomes):
+    """
+    Reorder the records in a MACS2 output file generated for a batch of
+    chromosomes so that they are grouped by chromosome in the order of the
+    batch. The records for each chromosome are kept in the order that MACS2
+    wrote them.
+
+    Parameters
+    ----------
+    peak_file : str
+        Location of the MACS2 output file
+    chromosomes : list
+        List of the chromosome names in the batch
+    """
+    if not os.path.isfile(peak_file):
+        return
+
+    contigs = [contig_region(chromosome)[0] for chromosome in chromosomes]
+    contig_lines = dict([(contig, []) for contig in contigs])
+    other_lines = []
+    with open(peak_file, 'rb') as file_in_handle:
+        for line in file_in_handle:
+            contig = line.split(b"\t", 1)[0].decode("utf-8")
+            if contig in contig_lines:
+                contig_lines[contig].append(line)
+            else:
+                other_lines.append(line)
+
+    with open(peak_file, 'wb') as file_out_handle:
+        for contig in contigs:
+            file_out_handle.writelines(contig_lines[contig])
+        file_out_handle.writelines(other_lines)
+
+
+def task_output_files(peak_files, macs_params, sweep=None):
+    """
+    Get the files written by a peak calling task and the parameters that
+    identify its results in the result cache.
+
+    Parameters
+    ----------
+    peak_files : list
+        Locations of the narrow peak, summits, broad peak and gapped peak
+        files for the task
+    macs_params : list
+        List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+    sweep : dict
+        Cutoff sweep as generated by `build_sweep`, None if there is no sweep
+
+    Returns
+    -------
+    output_files : dict
+        Location of each of the files written by the task indexed by the
+        type of file
+    sweep_files : dict
+        Location of the peak file for each cutoff of the sweep indexed by
+        the tag for the cutoff
+    cache_params : list
+        The MACS2 parameters along with the tags of the sweep
+    """
+    output_files = dict(zip(["narrowPeak", "summits.bed", "broadPeak", "gappedPeak"], peak_files))
+
+    sweep_files = {}
+    cache_params = macs_params
+    if sweep is not None:
+        sweep_type = "gappedPeak" if sweep["broad"] else "narrowPeak"
+        for tag, _cutoff in sweep["cutoffs"]:
+            sweep_files[tag] = output_files[sweep_type] + "." + tag
+            output_files[sweep_type + "." + tag] = sweep_files[tag]
+        cache_params = macs_params + ["--sweep", ",".join(sorted(sweep_files))]
+
+    return output_files, sweep_files, cache_params
+
+
+def fetch_cached_results(cache_options, cache_params, chromosomes, output_files):
+    """
+    Copy the results of a peak calling task from the result cache.
+
+    Parameters
+    ----------
+    cache_options : dict
+        The "cache" run option of `macs2_runner`
+    cache_params : list
+        MACS2 parameters generated by `task_output_files`
+    chromosomes : list
+        List of the chromosomes or tiles in the batch
+    output_files : dict
+        Location of each of the files written by the task as generated by
+        `task_output_files`
+
+    Returns
+    -------
+    result_cache : ResultCache
+        The result cache
+    cache_key : str
+        Key of the results of the task in the cache
+    cached : bool
+        True if the results were copied from the cache
+    """
+    result_cache = ResultCache(cache_options["dir"], cache_options.get("max_size", 0))
+    cache_key = result_cache.key(
+        cache_options["bam_digest"], cache_options.get("bam_bgd_digest"),
+        cache_params, chromosomes)
+
+    return result_cache, cache_key, result_cache.fetch(cache_key, output_files)
+
+
+def macs2_runner(  # pylint: disable=too-many-arguments,too-many-branches
+        name, bam_file, bai_file, macs_params,
+        narrowpeak, summits_bed, broadpeak, gappedpeak,
+        chromosome=None, bam_file_bgd=None, bai_file_bgd=None, bam_profile=None,
+        run_options=None, control_slices=None):
+    """
+    Function to run MACS2 for peak calling on aligned sequence files and
+    normalised against a provided background set of alignments.
+
+    Parameters
+    ----------
+    name : str
+        Name to be used to identify the files
+    bam_file : str
+        Location of the aligned FASTQ files as a bam file
+    bai_file : str
+        Location of the bam index file
+    narrowpeak : str
+        Location of the output narrowpeak file
+    summits_bed : str
+        Location of the output summits bed file
+    broadpeak : str
+        Location of the output broadpeak file
+    gappedpeak : str
+        Location of the output gappedpeak file
+    chromosome : str or list
+        If the tool is to be run over a single chromosome the matching
+        chromosome name should be specified. A list of chromosome names
+        runs a single MACS2 job over a batch of chromosomes. The list can
+        also contain a tile of a chromosome generated by `tile_batches`.
+        If None then the whole bam file is analysed
+    bam_file_bgd : str
+        Location of the aligned FASTQ files as a bam file representing
+        background values for the cell
+    bai_file_bgd : str
+        Location of the background bam index file
+    bam_profile : dict
+        Profile of the bam file generated by `build_bam_profile`. If None
+        then the profile is generated from the bam file
+    run_options : dict
+        Options for how MACS2 is run. "input_mode" is either "split" (the
+        default) to extract the reads into a temporary bam file, "fifo"
+        to stream the reads to MACS2 as a BAM through a named pipe,
+        "presplit" to use the temporary bam files already generated by
+        `Macs2Tasks.macs2_split_bam`, "distributed" when the bam files are
+        the slices for the batch, see
+        `Macs2Tasks.macs2_peak_calling_slice`, or "whole" to run MACS2 on
+        the whole bam files when the batch holds all of the chromosomes.
+        "backend" is either "subprocess" (the default) to run the macs2
+        command line tool or "inprocess" to run MACS2 from Python in a
+        long lived worker process. "limits" is a dict with the maximum
+        "time" in seconds and "memory" in bytes of the macs2 process, 0
+        for no limit, see `ProcessSupervisor`. "scratch_dir" is the
+        directory for the intermediate files of the task, see
+        `ScratchSpace`. If it is not set, or does not have enough free
+        space, then the directory of the bam file is used. "cache" is a
+        dict with the "dir" and "max_size" of the result cache and the
+        "bam_digest" and "bam_bgd_digest" of the input files, see
+        `ResultCache`. If it is not set then the results are not cached.
+        "sweep" describes the cutoffs to call peaks for from the pileup
+        generated by MACS2, see `build_sweep`. The peaks for each cutoff
+        are written to the narrow peak file, or for broad peaks the gapped
+        peak file, with the tag for the cutoff appended
+    control_slices : dict
+        Location of the background bam file for each chromosome as
+        generated by `Macs2Tasks.macs2_split_control`. If None, or if there
+        is not a file for each of the chromosomes, then the background bam
+        file is split by the task
+
+    Returns
+    -------
+    list
+        Records of the resources used by each stage of the task, see
+        `StageProfiler`. False if MACS2 could not be run
+    narrowPeak : file
+        BED6+4 file - ideal for transcription factor binding site
+        identification
+    summitPeak : file
+        BED4+1 file - Contains the peak summit locations for everypeak
+    broadPeak : file
+        BED6+3 file - ideal for histone binding site identification
+    gappedPeak : file
+        BED12+3 file - Contains a merged set of the broad and narrow peak
+        files
+
+    Definitions defined for each of these files have come from the MACS2
+    documentation described in the docs at https://github.com/taoliu/MACS
+    """
+    od_list = bam_file.split("/")
+    output_dir = "/".join(od_list[0:-1])
+
+    if isinstance(chromosome, list):
+        chromosomes = chromosome
+    else:
+        chromosomes = [chromosome]
+    label = batch_label(chromosomes)
+
+    if run_options is None:
+        run_options = {}
+    input_mode = run_options.get("input_mode", "split")
+
+    sweep = run_options.get("sweep")
+    output_files, sweep_files, cache_params = task_output_files(
+        [narrowpeak, summits_bed, broadpeak, gappedpeak], macs_params, sweep)
+    if sweep is not None:
+        if "--bdg" not in macs_params:
+            # The pileup tracks are removed along with the scratch space
+            macs_params = macs_params + ["--bdg"]
+
+    profiler = StageProfiler()
+
+    result_cache = None
+    cache_options = run_options.get("cache")
+    if cache_options:
+        with profiler.stage("cache", label):
+            result_cache, cache_key, cached = fetch_cached_results(
+                cache_options, cache_params, chromosomes, output_files)
+        if cached:
+            logger.info("MACS2: Using cached peaks for " + label)
+            return profiler.records
+
+    with profiler.stage("count", label):
+        if bam_profile is None:
+            bam_profile = build_bam_profile(bam_file, bai_file)
+
+        paired = bam_profile["paired"]
+        aligned_reads = profile_mapped_reads(bam_profile, chromosomes)
+
+    # The split bam files hold about the same share of the bam file as of
+    # the aligned reads, the same again is allowed for the background and
+    # the MACS2 output
+    total_reads = sum([mapped for _, _, mapped, _ in bam_profile["contigs"]])
+    required_space = 2 * os.path.getsize(bam_file) * aligned_reads // max(total_reads, 1)
+    scratch_dir = scratch_location(run_options.get("scratch_dir"), output_dir, required_space)
+    if run_options.get("scratch_dir") and scratch_dir != run_options["scratch_dir"]:
+        logger.warn("MACS2: Not enough space in {} for {}, using {}".format(
+            run_options["scratch_dir"], label, scratch_dir))
+
+    # Intermediate files are written to a private directory that is
+    # removed when the task finishes, whether or not it succeeds
+    with ScratchSpace(scratch_dir) as scratch:
+        with profiler.stage("split", label, reads=aligned_reads):
+            fifo_files = []
+            if input_mode == "fifo":
+                # Stream the reads to MACS2 rather than splitting the bam
+                fifo_dir = tempfile.mkdtemp(prefix="macs2_fifo_", dir=scratch.path)
+                fifo_files.append(
+                    (os.path.join(fifo_dir, label + ".treatment.bam"), bam_file, bai_file))
+                if bam_file_bgd is not None:
+                    fifo_files.append(
+                        (os.path.join(fifo_dir, label + ".control.bam"),
+                         bam_file_bgd, bai_file_bgd))
+
+                macs_params = set_macs2_param(
+                    macs_params, "--format", "BAMPE" if paired else "BAM")
+                if not paired and "--tsize" not in macs_params:
+                    # MACS2 needs to rewind the file to estimate the read length
+                    macs_params = macs_params + [
+                        "--tsize", str(bam_read_length(bam_file, bai_file, chromosomes))]
+
+                treatment_file = fifo_files[0][0]
+                control_file = fifo_files[1][0] if bam_file_bgd is not None else None
+            elif input_mode in ("distributed", "whole"):
+                # The bam files only hold the reads for the batch, or the
+                # batch is the whole genome
+                treatment_file = bam_file
+                control_file = bam_file_bgd
+
+                if paired:
+                    macs_params = set_macs2_param(macs_params, "--format", "BAMPE")
+            else:
+                # In the presplit input mode the files for the batch have
+                # already been generated by `Macs2Tasks.macs2_split_bam` and
+                # are removed once the task has finished with them
+                presplit = input_mode == "presplit"
+                treatment_file = bam_file.replace(".bam", "." + label + ".bam")
+                if presplit:
+                    scratch.track(treatment_file)
+                else:
+                    treatment_file = scratch.file(treatment_file)
+                    bam_split_contigs(bam_file, bai_file, chromosomes, treatment_file)
+
+                control_file = None
+                shared_control_files = control_slice_files(control_slices, chromosomes)
+                if bam_file_bgd is not None and shared_control_files is not None:
+                    # MACS2 combines multiple control files
+                    control_file = " ".join(shared_control_files)
+                elif bam_file_bgd is not None:
+                    control_file = bam_file_bgd.replace(".bam", "." + label + ".bam")
+                    if presplit:
+                        scratch.track(control_file)
+                    else:
+                        control_file = scratch.file(control_file)
+                        bam_split_contigs(
+                            bam_file_bgd, bai_file_bgd, chromosomes, control_file)
+
+                if paired:
+                    macs_params = set_macs2_param(macs_params, "--format", "BAMPE")
+
+        command_param = [
+            'macs2 callpeak',
+            " ".join(macs_params),
+            '-t', treatment_file,
+            '-n', name
+        ]
+        if control_file is not None:
+            bgd_command = '-c ' + control_file
+            command_param.append(bgd_command)
+
+        command_param.append('--outdir ' + scratch.path)
+        command_line = ' '.join(command_param)
+
+        if aligned_reads > 0:
+            with profiler.stage("callpeak", label, reads=aligned_reads) as callpeak_tags:
+                fifo_streams = []
+                try:
+                    for fifo_file, fifo_bam_file, fifo_bai_file in fifo_files:
+                        fifo_stream = BamFifo(
+                            fifo_file, fifo_bam_file, fifo_bai_file, chromosomes)
+                        fifo_stream.start()
+                        fifo_streams.append(fifo_stream)
+
+                    args = shlex.split(command_line)
+                    if run_options.get("backend", "subprocess") == "inprocess":
+                        returncode, error_report = callpeak_in_process(args[1:])
+                    else:
+                        # The output of MACS2 is streamed to the log and the
+                        # process is stopped if it goes over the limits
+                        supervisor = ProcessSupervisor(run_options.get("limits"))
+                        supervisor.run(args, "MACS2 " + label)
+                        returncode = supervisor.returncode
+                        error_report = supervisor.error_report()
+                        callpeak_tags["progress"] = supervisor.progress
+                        callpeak_tags["max_rss"] = supervisor.max_rss
+                except (IOError, OSError) as msg:
+                    logger.fatal("I/O error({0}): {1}\n{2}".format(
+                        msg.errno, msg.strerror, command_line))
+                    return False
+                finally:
+                    for fifo_stream in fifo_streams:
+                        fifo_stream.stop()
+                    if fifo_files:
+                        os.rmdir(os.path.dirname(fifo_files[0][0]))
+
+            if returncode != 0:
+                logger.fatal("MACS2 ERROR: " + command_line)
+                logger.fatal("MACS2 ERROR: BAM counts: " + str(aligned_reads))
+                logger.fatal("MACS2 ERROR: " + str(error_report))
+                return False
+
+            logger.info("MACS2: Process results: " + str(returncode))
+        elif fifo_files:
+            os.rmdir(os.path.dirname(fifo_files[0][0]))
+
+        logger.info("MACS2: Scratch files: " + " ".join(os.listdir(scratch.path)))
+
+        output_tmp = scratch.path + '/{}_{}'
+        if sweep_files:
+            if aligned_reads > 0 and returncode == 0:
+                try:
+                    with profiler.stage("sweep", label):
+                        run_cutoff_sweep(
+                            scratch.path + '/' + name, sweep, sweep_files,
+                            run_options.get("limits"))
+                except (IOError, OSError) as msg:
+                    logger.fatal("MACS2 SWEEP ERROR: " + str(msg))
+                    return False
+
+            for sweep_file in sweep_files.values():
+                if not os.path.isfile(sweep_file):
+                    open(sweep_file, 'w').close()
+                if len(chromosomes) > 1:
+                    order_by_contig(sweep_file, chromosomes)
+
+        with profiler.stage("collect", label):
+            # Only keep the peaks with a summit in the core region of each tile
+            tiles = [chrom for chrom in chromosomes if contig_region(chrom)[1] is not None]
+            if tiles:
+                for suffix, summit_column in [
+                        ('peaks.narrowPeak', 9), ('peaks.broadPeak', None),
+                        ('peaks.gappedPeak', None), ('summits.bed', None)]:
+                    filter_peaks_to_tiles(output_tmp.format(name, suffix), tiles, summit_column)
+                for sweep_file in sweep_files.values():
+                    filter_peaks_to_tiles(sweep_file, tiles, None if sweep["broad"] else 9)
+
+            if len(chromosomes) > 1:
+                for suffix in ['peaks.narrowPeak', 'peaks.broadPeak',
+                               'peaks.gappedPeak', 'summits.bed']:
+                    order_by_contig(output_tmp.format(name, suffix), chromosomes)
+
+            scratch.place(output_tmp.format(name, 'peaks.narrowPeak'), narrowpeak)
+            scratch.place(output_tmp.format(name, 'peaks.broadPeak'), broadpeak)
+            scratch.place(output_tmp.format(name, 'peaks.gappedPeak'), gappedpeak)
+            scratch.place(output_tmp.format(name, 'summits.bed'), summits_bed)
+
+        if result_cache is not None and aligned_reads > 0 and returncode == 0:
+            result_cache.store(cache_key, output_files)
+
+        return profiler.records
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,515 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+from utils import logger
+
+try:
+    if hasattr(sys, '_run_from_cmdl') is True:
+        raise ImportError
+    from pycompss.api.parameter import FILE_IN, FILE_OUT, IN
+    from pycompss.api.task import task
+    from pycompss.api.constraint import constraint
+except ImportError:
+    logger.warn("[Warning] Cannot import \"pycompss\" API packages.")
+    logger.warn("          Using mock decorators.")
+
+    from utils.dummy_pycompss import FILE_IN, FILE_OUT, IN  # pylint: disable=ungrouped-imports
+    from utils.dummy_pycompss import task, constraint  # pylint: disable=ungrouped-imports
+
+from mg_process_macs2.tool.bam_regions import build_bam_profile, bam_split_batches
+from mg_process_macs2.tool.fragment_size import (
+    cross_correlation_fragment_size, predictd_fragment_size)
+from mg_process_macs2.tool.macs2_runner import macs2_runner
+from mg_process_macs2.tool.peak_files import merge_peak_files
+from mg_process_macs2.tool.profiling import StageProfiler
+from mg_process_macs2.tool.scheduling import (
+    HIGH_MEMORY_TASK_CPUS, HIGH_MEMORY_TASK_SIZE, SPLIT_TASK_CPUS)
+
+
+# ------------------------------------------------------------------------------
+
+class Macs2Tasks(object):
+    """
+    COMPSs tasks for the stages of the MACS2 peak calling that are run on the
+    workers. The peak calling tasks run `macs2_runner`, the variants differ in
+    the input files that they are given and the resources that they request.
+    """
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=dict,
+        bam_file=FILE_IN,
+        bai_file=FILE_IN,
+        isModifier=False)
+    def macs2_bam_profile(self, bam_file, bai_file):  # pylint: disable=no-self-use
+        """
+        Generate the profile of a bam file that is shared by all of the peak
+        calling tasks. The read counts are taken from the bam index.
+
+        Parameters
+        ----------
+        bam_file : str
+            Location of the aligned FASTQ files as a bam file
+        bai_file : str
+            Location of the bam index file
+
+        Returns
+        -------
+        dict
+            Whether the reads are paired, the length and number of mapped and
+            unmapped reads for each chromosome and the bam header. See
+            `build_bam_profile`
+        """
+        return build_bam_profile(bam_file, bai_file)
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=int,
+        bam_file=FILE_IN,
+        bai_file=FILE_IN,
+        macs_params=IN,
+        contigs=IN,
+        method=IN,
+        limits=IN,
+        isModifier=False)
+    def macs2_fragment_size(  # pylint: disable=no-self-use,too-many-arguments
+            self, bam_file, bai_file, macs_params, contigs, method="predictd", limits=None):
+        """
+        Estimate the fragment size for the whole of a bam file.
+
+        Parameters
+        ----------
+        bam_file : str
+            Location of the aligned FASTQ files as a bam file
+        bai_file : str
+            Location of the bam index file
+        macs_params : list
+            List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+        contigs : list
+            List of tuples of the form (contig, length, mapped_reads) for the
+            contigs with aligned reads
+        method : str
+            "predictd" to use the MACS2 model or "xcor" to use the cross
+            correlation of a sample of the reads
+        limits : dict
+            Maximum "time" in seconds and "memory" in bytes for predictd
+
+        Returns
+        -------
+        int
+            The fragment size, None if it could not be estimated
+        """
+        if method == "xcor":
+            return cross_correlation_fragment_size(bam_file, bai_file, contigs)
+
+        return predictd_fragment_size(bam_file, macs_params, limits)
+
+    @constraint(ComputingUnits=str(SPLIT_TASK_CPUS))
+    @task(
+        returns=bool,
+        bam_file_bgd=FILE_IN,
+        control_slices=IN,
+        isModifier=False)
+    def macs2_split_control(self, bam_file_bgd, control_slices):  # pylint: disable=no-self-use
+        """
+        Split a background bam file into a bam file for each chromosome, in a
+        single pass over the file, so that they can be shared by the peak
+        calling tasks for several treatments. The files need to be on storage
+        that is shared with the peak calling tasks.
+
+        Parameters
+        ----------
+        bam_file_bgd : str
+            Location of the background bam file
+        control_slices : dict
+            Location of the output bam file for each chromosome
+
+        Returns
+        -------
+        bool
+        """
+        chromosomes = list(control_slices.keys())
+        bam_split_batches(
+            bam_file_bgd, [[chromosome] for chromosome in chromosomes],
+            [control_slices[chromosome] for chromosome in chromosomes], SPLIT_TASK_CPUS)
+
+        return True
+
+    @constraint(ComputingUnits=str(SPLIT_TASK_CPUS))
+    @task(
+        returns=list,
+        bam_file=FILE_IN,
+        batches=IN,
+        bam_files_out=IN,
+        isModifier=False)
+    def macs2_split_bam(self, bam_file, batches, bam_files_out):  # pylint: disable=no-self-use
+        """
+        Split a bam file into a bam file for each batch of chromosomes in a
+        single pass over the file. The files need to be on storage that is
+        shared with the peak calling tasks.
+
+        Parameters
+        ----------
+        bam_file : str
+            Location of the bam file
+        batches : list
+            List of the batches of chromosomes
+        bam_files_out : list
+            Location of the output bam file for each batch
+
+        Returns
+        -------
+        list
+            Number of alignments written to each of the files
+        """
+        return bam_split_batches(bam_file, batches, bam_files_out, SPLIT_TASK_CPUS)
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=list,
+        peak_file_1=FILE_IN,
+        peak_file_2=FILE_IN,
+        peak_file_out=FILE_OUT,
+        isModifier=False)
+    def macs2_merge_peak_pair(  # pylint: disable=no-self-use
+            self, peak_file_1, peak_file_2, peak_file_out):
+        """
+        Concatenate a pair of peak files as a step of the merge tree generated
+        by `merge_tree_steps`.
+
+        Parameters
+        ----------
+        peak_file_1 : str
+            Location of the first peak file
+        peak_file_2 : str
+            Location of the peak file appended to the first
+        peak_file_out : str
+            Location of the merged peak file
+
+        Returns
+        -------
+        list
+            Profile record of the merge, see `StageProfiler`
+        """
+        profiler = StageProfiler()
+        with profiler.stage("merge", output_file=os.path.basename(peak_file_out)):
+            merge_peak_files([(peak_file_out, [peak_file_1, peak_file_2])])
+
+        return profiler.records
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=list,
+        name=IN,
+        bam_file=FILE_IN,
+        bai_file=FILE_IN,
+        bam_file_bgd=FILE_IN,
+        bai_file_bgd=FILE_IN,
+        macs_params=IN,
+        narrowpeak=FILE_OUT,
+        summits_bed=FILE_OUT,
+        broadpeak=FILE_OUT,
+        gappedpeak=FILE_OUT,
+        chromosome=IN,
+        bam_profile=IN,
+        run_options=IN,
+        control_slices=IN,
+        isModifier=False)
+    def macs2_peak_calling(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_file, bai_file, bam_file_bgd, bai_file_bgd, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome,
+            bam_profile=None, run_options=None, control_slices=None):
+        """
+        Function to run MACS2 for peak calling on aligned sequence files and
+        normalised against a provided background set of alignments.
+
+        Parameters
+        ----------
+        name : str
+            Name to be used to identify the files
+        bam_file : str
+            Location of the aligned FASTQ files as a bam file
+        bai_file : str
+            Location of the bam index file
+        bam_file_bgd : str
+            Location of the aligned FASTQ files as a bam file representing
+            background values for the cell
+        bai_file_bgd : str
+            Location of the background bam index file
+        narrowpeak : str
+            Location of the output narrowpeak file
+        summits_bed : str
+            Location of the output summits bed file
+        broadpeak : str
+            Location of the output broadpeak file
+        gappedpeak : str
+            Location of the output gappedpeak file
+        chromosome : str or list
+            If the tool is to be run over a single chromosome the matching
+            chromosome name should be specified. A list of chromosome names
+            runs a single MACS2 job over a batch of chromosomes. If None then
+            the whole bam file is analysed
+        bam_profile : dict
+            Profile of the bam file generated by `macs2_bam_profile`
+        run_options : dict
+            Options for how MACS2 is run, see `macs2_runner`
+        control_slices : dict
+            Location of the background bam file for each chromosome generated
+            by `macs2_split_control`
+
+        Returns
+        -------
+        list
+            Profile records of the stages of the task, see `macs2_runner`
+        narrowPeak : file
+            BED6+4 file - ideal for transcription factor binding site
+            identification
+        summitPeak : file
+            BED4+1 file - Contains the peak summit locations for everypeak
+        broadPeak : file
+            BED6+3 file - ideal for histone binding site identification
+        gappedPeak : file
+            BED12+3 file - Contains a merged set of the broad and narrow peak
+            files
+
+        Definitions defined for each of these files have come from the MACS2
+        documentation described in the docs at https://github.com/taoliu/MACS
+        """
+
+        return macs2_runner(
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_file_bgd, bai_file_bgd, bam_profile, run_options,
+            control_slices)
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=list,
+        name=IN,
+        bam_file=FILE_IN,
+        bai_file=FILE_IN,
+        macs_params=IN,
+        narrowpeak=FILE_OUT,
+        summits_bed=FILE_OUT,
+        broadpeak=FILE_OUT,
+        gappedpeak=FILE_OUT,
+        chromosome=IN,
+        bam_profile=IN,
+        run_options=IN,
+        isModifier=False)
+    def macs2_peak_calling_nobgd(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome,
+            bam_profile=None, run_options=None):
+        """
+        Function to run MACS2 for peak calling on aligned sequence files without
+        a background dataset for normalisation.
+
+        Parameters
+        ----------
+        name : str
+            Name to be used to identify the files
+        bam_file : str
+            Location of the aligned FASTQ files as a bam file
+        bai_file : str
+            Location of the bam index file
+        narrowpeak : str
+            Location of the output narrowpeak file
+        summits_bed : str
+            Location of the output summits bed file
+        broadpeak : str
+            Location of the output broadpeak file
+        gappedpeak : str
+            Location of the output gappedpeak file
+        chromosome : str or list
+            If the tool is to be run over a single chromosome the matching
+            chromosome name should be specified. A list of chromosome names
+            runs a single MACS2 job over a batch of chromosomes. If None then
+            the whole bam file is analysed
+        bam_profile : dict
+            Profile of the bam file generated by `macs2_bam_profile`
+        run_options : dict
+            Options for how MACS2 is run, see `macs2_runner`
+
+        Returns
+        -------
+        list
+            Profile records of the stages of the task, see `macs2_runner`
+        narrowPeak : file
+            BED6+4 file - ideal for transcription factor binding site
+            identification
+        summitPeak : file
+            BED4+1 file - Contains the peak summit locations for everypeak
+        broadPeak : file
+            BED6+3 file - ideal for histone binding site identification
+        gappedPeak : file
+            BED12+3 file - Contains a merged set of the broad and narrow peak
+            files
+
+        Definitions defined for each of these files have come from the MACS2
+        documentation described in the docs at https://github.com/taoliu/MACS
+        """
+        return macs2_runner(
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_profile=bam_profile, run_options=run_options)
+
+    @constraint(
+        ComputingUnits=str(HIGH_MEMORY_TASK_CPUS), MemorySize=str(HIGH_MEMORY_TASK_SIZE))
+    @task(
+        returns=list,
+        name=IN,
+        bam_file=FILE_IN,
+        bai_file=FILE_IN,
+        bam_file_bgd=FILE_IN,
+        bai_file_bgd=FILE_IN,
+        macs_params=IN,
+        narrowpeak=FILE_OUT,
+        summits_bed=FILE_OUT,
+        broadpeak=FILE_OUT,
+        gappedpeak=FILE_OUT,
+        chromosome=IN,
+        bam_profile=IN,
+        run_options=IN,
+        control_slices=IN,
+        isModifier=False)
+    def macs2_peak_calling_high_memory(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_file, bai_file, bam_file_bgd, bai_file_bgd, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome,
+            bam_profile=None, run_options=None, control_slices=None):
+        """
+        Version of `macs2_peak_calling` for tasks with a large number of reads
+        that requests more memory and CPUs so that the task is not run on a
+        worker alongside other large tasks. See `macs2_peak_calling` for the
+        parameters.
+        """
+        return macs2_runner(
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_file_bgd, bai_file_bgd, bam_profile, run_options,
+            control_slices)
+
+    @constraint(
+        ComputingUnits=str(HIGH_MEMORY_TASK_CPUS), MemorySize=str(HIGH_MEMORY_TASK_SIZE))
+    @task(
+        returns=list,
+        name=IN,
+        bam_file=FILE_IN,
+        bai_file=FILE_IN,
+        macs_params=IN,
+        narrowpeak=FILE_OUT,
+        summits_bed=FILE_OUT,
+        broadpeak=FILE_OUT,
+        gappedpeak=FILE_OUT,
+        chromosome=IN,
+        bam_profile=IN,
+        run_options=IN,
+        isModifier=False)
+    def macs2_peak_calling_nobgd_high_memory(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome,
+            bam_profile=None, run_options=None):
+        """
+        Version of `macs2_peak_calling_nobgd` for tasks with a large number of
+        reads that requests more memory and CPUs so that the task is not run
+        on a worker alongside other large tasks. See
+        `macs2_peak_calling_nobgd` for the parameters.
+        """
+        return macs2_runner(
+            name, bam_file, bai_file, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_profile=bam_profile, run_options=run_options)
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=list,
+        name=IN,
+        bam_slice=FILE_IN,
+        bam_slice_bgd=FILE_IN,
+        macs_params=IN,
+        narrowpeak=FILE_OUT,
+        summits_bed=FILE_OUT,
+        broadpeak=FILE_OUT,
+        gappedpeak=FILE_OUT,
+        chromosome=IN,
+        bam_profile=IN,
+        run_options=IN,
+        isModifier=False)
+    def macs2_peak_calling_slice(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_slice, bam_slice_bgd, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome,
+            bam_profile, run_options):
+        """
+        Version of `macs2_peak_calling` for the "distributed" input mode where
+        the only input files are the bam files holding the reads for the batch
+        of chromosomes. COMPSs only transfers these slices to the worker rather
+        than the whole of the bam files.
+
+        Parameters
+        ----------
+        bam_slice : str
+            Location of the bam file with the reads for the batch
+        bam_slice_bgd : str
+            Location of the background bam file with the reads for the batch
+
+        See `macs2_peak_calling` for the other parameters.
+        """
+        return macs2_runner(
+            name, bam_slice, None, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_slice_bgd, None, bam_profile, run_options)
+
+    @constraint(ComputingUnits="1")
+    @task(
+        returns=list,
+        name=IN,
+        bam_slice=FILE_IN,
+        macs_params=IN,
+        narrowpeak=FILE_OUT,
+        summits_bed=FILE_OUT,
+        broadpeak=FILE_OUT,
+        gappedpeak=FILE_OUT,
+        chromosome=IN,
+        bam_profile=IN,
+        run_options=IN,
+        isModifier=False)
+    def macs2_peak_calling_slice_nobgd(  # pylint: disable=no-self-use,too-many-arguments
+            self, name, bam_slice, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak, chromosome,
+            bam_profile, run_options):
+        """
+        Version of `macs2_peak_calling_nobgd` for the "distributed" input mode
+        where the only input file is the bam file holding the reads for the
+        batch of chromosomes.
+
+        Parameters
+        ----------
+        bam_slice : str
+            Location of the bam file with the reads for the batch
+
+        See `macs2_peak_calling_nobgd` for the other parameters.
+        """
+        return macs2_runner(
+            name, bam_slice, None, macs_params,
+            narrowpeak, summits_bed, broadpeak, gappedpeak,
+            chromosome, bam_profile=bam_profile, run_options=run_options)
+
+# ------------------------------------------------------------------------------
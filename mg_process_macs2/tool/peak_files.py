@@ -0,0 +1,355 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import threading
+
+import pysam
+
+# Size of the blocks used when copying peak files
+CHUNK_SIZE = 1024 * 1024
+
+
+# ------------------------------------------------------------------------------
+
+def copy_peak_file(file_in_handle, file_out_handle, chunk_size=CHUNK_SIZE):
+    """
+    Append the remaining content of an open file to an open output file
+    without holding the whole file in memory.
+
+    Where the platform supports it `os.sendfile` is used so that the data is
+    copied by the kernel, otherwise the file is copied in blocks of
+    `chunk_size` bytes.
+
+    Parameters
+    ----------
+    file_in_handle : file
+        Handle of the file to copy from, opened in binary mode
+    file_out_handle : file
+        Handle of the file to append to, opened in binary mode
+    chunk_size : int
+        Maximum number of bytes to copy in each block
+    """
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        try:
+            in_fd = file_in_handle.fileno()
+            out_fd = file_out_handle.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            in_fd = None
+
+        if in_fd is not None:
+            file_out_handle.flush()
+            offset = file_in_handle.tell()
+            size = os.fstat(in_fd).st_size
+            try:
+                while offset < size:
+                    sent = os.sendfile(out_fd, in_fd, offset, min(chunk_size, size - offset))
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                # The file systems do not support sendfile so fall back to
+                # copying the remainder of the file in blocks
+                file_in_handle.seek(offset)
+
+    shutil.copyfileobj(file_in_handle, file_out_handle, chunk_size)
+
+
+def merge_peak_files(merge_jobs, open_func=open, delete_func=None):
+    """
+    Concatenate sets of peak files into their matching output files.
+
+    Each output file is written by its own thread so that the output files
+    are generated concurrently. Within each output the input files are
+    appended in the order given, so if the inputs are in the order of the
+    BAM header then so is the output.
+
+    Parameters
+    ----------
+    merge_jobs : list
+        List of tuples of the form (output_file, [input_files])
+    open_func : function
+        Function used to open the input files. Calls to this function are
+        serialised so that it is safe to use `compss_open`
+    delete_func : function
+        Function called with each input file once it has been copied. If None
+        then the input files are left in place
+    """
+    lock = threading.Lock()
+    errors = []
+
+    def _merge(output_file, input_files):
+        """
+        Copy a set of input files into a single output file
+        """
+        try:
+            with open(output_file, 'wb') as file_out_handle:
+                for input_file in input_files:
+                    with lock:
+                        file_in_handle = open_func(input_file, 'rb')
+                    with file_in_handle:
+                        copy_peak_file(file_in_handle, file_out_handle)
+                    if delete_func is not None:
+                        with lock:
+                            delete_func(input_file)
+        except (IOError, OSError) as msg:
+            errors.append((output_file, msg))
+
+    threads = []
+    for output_file, input_files in merge_jobs:
+        thread = threading.Thread(target=_merge, args=(output_file, input_files))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        output_file, msg = errors[0]
+        raise IOError("Failed to merge peak files into {}: {}".format(output_file, msg))
+
+
+def merge_tree_steps(input_files, output_file):
+    """
+    Plan the merge of a set of peak files as a tree of pairwise merges.
+
+    Each level of the tree merges neighbouring pairs of files from the level
+    below, so every merge can be run as soon as its two inputs exist and the
+    files are kept in the order given. A file without a neighbour is passed
+    up to the next level unchanged.
+
+    Parameters
+    ----------
+    input_files : list
+        Locations of the files to merge, in the order of the output
+    output_file : str
+        Location of the final merged file. The intermediate files are named
+        after it
+
+    Returns
+    -------
+    steps : list
+        List of tuples of the form ([input_file_1, input_file_2], output_file)
+        in an order where the inputs of each step are generated by an earlier
+        step or are in `input_files`
+    root_file : str
+        Location of the file that holds all of the merged inputs. This is
+        either the last intermediate file or, if there is a single input file,
+        the input file. None if there are no input files
+    """
+    steps = []
+    level_files = list(input_files)
+    level = 0
+    while len(level_files) > 1:
+        next_files = []
+        for index in range(0, len(level_files), 2):
+            pair = level_files[index:index + 2]
+            if len(pair) == 1:
+                next_files.append(pair[0])
+                continue
+            merged_file = "{}.merge{}.{}".format(output_file, level, index // 2)
+            steps.append((pair, merged_file))
+            next_files.append(merged_file)
+        level_files = next_files
+        level += 1
+
+    return steps, (level_files[0] if level_files else None)
+
+
+def filter_peaks_to_tiles(peak_file, tiles, summit_column=None):
+    """
+    Remove the peaks from a MACS2 output file that were called for a tile of a
+    contig but that belong to a neighbouring tile. A peak belongs to the tile
+    whose core region contains its summit, so each peak in the overlap between
+    tiles is only kept once.
+
+    Parameters
+    ----------
+    peak_file : str
+        Location of the MACS2 output file
+    tiles : list
+        List of tiles of the form (contig, start, end, core_start, core_end)
+    summit_column : int
+        Column that holds the offset of the summit from the start of the peak
+        (the 10th column of a narrowPeak file). If None, or the offset is -1,
+        then the middle of the peak is used
+    """
+    if not os.path.isfile(peak_file):
+        return
+
+    cores = dict([(tile[0], (tile[3], tile[4])) for tile in tiles])
+
+    kept_lines = []
+    with open(peak_file, 'rb') as file_in_handle:
+        for line in file_in_handle:
+            columns = line.rstrip(b"\n").split(b"\t")
+            contig = columns[0].decode("utf-8")
+            if contig not in cores or len(columns) < 3:
+                kept_lines.append(line)
+                continue
+
+            start, end = int(columns[1]), int(columns[2])
+            summit = (start + end) // 2
+            if summit_column is not None and int(columns[summit_column]) >= 0:
+                summit = start + int(columns[summit_column])
+
+            core_start, core_end = cores[contig]
+            if core_start <= summit < core_end:
+                kept_lines.append(line)
+
+    with open(peak_file, 'wb') as file_out_handle:
+        file_out_handle.writelines(kept_lines)
+
+
+def sort_peak_file(peak_file):
+    """
+    Sort the peaks in a file by their start within each contig. The contigs
+    are kept in the order that they first appear, which for the merged files
+    is the order of the BAM header, and any track lines are kept at the top
+    of the file.
+
+    Parameters
+    ----------
+    peak_file : str
+        Location of the peak file
+
+    Returns
+    -------
+    int
+        Number of track lines at the top of the file
+    """
+    track_lines = []
+    contig_lines = {}
+    contigs = []
+    with open(peak_file, 'rb') as file_in_handle:
+        for line in file_in_handle:
+            if line.startswith(b"track"):
+                track_lines.append(line)
+                continue
+            columns = line.split(b"\t", 3)
+            if columns[0] not in contig_lines:
+                contig_lines[columns[0]] = []
+                contigs.append(columns[0])
+            contig_lines[columns[0]].append((int(columns[1]), int(columns[2]), line))
+
+    with open(peak_file, 'wb') as file_out_handle:
+        file_out_handle.writelines(track_lines)
+        for contig in contigs:
+            contig_lines[contig].sort(key=lambda peak: (peak[0], peak[1]))
+            file_out_handle.writelines([peak[2] for peak in contig_lines[contig]])
+
+    return len(track_lines)
+
+
+def compress_peak_file(peak_file):
+    """
+    Convert a peak file into a coordinate sorted BGZF file with a tabix index
+    so that the peaks in a region can be read without reading the whole
+    file. The uncompressed file is removed.
+
+    Parameters
+    ----------
+    peak_file : str
+        Location of the peak file
+
+    Returns
+    -------
+    compressed_file : str
+        Location of the BGZF file, the peak file with the suffix ".gz"
+    index_file : str
+        Location of the tabix index
+    """
+    track_lines = sort_peak_file(peak_file)
+    compressed_file = pysam.tabix_index(
+        peak_file, force=True, seq_col=0, start_col=1, end_col=2, zerobased=True,
+        line_skip=track_lines)
+
+    return compressed_file, compressed_file + ".tbi"
+
+
+class OrderedPeakMerger(object):
+    """
+    Merge sets of peak files into their matching output files as the inputs
+    become available.
+
+    The inputs can be completed in any order, but they are appended to the
+    outputs in the order given so that the outputs match the order of the
+    BAM header.
+    """
+
+    def __init__(self, merge_jobs, open_func=open, delete_func=None):
+        """
+        Init function
+
+        Parameters
+        ----------
+        merge_jobs : list
+            List of tuples of the form (output_file, [input_files]). All of the
+            lists of input files need to be the same length
+        open_func : function
+            Function used to open the input files
+        delete_func : function
+            Function called with each input file once it has been copied. If
+            None then the input files are left in place
+        """
+        self.merge_jobs = merge_jobs
+        self.open_func = open_func
+        self.delete_func = delete_func
+
+        self.next_index = 0
+        self.completed = set()
+        self.file_out_handles = [open(output_file, 'wb') for output_file, _ in merge_jobs]
+
+    def add(self, index):
+        """
+        Mark the input files at a given position as complete and append all
+        of the inputs that are now ready to the outputs.
+
+        Parameters
+        ----------
+        index : int
+            Position of the completed inputs in the lists of input files
+        """
+        self.completed.add(index)
+        while self.next_index in self.completed:
+            for (_, input_files), file_out_handle in zip(self.merge_jobs, self.file_out_handles):
+                with self.open_func(input_files[self.next_index], 'rb') as file_in_handle:
+                    copy_peak_file(file_in_handle, file_out_handle)
+                if self.delete_func is not None:
+                    self.delete_func(input_files[self.next_index])
+            self.completed.remove(self.next_index)
+            self.next_index += 1
+
+    def close(self):
+        """
+        Close the output files
+
+        Returns
+        -------
+        bool
+            True if all of the inputs were merged
+        """
+        for file_out_handle in self.file_out_handles:
+            file_out_handle.close()
+
+        return all([self.next_index == len(input_files) for _, input_files in self.merge_jobs])
+
+# ------------------------------------------------------------------------------
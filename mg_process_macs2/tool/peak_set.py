@@ -0,0 +1,307 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import gzip
+import json
+import os
+import struct
+import warnings
+
+import numpy as np
+
+# Suffix added to the location of a peak file for its binary sidecar file
+PEAK_SET_SUFFIX = ".peakset"
+
+# Identifies the binary sidecar files and the version of their layout
+PEAK_SET_MAGIC = b"MGPEAKS1"
+
+# The records in the sidecar file start on a multiple of this many bytes
+PEAK_SET_ALIGNMENT = 64
+
+# The columns that are kept for each of the MACS2 output types as tuples of
+# the form (column, field, dtype). The contig (column 0) is always kept as a
+# code into the list of contigs. The names of the peaks and the blocks of the
+# gapped peaks are not kept
+PEAK_FORMATS = {
+    "narrow_peak": [
+        (1, "start", "<i4"), (2, "end", "<i4"), (4, "score", "<f4"), (5, "strand", "i1"),
+        (6, "signal_value", "<f4"), (7, "p_value", "<f4"), (8, "q_value", "<f4"),
+        (9, "summit", "<i4")
+    ],
+    "broad_peak": [
+        (1, "start", "<i4"), (2, "end", "<i4"), (4, "score", "<f4"), (5, "strand", "i1"),
+        (6, "signal_value", "<f4"), (7, "p_value", "<f4"), (8, "q_value", "<f4")
+    ],
+    "gapped_peak": [
+        (1, "start", "<i4"), (2, "end", "<i4"), (4, "score", "<f4"), (5, "strand", "i1"),
+        (6, "thick_start", "<i4"), (7, "thick_end", "<i4"), (9, "block_count", "<i4"),
+        (12, "signal_value", "<f4"), (13, "p_value", "<f4"), (14, "q_value", "<f4")
+    ],
+    "summits": [
+        (1, "start", "<i4"), (2, "end", "<i4"), (4, "score", "<f4")
+    ]
+}
+
+# Number of columns in each of the MACS2 output types
+PEAK_FORMAT_COLUMNS = {
+    "narrow_peak": 10,
+    "broad_peak": 9,
+    "gapped_peak": 15,
+    "summits": 5
+}
+
+
+# ------------------------------------------------------------------------------
+
+def peak_dtype(peak_format):
+    """
+    Get the NumPy dtype of the records for a peak file format.
+
+    Parameters
+    ----------
+    peak_format : str
+        One of "narrow_peak", "broad_peak", "gapped_peak" or "summits"
+
+    Returns
+    -------
+    numpy.dtype
+    """
+    if peak_format not in PEAK_FORMATS:
+        raise ValueError("Unknown peak format: " + str(peak_format))
+
+    return np.dtype(
+        [("contig", "<i4")] + [(field, dtype) for _, field, dtype in PEAK_FORMATS[peak_format]])
+
+
+class PeakSet(object):
+    """
+    Columnar representation of the peaks from a MACS2 output file.
+
+    The peaks are held in a NumPy structured array with a code for the contig
+    of each peak into the list of contigs, int32 coordinates and float32
+    scores. The strand is stored as 1, -1 or 0 for "+", "-" and ".". A peak
+    set can be saved as a binary sidecar file next to the peak file that is
+    memory mapped when it is loaded, so that the peaks do not need to be
+    parsed again.
+    """
+
+    def __init__(self, peaks, contigs, peak_format):
+        """
+        Init function
+
+        Parameters
+        ----------
+        peaks : numpy.ndarray
+            Structured array of the peaks with the dtype from `peak_dtype`
+        contigs : list
+            Names of the contigs indexed by the contig codes
+        peak_format : str
+            One of "narrow_peak", "broad_peak", "gapped_peak" or "summits"
+        """
+        self.peaks = peaks
+        self.contigs = list(contigs)
+        self.peak_format = peak_format
+
+    def __len__(self):
+        return len(self.peaks)
+
+    @classmethod
+    def from_bed(cls, peak_file, peak_format):
+        """
+        Parse a MACS2 output file.
+
+        The columns that are kept are parsed by NumPy straight into typed
+        arrays and the other columns are skipped without being converted.
+        Each contig name is replaced by its code as the lines are read, so
+        the names are only held once for each contig. Track lines are
+        ignored.
+
+        Parameters
+        ----------
+        peak_file : str
+            Location of the MACS2 output file. Files with the suffix ".gz"
+            are read as gzip or BGZF compressed files
+        peak_format : str
+            One of "narrow_peak", "broad_peak", "gapped_peak" or "summits"
+
+        Returns
+        -------
+        PeakSet
+        """
+        dtype = peak_dtype(peak_format)
+        columns = [(0, "contig", "<i4")] + [
+            (column, field, "S1" if field == "strand" else field_dtype)
+            for column, field, field_dtype in PEAK_FORMATS[peak_format]
+        ]
+
+        # Contig codes are assigned in the order that the contigs first appear
+        contig_codes = {}
+
+        def _coded_lines(file_handle):
+            """
+            Replace the contig name at the start of each line with its code,
+            skipping the track lines and blank lines
+            """
+            for line in file_handle:
+                if line.startswith(b"track") or not line.strip():
+                    continue
+                contig, rest = (line.split(b"\t", 1) + [b""])[:2]
+                code = contig_codes.setdefault(contig, len(contig_codes))
+                yield str(code).encode("ascii") + b"\t" + rest
+
+        open_func = gzip.open if peak_file.endswith(".gz") else open
+        with open_func(peak_file, "rb") as file_handle:
+            with warnings.catch_warnings():
+                # An empty file is a valid file without any peaks
+                warnings.simplefilter("ignore", UserWarning)
+                try:
+                    fields = np.loadtxt(
+                        _coded_lines(file_handle),
+                        dtype=[(field, field_dtype) for _, field, field_dtype in columns],
+                        delimiter="\t", comments=None,
+                        usecols=[column for column, _, _ in columns], ndmin=1)
+                except (ValueError, IndexError) as msg:
+                    raise ValueError("{} does not have {} columns on every line: {}".format(
+                        peak_file, PEAK_FORMAT_COLUMNS[peak_format], msg))
+
+        peaks = np.zeros(len(fields), dtype=dtype)
+        peaks["contig"] = fields["contig"]
+        contigs = [
+            contig.decode("utf-8")
+            for contig, _code in sorted(contig_codes.items(), key=lambda item: item[1])
+        ]
+
+        for _, field, _ in PEAK_FORMATS[peak_format]:
+            if field == "strand":
+                peaks[field] = (
+                    (fields[field] == b"+").astype(np.int8) - (fields[field] == b"-"))
+            else:
+                peaks[field] = fields[field]
+
+        return cls(peaks, contigs, peak_format)
+
+    def save(self, sidecar_file):
+        """
+        Write the peaks to a binary sidecar file.
+
+        The file has a JSON header with the format, the contigs and the number
+        of peaks followed by the records, which start on a multiple of
+        PEAK_SET_ALIGNMENT bytes. The file is written to a temporary file and
+        then renamed so that a partial file is never loaded.
+
+        Parameters
+        ----------
+        sidecar_file : str
+            Location of the sidecar file
+        """
+        header = json.dumps({
+            "format": self.peak_format,
+            "contigs": self.contigs,
+            "count": len(self.peaks)
+        }).encode("utf-8")
+        prefix_size = len(PEAK_SET_MAGIC) + 4 + len(header)
+        padding = -prefix_size % PEAK_SET_ALIGNMENT
+
+        tmp_file = sidecar_file + ".tmp"
+        with open(tmp_file, "wb") as file_handle:
+            file_handle.write(PEAK_SET_MAGIC)
+            file_handle.write(struct.pack("<I", len(header) + padding))
+            file_handle.write(header + b" " * padding)
+            file_handle.write(np.ascontiguousarray(self.peaks).tobytes())
+        os.rename(tmp_file, sidecar_file)
+
+    @classmethod
+    def load(cls, sidecar_file, mmap=True):
+        """
+        Load the peaks from a binary sidecar file written by `save`.
+
+        Parameters
+        ----------
+        sidecar_file : str
+            Location of the sidecar file
+        mmap : bool
+            If True then the records are memory mapped read only rather than
+            read into memory
+
+        Returns
+        -------
+        PeakSet
+        """
+        with open(sidecar_file, "rb") as file_handle:
+            if file_handle.read(len(PEAK_SET_MAGIC)) != PEAK_SET_MAGIC:
+                raise ValueError(sidecar_file + " is not a peak set file")
+            header_size = struct.unpack("<I", file_handle.read(4))[0]
+            header = json.loads(file_handle.read(header_size).decode("utf-8"))
+            offset = file_handle.tell()
+
+            dtype = peak_dtype(header["format"])
+            if header["count"] == 0:
+                peaks = np.zeros(0, dtype=dtype)
+            elif mmap:
+                peaks = np.memmap(
+                    sidecar_file, dtype=dtype, mode="r", offset=offset,
+                    shape=(header["count"],))
+            else:
+                peaks = np.fromfile(file_handle, dtype=dtype, count=header["count"])
+
+        return cls(peaks, header["contigs"], header["format"])
+
+    def contig_peaks(self, contig):
+        """
+        Get the peaks on a contig.
+
+        Parameters
+        ----------
+        contig : str
+            Name of the contig
+
+        Returns
+        -------
+        numpy.ndarray
+            Structured array of the peaks on the contig, empty if there are no
+            peaks on the contig
+        """
+        if contig not in self.contigs:
+            return self.peaks[:0]
+
+        return self.peaks[self.peaks["contig"] == self.contigs.index(contig)]
+
+
+def write_peak_set(peak_file, peak_format):
+    """
+    Parse a MACS2 output file and write its binary sidecar file.
+
+    Parameters
+    ----------
+    peak_file : str
+        Location of the MACS2 output file, which can be compressed
+    peak_format : str
+        One of "narrow_peak", "broad_peak", "gapped_peak" or "summits"
+
+    Returns
+    -------
+    str
+        Location of the sidecar file, the peak file with the suffix
+        PEAK_SET_SUFFIX
+    """
+    sidecar_file = peak_file + PEAK_SET_SUFFIX
+    PeakSet.from_bed(peak_file, peak_format).save(sidecar_file)
+
+    return sidecar_file
+
+# ------------------------------------------------------------------------------
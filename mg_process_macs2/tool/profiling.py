@@ -0,0 +1,239 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import resource
+import socket
+import sys
+import time
+
+
+# ------------------------------------------------------------------------------
+
+def _io_counters():
+    """
+    Get the number of bytes read and written by the read and write system
+    calls of this process and the child processes that it has waited for.
+    None if the counters are not available on the platform.
+    """
+    try:
+        with open("/proc/self/io", "r") as file_handle:
+            counters = dict([
+                (line.split(":")[0], int(line.split(":")[1])) for line in file_handle
+            ])
+        return counters["rchar"], counters["wchar"]
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _cpu_time():
+    """
+    CPU time used by this process and the child processes that it has waited
+    for, in seconds
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        self_usage.ru_utime + self_usage.ru_stime + child_usage.ru_utime + child_usage.ru_stime)
+
+
+def _child_max_rss():
+    """
+    Largest resident set size of the child processes that have been waited
+    for, in bytes
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+
+class StageProfiler(object):
+    """
+    Record the resources used by each stage of a run.
+
+    Each stage records its wall time, the CPU time used by the process and
+    its child processes, the peak resident set size of the child processes
+    (such as MACS2) and the bytes read and written. The peak resident set
+    size is the largest of all of the child processes that have finished by
+    the end of the stage. The records are plain dicts so that the records
+    from the tasks can be returned to the master and added to its profile.
+    """
+
+    def __init__(self):
+        """
+        Init function
+        """
+        self.records = []
+        self.host = socket.gethostname()
+
+    @contextlib.contextmanager
+    def stage(self, stage, chromosome=None, **tags):
+        """
+        Record the resources used by the code run in the context.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage
+        chromosome : str
+            Label of the batch of chromosomes for the stage, None for the
+            stages that cover the whole run
+        tags : dict
+            Other values to record with the stage, such as the number of reads
+
+        Yields
+        ------
+        dict
+            The tags for the stage, values that are only known once the code
+            has run can be added to it
+        """
+        tags = dict(tags)
+        start = time.time()
+        cpu_start = _cpu_time()
+        read_start, write_start = _io_counters()
+        try:
+            yield tags
+        finally:
+            read_end, write_end = _io_counters()
+            record = {
+                "stage": stage,
+                "chromosome": chromosome,
+                "start": start,
+                "wall": time.time() - start,
+                "cpu": _cpu_time() - cpu_start,
+                "child_max_rss": _child_max_rss(),
+                "io_read": None if read_start is None else read_end - read_start,
+                "io_write": None if write_start is None else write_end - write_start,
+                "host": self.host,
+                "pid": os.getpid()
+            }
+            record.update(tags)
+            self.records.append(record)
+
+    def add(self, records):
+        """
+        Add the records from another profiler, for example from a task.
+
+        Parameters
+        ----------
+        records : list
+            Records from `StageProfiler.records`
+        """
+        if isinstance(records, list):
+            self.records.extend(records)
+
+    def summary(self):
+        """
+        Total the resources used by each stage.
+
+        Returns
+        -------
+        dict
+            For each stage the number of records ("count"), the total "wall"
+            and "cpu" time, "io_read" and "io_write" bytes, the largest
+            "child_max_rss" and the chromosome of the slowest record
+            ("slowest")
+        """
+        stages = {}
+        for record in self.records:
+            stage = stages.setdefault(record["stage"], {
+                "count": 0, "wall": 0.0, "cpu": 0.0, "io_read": 0, "io_write": 0,
+                "child_max_rss": 0, "slowest": None, "slowest_wall": 0.0
+            })
+            stage["count"] += 1
+            stage["wall"] += record["wall"]
+            stage["cpu"] += record["cpu"]
+            stage["io_read"] += record["io_read"] or 0
+            stage["io_write"] += record["io_write"] or 0
+            stage["child_max_rss"] = max(stage["child_max_rss"], record["child_max_rss"])
+            if record["chromosome"] is not None and record["wall"] >= stage["slowest_wall"]:
+                stage["slowest"] = record["chromosome"]
+                stage["slowest_wall"] = record["wall"]
+
+        return stages
+
+    def save(self, profile_file):
+        """
+        Write the summary and all of the records as a JSON file.
+
+        Parameters
+        ----------
+        profile_file : str
+            Location of the profile file
+        """
+        with open(profile_file, "w") as file_handle:
+            json.dump(
+                {"summary": self.summary(), "records": self.records},
+                file_handle, indent=4, sort_keys=True)
+
+    def save_trace(self, trace_file):
+        """
+        Write the records as a timeline in the Chrome trace event format,
+        which can be loaded into chrome://tracing or the Perfetto UI.
+
+        Each record is a span. The spans are grouped into a process for each
+        host and a thread for each process id on the host, so the tasks that
+        ran at the same time on a worker are shown side by side. The stage,
+        chromosome, host, process id, number of reads and the resources used
+        are shown as the arguments of each span.
+
+        Parameters
+        ----------
+        trace_file : str
+            Location of the trace file
+        """
+        hosts = sorted(set([record["host"] for record in self.records]))
+        first_start = min([record["start"] for record in self.records] or [0])
+
+        events = []
+        for host_index, host in enumerate(hosts):
+            events.append({
+                "name": "process_name", "ph": "M", "pid": host_index + 1, "tid": 0,
+                "args": {"name": host}
+            })
+        for pid, host in sorted(set([
+                (record["pid"], record["host"]) for record in self.records])):
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": hosts.index(host) + 1, "tid": pid,
+                "args": {"name": "pid " + str(pid)}
+            })
+
+        for record in sorted(self.records, key=lambda record: record["start"]):
+            args = dict([
+                (key, value) for key, value in record.items()
+                if key not in ("stage", "start", "wall")
+            ])
+            events.append({
+                "name": record["stage"] if record["chromosome"] is None else "{} {}".format(
+                    record["stage"], record["chromosome"]),
+                "cat": "run" if record["chromosome"] is None else "task",
+                "ph": "X",
+                "ts": int(round((record["start"] - first_start) * 1000000)),
+                "dur": int(round(record["wall"] * 1000000)),
+                "pid": hosts.index(record["host"]) + 1,
+                "tid": record["pid"],
+                "args": args
+            })
+
+        with open(trace_file, "w") as file_handle:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file_handle)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,364 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Changing this invalidates all of the existing cache entries
+CACHE_VERSION = 1
+
+# Size of the blocks used when generating the digest of a file
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Suffix of the file that the digest of a file is saved in
+DIGEST_SUFFIX = ".sha256"
+
+# Name of the file in a cache entry that holds a value rather than peak files
+VALUE_FILE = "value.json"
+
+
+# ------------------------------------------------------------------------------
+
+def file_digest(file_name):
+    """
+    Generate the SHA-256 digest of the content of a file.
+
+    The digest is saved next to the file, with the suffix DIGEST_SUFFIX,
+    along with the size and modification time of the file. The saved digest
+    is used while the file is unchanged, so a large bam file is only read
+    once rather than on every run. If the digest cannot be saved then it is
+    generated each time.
+
+    Parameters
+    ----------
+    file_name : str
+        Location of the file
+
+    Returns
+    -------
+    str
+        Hex digest of the file
+    """
+    file_stat = os.stat(file_name)
+    file_state = {"size": file_stat.st_size, "mtime": file_stat.st_mtime}
+
+    digest_file = file_name + DIGEST_SUFFIX
+    try:
+        with open(digest_file, "r") as file_handle:
+            saved_state = json.load(file_handle)
+        if saved_state["size"] == file_state["size"] \
+                and saved_state["mtime"] == file_state["mtime"]:
+            return saved_state["sha256"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file_handle:
+        for chunk in iter(lambda: file_handle.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    file_state["sha256"] = digest.hexdigest()
+
+    # The file is written under a temporary name so that runs that start at
+    # the same time do not read a partly written file
+    tmp_file = None
+    try:
+        tmp_handle, tmp_file = tempfile.mkstemp(
+            prefix=os.path.basename(digest_file), dir=os.path.dirname(os.path.abspath(file_name)))
+        with os.fdopen(tmp_handle, "w") as file_handle:
+            json.dump(file_state, file_handle)
+        os.rename(tmp_file, digest_file)
+    except (IOError, OSError):
+        if tmp_file is not None and os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+
+    return file_state["sha256"]
+
+
+def normalise_macs2_params(macs_params):
+    """
+    Convert a list of MACS2 parameters into a sorted list of (param, value)
+    pairs so that the same parameters given in a different order are equal.
+
+    Parameters
+    ----------
+    macs_params : list
+        List of MACS2 parameters and values as generated by
+        `Macs2.get_macs2_params`
+
+    Returns
+    -------
+    list
+        Sorted list of [param, value] pairs. The value is None for flags
+    """
+    pairs = []
+    index = 0
+    while index < len(macs_params):
+        param = str(macs_params[index])
+        value = None
+        if index + 1 < len(macs_params) and not str(macs_params[index + 1]).startswith("--"):
+            value = str(macs_params[index + 1])
+            index += 1
+        pairs.append([param, value])
+        index += 1
+
+    return sorted(pairs, key=lambda pair: (pair[0], pair[1] or ""))
+
+
+class ResultCache(object):
+    """
+    Content addressed cache of the peak files generated by MACS2.
+
+    Each entry is a directory named by the key that holds the output files
+    from a single task. The entries are reused in place of running MACS2
+    again, and the least recently used entries are removed once the total
+    size of the cache goes over the limit. When running on a cluster the
+    cache directory needs to be on storage that is shared by all of the
+    nodes.
+    """
+
+    def __init__(self, cache_dir, max_size=0):
+        """
+        Init function
+
+        Parameters
+        ----------
+        cache_dir : str
+            Location of the cache directory. It is created if required
+        max_size : int
+            Maximum total size of the cache in bytes. 0 for no limit
+        """
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size)
+
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+
+    @staticmethod
+    def key(bam_digest, bam_bgd_digest, macs_params, chromosomes):
+        """
+        Generate the cache key for a peak calling task.
+
+        Parameters
+        ----------
+        bam_digest : str
+            Digest of the bam file
+        bam_bgd_digest : str
+            Digest of the background bam file, None if there is no background
+        macs_params : list
+            List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+        chromosomes : list
+            List of the chromosomes that the task calls peaks for
+
+        Returns
+        -------
+        str
+            Hex digest identifying the task
+        """
+        key_data = json.dumps({
+            "version": CACHE_VERSION,
+            "bam": bam_digest,
+            "bam_bgd": bam_bgd_digest,
+            "params": normalise_macs2_params(macs_params),
+            "chromosomes": [str(chromosome) for chromosome in chromosomes]
+        }, sort_keys=True)
+
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def value_key(name, bam_digest, macs_params, chromosomes):
+        """
+        Generate the cache key for a value that is derived from a bam file,
+        such as the fragment size.
+
+        Parameters
+        ----------
+        name : str
+            Name of the value, including how it is generated
+        bam_digest : str
+            Digest of the bam file
+        macs_params : list
+            List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+        chromosomes : list
+            List of the chromosomes that the value is generated from
+
+        Returns
+        -------
+        str
+            Hex digest identifying the value
+        """
+        key_data = json.dumps({
+            "version": CACHE_VERSION,
+            "value": name,
+            "bam": bam_digest,
+            "params": normalise_macs2_params(macs_params),
+            "chromosomes": [str(chromosome) for chromosome in chromosomes]
+        }, sort_keys=True)
+
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        """
+        Location of the directory for a cache entry
+        """
+        return os.path.join(self.cache_dir, key)
+
+    def fetch(self, key, output_files):
+        """
+        Copy the files for a cache entry to the output locations.
+
+        Parameters
+        ----------
+        key : str
+            Cache key generated by `key`
+        output_files : dict
+            Output file locations indexed by output type
+
+        Returns
+        -------
+        bool
+            True if the entry was in the cache and all of the files were copied
+        """
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return False
+
+        try:
+            for output_type, output_file in output_files.items():
+                shutil.copyfile(os.path.join(entry_dir, output_type), output_file)
+            os.utime(entry_dir, None)
+        except (IOError, OSError):
+            # The entry was incomplete or was removed while being read
+            return False
+
+        return True
+
+    def store(self, key, output_files):
+        """
+        Add the output files from a task to the cache and remove the least
+        recently used entries if the cache is over the size limit.
+
+        Parameters
+        ----------
+        key : str
+            Cache key generated by `key`
+        output_files : dict
+            Output file locations indexed by output type
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            os.utime(entry_dir, None)
+            return
+
+        # The entry is built in a temporary directory and then renamed so that
+        # other tasks never see a partial entry
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp_" + key, dir=self.cache_dir)
+        try:
+            for output_type, output_file in output_files.items():
+                shutil.copyfile(output_file, os.path.join(tmp_dir, output_type))
+            os.rename(tmp_dir, entry_dir)
+        except (IOError, OSError):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def fetch_value(self, key):
+        """
+        Get a value saved by `store_value`.
+
+        Parameters
+        ----------
+        key : str
+            Cache key generated by `value_key`
+
+        Returns
+        -------
+        The value, None if it is not in the cache
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, VALUE_FILE), "r") as file_handle:
+                value = json.load(file_handle)
+            os.utime(entry_dir, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        return value
+
+    def store_value(self, key, value):
+        """
+        Add a value that can be saved as JSON to the cache.
+
+        Parameters
+        ----------
+        key : str
+            Cache key generated by `value_key`
+        value
+            The value
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            os.utime(entry_dir, None)
+            return
+
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp_" + key, dir=self.cache_dir)
+        try:
+            with open(os.path.join(tmp_dir, VALUE_FILE), "w") as file_handle:
+                json.dump(value, file_handle)
+            os.rename(tmp_dir, entry_dir)
+        except (IOError, OSError):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size of the
+        cache is within the size limit.
+        """
+        if not self.max_size:
+            return
+
+        entries = []
+        total_size = 0
+        for entry in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, entry)
+            if entry.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            try:
+                entry_size = sum([
+                    os.path.getsize(os.path.join(entry_dir, entry_file))
+                    for entry_file in os.listdir(entry_dir)
+                ])
+                entries.append((os.path.getmtime(entry_dir), entry_size, entry_dir))
+            except OSError:
+                continue
+            total_size += entry_size
+
+        for _mtime, entry_size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= entry_size
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,197 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import time
+
+
+# ------------------------------------------------------------------------------
+
+class RunManifest(object):
+    """
+    Record of the state of each of the peak calling tasks in a run.
+
+    The manifest is saved as a JSON file after each change so that a run that
+    fails part of the way through can be resumed by only running the tasks
+    that did not complete. The manifest is only reused if the inputs and the
+    parameters match those of the run that created it. The batches of
+    chromosomes are stored in the manifest, as they depend on the resources
+    of the machine, so that a resumed run uses the same tasks, along with
+    values such as the fragment size that are costly to generate again.
+    """
+
+    def __init__(self, manifest_file, run_key, resume=True):
+        """
+        Init function
+
+        Parameters
+        ----------
+        manifest_file : str
+            Location of the manifest file
+        run_key : str
+            Key identifying the run as generated by `run_key`
+        resume : bool
+            If False then an existing manifest is replaced rather than being
+            reused
+        """
+        self.manifest_file = manifest_file
+        self.manifest = {"run_key": run_key, "tasks": {}}
+
+        if resume and os.path.isfile(manifest_file):
+            try:
+                with open(manifest_file, "r") as file_handle:
+                    manifest = json.load(file_handle)
+                if manifest.get("run_key") == run_key:
+                    self.manifest = manifest
+            except ValueError:
+                # The manifest is not valid JSON so the run starts again
+                pass
+
+    @staticmethod
+    def run_key(input_files, macs_params):
+        """
+        Generate the key identifying a run.
+
+        Parameters
+        ----------
+        input_files : list
+            Locations of the input bam files. The size and modification time
+            of each file are included so that a changed input starts a new run
+        macs_params : list
+            List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+
+        Returns
+        -------
+        str
+            Hex digest identifying the run
+        """
+        inputs = []
+        for input_file in input_files:
+            file_stat = os.stat(input_file)
+            inputs.append([os.path.abspath(input_file), file_stat.st_size, file_stat.st_mtime])
+
+        key_data = json.dumps({
+            "inputs": inputs,
+            "params": [str(param) for param in macs_params]
+        }, sort_keys=True)
+
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def use_batches(self, batches):
+        """
+        Get the batches of chromosomes for the run. If the manifest is from a
+        previous run then its batches are used, otherwise the batches are
+        recorded in the manifest.
+
+        Parameters
+        ----------
+        batches : list
+            List of the batches of chromosomes planned for this run
+
+        Returns
+        -------
+        list
+            List of the batches of chromosomes to run. Tiles of chromosomes
+            from a previous run are lists rather than tuples
+        """
+        if "batches" not in self.manifest:
+            self.manifest["batches"] = batches
+            self.save()
+
+        return self.manifest["batches"]
+
+    def use_value(self, name, generate):
+        """
+        Get a value for the run, such as the fragment size. If the manifest
+        is from a previous run then its value is used, otherwise the value is
+        generated and recorded in the manifest.
+
+        Parameters
+        ----------
+        name : str
+            Name of the value
+        generate : function
+            Function called without any arguments that generates the value
+
+        Returns
+        -------
+        The value
+        """
+        values = self.manifest.setdefault("values", {})
+        if name not in values:
+            values[name] = generate()
+            self.save()
+
+        return values[name]
+
+    def is_complete(self, label):
+        """
+        Check if a task completed and that all of its output files still
+        exist.
+
+        Parameters
+        ----------
+        label : str
+            Label of the batch of chromosomes for the task
+
+        Returns
+        -------
+        bool
+        """
+        task = self.manifest["tasks"].get(label)
+        if task is None or task["status"] != "complete":
+            return False
+
+        return all([os.path.isfile(output_file) for output_file in task["outputs"]])
+
+    def mark(self, label, status, outputs=None, message=None):
+        """
+        Record the state of a task and save the manifest.
+
+        Parameters
+        ----------
+        label : str
+            Label of the batch of chromosomes for the task
+        status : str
+            "complete" or "failed"
+        outputs : list
+            Locations of the output files from the task
+        message : str
+            Description of why the task failed
+        """
+        self.manifest["tasks"][label] = {
+            "status": status,
+            "outputs": outputs or [],
+            "message": message,
+            "time": time.time()
+        }
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest file. The file is replaced in a single step so that
+        a failure while saving does not leave a partial manifest.
+        """
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w") as file_handle:
+            json.dump(self.manifest, file_handle, indent=4, sort_keys=True)
+        os.rename(tmp_file, self.manifest_file)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,313 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import math
+
+# Memory used by a MACS2 process before any reads are loaded, in bytes
+TASK_BASE_MEMORY = 256 * 1024 ** 2
+
+# Memory used by MACS2 for each aligned read, in bytes
+TASK_READ_MEMORY = 100
+
+# Memory (GB) and CPUs requested for the tasks that are estimated to need
+# more than the high memory threshold
+HIGH_MEMORY_TASK_SIZE = 16.0
+HIGH_MEMORY_TASK_CPUS = 2
+
+# CPUs requested for the tasks that split a bam file, which are used for the
+# BGZF compression threads
+SPLIT_TASK_CPUS = 4
+
+# Bam files with at most this many aligned reads are peak called by a single
+# MACS2 task over the whole genome, as splitting the bam file and starting
+# the tasks takes longer than the time saved by running them in parallel
+WHOLE_GENOME_READS = 2000000
+
+# Smallest number of aligned reads that is worth running as a task of its own
+MIN_TASK_READS = 500000
+
+# Number of tasks aimed for on each worker so that the workers finish at
+# about the same time when the tasks are of different sizes
+TASKS_PER_WORKER = 2
+
+# Execution strategies that can be chosen by `choose_strategy`
+STRATEGIES = ("auto", "whole_genome", "per_chromosome", "batched", "tiled")
+
+
+# ------------------------------------------------------------------------------
+
+def batch_contigs(contig_stats, max_batch_size, batch_by="reads"):
+    """
+    Group the contigs from a BAM file into batches so that a single MACS2
+    task can process several small contigs.
+
+    Contigs are taken in the order that they are given (normally the order of
+    the BAM header) and consecutive contigs are packed into a batch until the
+    next contig would take the batch over `max_batch_size`. Contigs that are
+    on their own at least `max_batch_size` are always given a batch of their
+    own. Keeping the header order within and between batches means that the
+    merged peak files do not need to be re-sorted.
+
+    Parameters
+    ----------
+    contig_stats : list
+        List of tuples of the form (contig, length, mapped_reads)
+    max_batch_size : int
+        Target size of each batch. Measured as the number of aligned reads
+        or the number of bases depending on `batch_by`. A value of 0 or None
+        turns off batching so that every contig is in its own batch.
+    batch_by : str
+        Either "reads" to balance the batches on the number of aligned reads
+        or "length" to balance the batches on the length of the contigs.
+
+    Returns
+    -------
+    list
+        List of batches where each batch is a list of contig names
+    """
+    if batch_by not in ("reads", "length"):
+        raise ValueError("Unknown batch_by value: " + str(batch_by))
+
+    if not max_batch_size:
+        return [[contig[0]] for contig in contig_stats]
+
+    batches = []
+    current_batch = []
+    current_size = 0
+    for contig, length, mapped in contig_stats:
+        size = mapped if batch_by == "reads" else length
+
+        if size >= max_batch_size:
+            if current_batch:
+                batches.append(current_batch)
+                current_batch = []
+                current_size = 0
+            batches.append([contig])
+            continue
+
+        if current_batch and current_size + size > max_batch_size:
+            batches.append(current_batch)
+            current_batch = []
+            current_size = 0
+
+        current_batch.append(contig)
+        current_size += size
+
+    if current_batch:
+        batches.append(current_batch)
+
+    return batches
+
+
+def batch_label(batch):
+    """
+    Generate the label used to name the intermediate and per task output
+    files for a batch of contigs.
+
+    A batch with a single contig is labelled with the name of the contig so
+    that the file names match those generated when running a task per
+    chromosome.
+
+    Parameters
+    ----------
+    batch : list
+        List of contig names or tiles of contigs
+
+    Returns
+    -------
+    str
+        Label for the batch
+    """
+    def _item_label(item):
+        """
+        Label for a contig or a tile of a contig
+        """
+        if isinstance(item, (list, tuple)):
+            return "{}.{}-{}".format(item[0], item[3], item[4])
+        return str(item)
+
+    if len(batch) == 1:
+        return _item_label(batch[0])
+
+    return "{}..{}".format(_item_label(batch[0]), _item_label(batch[-1]))
+
+
+def tile_batches(batches, contig_stats, tile_reads, overlap):
+    """
+    Split the contigs that are in a batch of their own and have more than
+    `tile_reads` aligned reads into overlapping tiles so that the peak calling
+    for large contigs can be spread over several tasks.
+
+    Each tile has a core region, and the tiles of a contig are extended into
+    the neighbouring tiles by `overlap` bases so that peaks near the edge of
+    the core region are called from all of the reads around them. Each peak is
+    then kept only by the tile whose core region contains its summit. The
+    tiles are of equal length, so the number of reads in each tile assumes
+    that the reads are evenly spread over the contig.
+
+    Parameters
+    ----------
+    batches : list
+        List of batches of contig names as generated by `batch_contigs`
+    contig_stats : list
+        List of tuples of the form (contig, length, mapped_reads)
+    tile_reads : int
+        Target number of aligned reads in each tile. 0 or None turns off
+        tiling
+    overlap : int
+        Number of bases that each tile extends into its neighbours
+
+    Returns
+    -------
+    list
+        List of batches where the batches for large contigs are replaced by a
+        batch for each tile. Each tile is of the form (contig, start, end,
+        core_start, core_end)
+    """
+    if not tile_reads:
+        return batches
+
+    contigs = dict([(contig[0], contig) for contig in contig_stats])
+
+    tiled_batches = []
+    for batch in batches:
+        if len(batch) != 1 or contigs[batch[0]][2] <= tile_reads:
+            tiled_batches.append(batch)
+            continue
+
+        contig, length, mapped = contigs[batch[0]]
+        tile_count = int(math.ceil(float(mapped) / tile_reads))
+        core_length = int(math.ceil(float(length) / tile_count))
+        for core_start in range(0, length, core_length):
+            core_end = min(length, core_start + core_length)
+            tiled_batches.append([(
+                contig, max(0, core_start - overlap), min(length, core_end + overlap),
+                core_start, core_end
+            )])
+
+    return tiled_batches
+
+
+def choose_strategy(contig_stats, workers, strategy="auto",
+                    whole_genome_reads=WHOLE_GENOME_READS):
+    """
+    Choose how the peak calling is split into tasks from the number of
+    aligned reads, the number of contigs and the number of workers.
+
+    The "auto" strategy runs small bam files, or runs with a single worker,
+    as one MACS2 task over the whole genome. Otherwise each task is aimed to
+    have the reads for TASKS_PER_WORKER tasks on each worker, but at least
+    MIN_TASK_READS. Contigs with more than twice that are split into tiles,
+    otherwise the small contigs are batched together, or each contig is run
+    as a task of its own if none of them are small enough to batch.
+
+    Parameters
+    ----------
+    contig_stats : list
+        List of tuples of the form (contig, length, mapped_reads)
+    workers : int
+        Number of tasks that can run at the same time
+    strategy : str
+        "auto" to choose the strategy, or one of "whole_genome",
+        "per_chromosome", "batched" or "tiled" to use the task size for the
+        given strategy
+    whole_genome_reads : int
+        Largest number of aligned reads run as a single task by "auto"
+
+    Returns
+    -------
+    dict
+        The chosen "strategy", the "batch_size" and "tile_reads" to generate
+        the batches with `batch_contigs` and `tile_batches`, the number of
+        "workers" and the total number of aligned "reads"
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown strategy: " + str(strategy))
+
+    total_reads = sum([mapped for _, _, mapped in contig_stats])
+    largest_reads = max([mapped for _, _, mapped in contig_stats] or [0])
+    workers = max(1, int(workers))
+    task_reads = max(
+        MIN_TASK_READS, int(math.ceil(float(total_reads) / (workers * TASKS_PER_WORKER))))
+
+    if strategy == "auto":
+        if workers == 1 or total_reads <= whole_genome_reads:
+            strategy = "whole_genome"
+        elif largest_reads > 2 * task_reads:
+            strategy = "tiled"
+        elif len(batch_contigs(contig_stats, task_reads)) == len(contig_stats):
+            strategy = "per_chromosome"
+        else:
+            strategy = "batched"
+
+    batch_size, tile_reads = task_reads, 0
+    if strategy == "whole_genome":
+        batch_size = total_reads + 1
+    elif strategy == "per_chromosome":
+        batch_size = 0
+    elif strategy == "tiled":
+        tile_reads = task_reads
+
+    return {
+        "strategy": strategy,
+        "batch_size": batch_size,
+        "tile_reads": tile_reads,
+        "workers": workers,
+        "reads": total_reads
+    }
+
+
+def estimate_task_memory(reads):
+    """
+    Estimate the memory required by MACS2 to call the peaks for a task.
+
+    Parameters
+    ----------
+    reads : int
+        Number of aligned reads processed by the task
+
+    Returns
+    -------
+    int
+        Estimated memory in bytes
+    """
+    return TASK_BASE_MEMORY + reads * TASK_READ_MEMORY
+
+
+def order_longest_first(indices, costs):
+    """
+    Order tasks so that the most expensive are started first. Starting the
+    longest tasks first stops a large task that is started late from holding
+    up the end of the run.
+
+    Parameters
+    ----------
+    indices : list
+        List of the task indices to order
+    costs : list
+        Estimated cost of each task, indexed by the task index
+
+    Returns
+    -------
+    list
+        The task indices in order of decreasing cost. Tasks with the same cost
+        stay in the order given
+    """
+    return sorted(indices, key=lambda index: -costs[index])
+
+# ------------------------------------------------------------------------------
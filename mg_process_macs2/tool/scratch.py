@@ -0,0 +1,188 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import errno
+import os
+import shutil
+import tempfile
+
+
+# ------------------------------------------------------------------------------
+
+def free_space(directory):
+    """
+    Get the space available to the user in the file system of a directory.
+
+    Parameters
+    ----------
+    directory : str
+        Location of the directory
+
+    Returns
+    -------
+    int
+        Number of bytes available, None if it is not known
+    """
+    try:
+        stats = os.statvfs(directory)
+    except (AttributeError, OSError):
+        return None
+
+    return stats.f_bavail * stats.f_frsize
+
+
+def place_file(file_name, output_file):
+    """
+    Move a file to its final location. The file is renamed if both are on
+    the same file system and copied otherwise.
+
+    Parameters
+    ----------
+    file_name : str
+        Location of the file
+    output_file : str
+        Final location of the file
+    """
+    try:
+        os.rename(file_name, output_file)
+    except OSError as msg:
+        if msg.errno != errno.EXDEV:
+            raise
+        shutil.copyfile(file_name, output_file)
+        os.remove(file_name)
+
+
+class ScratchSpace(object):
+    """
+    Private directory for the intermediate files of a task.
+
+    The directory is made in the scratch location, ideally node local or
+    tmpfs storage rather than the shared file system. Files made within it
+    are removed along with the directory when the scratch space is closed,
+    whether or not the task was successful. Files elsewhere that the task
+    generated can be tracked so that they are removed as well. Results are
+    moved out of the directory with `place` so that they are not copied when
+    the output is on the same file system.
+    """
+
+    def __init__(self, base_dir=None, prefix="macs2_"):
+        """
+        Init function
+
+        Parameters
+        ----------
+        base_dir : str
+            Directory to make the scratch directory in. If None then the
+            default temporary directory is used
+        prefix : str
+            Prefix of the name of the scratch directory
+        """
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=base_dir)
+        self.tracked_files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def file(self, file_name):
+        """
+        Get the location for an intermediate file in the scratch directory.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file, only the base name is used
+
+        Returns
+        -------
+        str
+            Location of the file in the scratch directory
+        """
+        return os.path.join(self.path, os.path.basename(file_name))
+
+    def track(self, file_name):
+        """
+        Remove a file outside of the scratch directory when the scratch
+        space is cleaned up.
+
+        Parameters
+        ----------
+        file_name : str
+            Location of the file
+        """
+        self.tracked_files.append(file_name)
+
+    def place(self, file_name, output_file):
+        """
+        Move a file from the scratch directory to its final location. If the
+        file was not generated then an empty output file is created.
+
+        Parameters
+        ----------
+        file_name : str
+            Location of the file in the scratch directory
+        output_file : str
+            Final location of the file
+        """
+        if os.path.isfile(file_name):
+            place_file(file_name, output_file)
+        else:
+            open(output_file, "w").close()
+
+    def cleanup(self):
+        """
+        Remove the scratch directory and the tracked files.
+        """
+        for file_name in self.tracked_files:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+        self.tracked_files = []
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def scratch_location(scratch_dir, fallback_dir, required_space):
+    """
+    Choose the directory for the scratch space of a task.
+
+    Parameters
+    ----------
+    scratch_dir : str
+        Configured scratch directory, None to use the fallback directory
+    fallback_dir : str
+        Directory used when there is no scratch directory or it does not have
+        enough free space
+    required_space : int
+        Estimated number of bytes needed by the task
+
+    Returns
+    -------
+    str
+        Location of the directory to make the scratch space in
+    """
+    if not scratch_dir:
+        return fallback_dir
+
+    available = free_space(scratch_dir)
+    if available is not None and available < required_space:
+        return fallback_dir
+
+    return scratch_dir
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,221 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import collections
+import re
+import subprocess
+import threading
+import time
+
+from utils import logger
+
+# MACS2 logs the start of each step of the peak calling as "#<step> <message>",
+# for example "#1 read tag files..." or "#3 Call peaks..."
+MACS2_STEP = re.compile(r"#(\d+(?:\.\d+)?)\s+(.*\S)")
+
+# Number of reads MACS2 found in the treatment and control files
+MACS2_TAGS = re.compile(r"total (?:tags|fragments) in (treatment|control):\s*(\d+)")
+
+# Time given to a process to exit after it is asked to terminate before it is
+# killed
+TERMINATE_GRACE = 5.0
+
+
+# ------------------------------------------------------------------------------
+
+def _process_rss(pid):
+    """
+    Get the resident set size of a process in bytes. None if it is not
+    available on the platform or the process has finished.
+    """
+    try:
+        with open("/proc/{}/status".format(pid), "r") as file_handle:
+            for line in file_handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+def parse_macs2_progress(line):
+    """
+    Parse a line of the MACS2 log into a progress event.
+
+    Parameters
+    ----------
+    line : str
+        Line from the MACS2 log
+
+    Returns
+    -------
+    dict
+        The "step" and the "message" for the line, along with the "treatment"
+        or "control" read count if the line reports one. None if the line is
+        not a progress line
+    """
+    step = MACS2_STEP.search(line)
+    if step is None:
+        return None
+
+    event = {"step": step.group(1), "message": step.group(2)}
+    tags = MACS2_TAGS.search(line)
+    if tags is not None:
+        event[tags.group(1)] = int(tags.group(2))
+
+    return event
+
+
+class ProcessSupervisor(object):
+    """
+    Run a command with its output streamed to the logger.
+
+    The stdout and stderr of the process are read line by line as they are
+    written so that they are not held in memory, and only the last lines of
+    stderr are kept for reporting errors. Progress lines from MACS2 are
+    recorded as events. The process is terminated if it runs for longer than
+    the time limit or if its resident set size goes over the memory limit.
+    """
+
+    def __init__(self, limits=None, tail_lines=50, poll_interval=0.2):
+        """
+        Init function
+
+        Parameters
+        ----------
+        limits : dict
+            "time" is the maximum wall time of the process in seconds and
+            "memory" the maximum resident set size of the process in bytes,
+            which is only checked on platforms with /proc. A missing or 0
+            value means there is no limit
+        tail_lines : int
+            Number of lines at the end of stderr that are kept
+        poll_interval : float
+            Seconds between the checks of the limits
+        """
+        limits = limits or {}
+        self.limits = {
+            "time": float(limits.get("time", 0)),
+            "memory": float(limits.get("memory", 0))
+        }
+        self.poll_interval = poll_interval
+
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.progress = []
+        self.max_rss = 0
+        self.failure = None
+        self.returncode = None
+
+    def _read_stream(self, stream, label, start, keep_tail):
+        """
+        Log each line of a stream of the process, recording the progress
+        events and the tail of the stream.
+        """
+        for line in iter(stream.readline, b""):
+            line = line.decode("utf-8", "replace").rstrip()
+            if not line:
+                continue
+            logger.info("{}: {}".format(label, line))
+            if keep_tail:
+                self.tail.append(line)
+            event = parse_macs2_progress(line)
+            if event is not None:
+                event["elapsed"] = time.time() - start
+                self.progress.append(event)
+        stream.close()
+
+    def _stop(self, process):
+        """
+        Terminate the process, killing it if it does not exit in time.
+        """
+        process.terminate()
+        deadline = time.time() + TERMINATE_GRACE
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(self.poll_interval)
+        if process.poll() is None:
+            process.kill()
+
+    def run(self, args, label="MACS2"):
+        """
+        Run a command until it completes or goes over one of the limits.
+
+        Parameters
+        ----------
+        args : list
+            The command and its arguments
+        label : str
+            Prefix for the lines of the output in the log
+
+        Returns
+        -------
+        bool
+            True if the process completed with an exit code of 0. Otherwise
+            `failure` describes why the process failed and `tail` holds the
+            last lines of stderr
+        """
+        start = time.time()
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        readers = [
+            threading.Thread(
+                target=self._read_stream, args=(process.stdout, label, start, False)),
+            threading.Thread(
+                target=self._read_stream, args=(process.stderr, label, start, True))
+        ]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        while process.poll() is None:
+            rss = _process_rss(process.pid)
+            if rss is not None:
+                self.max_rss = max(self.max_rss, rss)
+
+            if self.limits["time"] and time.time() - start > self.limits["time"]:
+                self.failure = "exceeded the time limit of {} seconds".format(self.limits["time"])
+            elif self.limits["memory"] and rss is not None and rss > self.limits["memory"]:
+                self.failure = "exceeded the memory limit of {} bytes ({} bytes in use)".format(
+                    int(self.limits["memory"]), rss)
+            if self.failure is not None:
+                self._stop(process)
+                break
+
+            time.sleep(self.poll_interval)
+
+        self.returncode = process.wait()
+        for reader in readers:
+            reader.join()
+
+        if self.failure is None and self.returncode != 0:
+            self.failure = "exited with code {}".format(self.returncode)
+
+        return self.failure is None
+
+    def error_report(self):
+        """
+        Describe the failure of the process along with the tail of stderr.
+
+        Returns
+        -------
+        str
+        """
+        return "{}\nLast {} lines of stderr:\n\t{}".format(
+            self.failure, len(self.tail), "\n\t".join(self.tail))
+
+# ------------------------------------------------------------------------------
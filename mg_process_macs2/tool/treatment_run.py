@@ -0,0 +1,908 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import sys
+
+from utils import logger
+
+try:
+    if hasattr(sys, '_run_from_cmdl') is True:
+        raise ImportError
+    from pycompss.api.api import compss_wait_on, compss_open, compss_delete_file
+except ImportError:
+    logger.warn("[Warning] Cannot import \"pycompss\" API packages.")
+    logger.warn("          Using mock decorators.")
+
+    from utils.dummy_pycompss import (  # pylint: disable=ungrouped-imports
+        compss_wait_on, compss_open, compss_delete_file)
+
+from basic_modules.metadata import Metadata
+from mg_common.tool.bam_utils import bamUtilsTask
+
+from mg_process_macs2.tool.bam_regions import profile_mapped_reads, bam_split_batches
+from mg_process_macs2.tool.cutoff_sweep import build_sweep, sweep_file_name
+from mg_process_macs2.tool.local_executor import LocalExecutor
+from mg_process_macs2.tool.macs2_runner import (
+    control_slice_files, fetch_cached_results, macs2_runner, set_macs2_param, task_output_files)
+from mg_process_macs2.tool.macs2_tasks import Macs2Tasks
+from mg_process_macs2.tool.peak_files import (
+    OrderedPeakMerger, compress_peak_file, merge_peak_files, merge_tree_steps)
+from mg_process_macs2.tool.peak_set import write_peak_set
+from mg_process_macs2.tool.profiling import StageProfiler
+from mg_process_macs2.tool.result_cache import ResultCache, file_digest
+from mg_process_macs2.tool.run_manifest import RunManifest
+from mg_process_macs2.tool.scheduling import (
+    HIGH_MEMORY_TASK_SIZE, SPLIT_TASK_CPUS, WHOLE_GENOME_READS, batch_contigs, batch_label,
+    choose_strategy, estimate_task_memory, order_longest_first, tile_batches)
+
+# Output files of the peak calling in the order that they are passed to the
+# peak calling tasks
+PEAK_OUTPUTS = ['narrow_peak', 'summits', 'broad_peak', 'gapped_peak']
+
+# BED type of each of the output files
+OUTPUT_BED_TYPES = {
+    'narrow_peak': "bed4+1",
+    'summits': "bed6+4",
+    'broad_peak': "bed6+3",
+    'gapped_peak': "bed12+3"
+}
+
+
+# ------------------------------------------------------------------------------
+
+def batch_peak_files(output_files, label):
+    """
+    Get the locations of the peak files written by the task for a batch of
+    chromosomes, which are merged into the output files.
+
+    Parameters
+    ----------
+    output_files : dict
+        Locations of the output files indexed by output type
+    label : str
+        Label of the batch used in the file names
+
+    Returns
+    -------
+    list
+        Locations of the narrow peak, summits, broad peak and gapped peak
+        files for the batch, in the order of `PEAK_OUTPUTS`
+    """
+    return [str(output_files[output_type]) + "." + label for output_type in PEAK_OUTPUTS]
+
+
+class TreatmentRun(object):
+    """
+    Peak calling for a single treatment bam file, against a background bam
+    file that has been prepared by `Macs2._prepare_control`.
+
+    The chromosomes with aligned reads are grouped into batches that are
+    each run as a task, in local worker processes when run with `--local` or
+    as COMPSs tasks, and the peak files for the batches are merged into the
+    output files. See `Macs2` for the configuration options.
+    """
+
+    # Target size of each batch of chromosomes for each of the
+    # "macs2_batch_by" options when "macs2_batch_size" is not set. Without
+    # either option each chromosome is run as a task of its own
+    default_batch_size = {
+        "reads": 1000000,
+        "length": 50000000
+    }
+
+    def __init__(self, configuration, input_files, control=None):
+        """
+        Init function
+
+        Parameters
+        ----------
+        configuration : dict
+            Configuration of the `Macs2` tool
+        input_files : dict
+            Location of the treatment bam file (bam) and the background bam
+            file (bam_bg)
+        control : dict
+            Background bam file prepared by `Macs2._prepare_control`. None if
+            there is no background
+        """
+        self.configuration = configuration
+        self.input_files = input_files
+        self.control = control
+        self.tasks = Macs2Tasks()
+        self.profiler = StageProfiler()
+
+    @staticmethod
+    def _remove_files(file_names):
+        """
+        Remove the temporary files that exist from a list of files.
+
+        Parameters
+        ----------
+        file_names : list
+            Locations of the files
+        """
+        for file_name in file_names:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    @staticmethod
+    def _add_peak_set(metadata, peak_file, peak_format):
+        """
+        Write the binary sidecar file for an output file and record its
+        location in the metadata.
+
+        Parameters
+        ----------
+        metadata : Metadata
+            Metadata for the output file
+        peak_file : str
+            Location of the output file
+        peak_format : str
+            Type of the output file, see `PEAK_FORMATS`
+        """
+        try:
+            metadata.meta_data["peak_set"] = write_peak_set(peak_file, peak_format)
+        except ValueError as msg:
+            logger.warn("MACS2: Unable to write the peak set for {}: {}".format(
+                peak_file, msg))
+
+    @staticmethod
+    def _compress_output(metadata):
+        """
+        Compress and index an output file and record the compressed file and
+        its index in the metadata.
+
+        Parameters
+        ----------
+        metadata : Metadata
+            Metadata for the output file
+        """
+        compressed_file, index_file = compress_peak_file(metadata.file_path)
+        metadata.file_path = compressed_file
+        metadata.meta_data["compressed"] = "gzip"
+        metadata.meta_data["tabix_index"] = index_file
+
+    def _choose_strategy(self, contig_stats):
+        """
+        Choose how the chromosomes are split into tasks, see
+        `choose_strategy`. The batching and tiling options are used as they
+        are unless a strategy is configured, and "auto" also uses them if any
+        are set.
+
+        Parameters
+        ----------
+        contig_stats : list
+            List of tuples of the form (contig, length, mapped_reads) for the
+            chromosomes with aligned reads
+
+        Returns
+        -------
+        dict
+            The "strategy", "batch_by", "batch_size" and "tile_reads" for
+            generating the batches
+        """
+        strategy = self.configuration.get("macs2_strategy", "configured")
+        workers = self.configuration.get("macs2_workers")
+        if hasattr(sys, '_run_from_cmdl') is True:
+            workers = workers or self.configuration.get(
+                "macs2_local_workers") or multiprocessing.cpu_count()
+        configured = [
+            option for option in ["macs2_batch_by", "macs2_batch_size", "macs2_tile_reads"]
+            if self.configuration.get(option) is not None
+        ]
+
+        if strategy == "configured" or (strategy == "auto" and configured):
+            batch_by = self.configuration.get("macs2_batch_by") or "reads"
+            batch_size = self.configuration.get("macs2_batch_size")
+            if batch_size is None and self.configuration.get("macs2_batch_by"):
+                batch_size = self.default_batch_size.get(batch_by, 0)
+            return {
+                "strategy": "configured",
+                "batch_by": batch_by,
+                "batch_size": int(batch_size or 0),
+                "tile_reads": int(self.configuration.get("macs2_tile_reads") or 0),
+                "workers": int(workers) if workers else None,
+                "reads": sum([mapped for _, _, mapped in contig_stats])
+            }
+
+        if not workers:
+            raise ValueError(
+                "macs2_workers needs to be set for the {} strategy when run with COMPSs".format(
+                    strategy))
+
+        chosen = choose_strategy(
+            contig_stats, workers, strategy,
+            int(self.configuration.get("macs2_whole_genome_reads", WHOLE_GENOME_READS)))
+        chosen["batch_by"] = "reads"
+
+        return chosen
+
+    def _fragment_size(  # pylint: disable=too-many-arguments
+            self, command_params, bam_profile, contig_stats, limits, manifest):
+        """
+        Estimate the fragment size once for the whole genome so that it can be
+        passed to each of the tasks rather than each task building its own
+        model. The fragment size is taken from the manifest of a resumed run
+        or from the result cache if it is there, so that a run whose results
+        are already available does not read the whole of the bam file again.
+
+        Returns
+        -------
+        command_params : list
+            The MACS2 parameters with the fragment size
+        fragment_size : int
+            The fragment size, None if it was not estimated
+        """
+        fragment_model = self.configuration.get("macs2_fragment_model", "predictd")
+        if fragment_model not in ("predictd", "xcor", "task"):
+            raise ValueError("Unknown MACS2 fragment model: " + str(fragment_model))
+        if fragment_model == "task" or "--nomodel" in command_params or bam_profile["paired"]:
+            return command_params, None
+
+        def _estimate():
+            """
+            Get the fragment size from the result cache or estimate it
+            """
+            result_cache = None
+            if self.configuration.get("macs2_cache_dir"):
+                result_cache = ResultCache(
+                    self.configuration["macs2_cache_dir"],
+                    float(self.configuration.get("macs2_cache_size", 0)) * 1024 ** 3)
+                cache_key = result_cache.value_key(
+                    "fragment_size." + fragment_model, file_digest(self.input_files['bam']),
+                    command_params, [contig for contig, _, _ in contig_stats])
+                fragment_size = result_cache.fetch_value(cache_key)
+                if fragment_size:
+                    logger.info("MACS2: Using the cached fragment size")
+                    return fragment_size
+
+            with self.profiler.stage("fragment_size"):
+                fragment_size = compss_wait_on(self.tasks.macs2_fragment_size(
+                    self.input_files['bam'], self.input_files['bam'] + '.bai', command_params,
+                    contig_stats, fragment_model, limits))
+            if result_cache is not None and fragment_size:
+                result_cache.store_value(cache_key, fragment_size)
+
+            return fragment_size
+
+        fragment_size = manifest.use_value("fragment_size", _estimate)
+        if not fragment_size:
+            logger.warn("MACS2: Unable to estimate the fragment size, using a model per task")
+            return command_params, None
+
+        logger.info("MACS2: Fragment size: " + str(fragment_size))
+        return command_params + ["--nomodel", "--extsize", str(fragment_size)], fragment_size
+
+    def _sweep(self, command_params):
+        """
+        Describe the cutoff sweep, whose peaks are called from the pileup that
+        MACS2 generates for the main run.
+
+        Returns
+        -------
+        sweep : dict
+            See `build_sweep`, None if there is no sweep
+        sweep_outputs : list
+            List of tuples of the form (output_name, output_type, tag, cutoff)
+            for each of the cutoffs
+        """
+        if not self.configuration.get("macs2_sweep_cutoffs"):
+            return None, []
+
+        sweep = build_sweep(
+            self.configuration.get("macs2_sweep_param", "qvalue"),
+            self.configuration["macs2_sweep_cutoffs"], command_params)
+        sweep_type = "gapped_peak" if sweep["broad"] else "narrow_peak"
+        sweep_outputs = [
+            (sweep_type + "_" + tag, sweep_type, tag, cutoff)
+            for tag, cutoff in sweep["cutoffs"]
+        ]
+
+        return sweep, sweep_outputs
+
+    def _run_options(self, limits, sweep, strategy, batches):
+        """
+        Get the options for how MACS2 is run by each of the tasks, see
+        `macs2_runner`.
+        """
+        run_options = {
+            "input_mode": self.configuration.get("macs2_input_mode", "split"),
+            "backend": self.configuration.get("macs2_backend", "subprocess"),
+            "scratch_dir": self.configuration.get("macs2_scratch_dir"),
+            "limits": limits
+        }
+        if sweep is not None:
+            run_options["sweep"] = sweep
+        if strategy["strategy"] == "whole_genome" and len(batches) == 1:
+            # A single task reads the whole of the bam files so they are not
+            # split
+            if run_options["input_mode"] != "whole":
+                logger.info(
+                    "MACS2: Input mode {} replaced by whole for a single whole genome task".format(
+                        run_options["input_mode"]))
+            run_options["input_mode"] = "whole"
+
+        cache_dir = self.configuration.get("macs2_cache_dir")
+        if cache_dir:
+            run_options["cache"] = {
+                "dir": cache_dir,
+                "max_size": float(self.configuration.get("macs2_cache_size", 0)) * 1024 ** 3,
+                "bam_digest": file_digest(self.input_files['bam']),
+                "bam_bgd_digest": None
+            }
+            if self.control is not None:
+                run_options["cache"]["bam_bgd_digest"] = self.control["digest"] or file_digest(
+                    self.control["bam"])
+
+        return run_options
+
+    def _plan_tasks(self, batches, output_files, sweep_outputs, bam_profile):
+        """
+        Get the files written by the task for each batch and how they are
+        merged into the output files.
+
+        Returns
+        -------
+        batch_tasks : list
+            A dict for each batch with the "batch", its "label", the
+            "peak_files" passed to the task, all of the "outputs" of the task,
+            the number of "reads" and the "slices" of the bam files that the
+            task reads in the distributed input mode
+        merge_jobs : list
+            List of tuples of the form (output_file, input_files) where the
+            input files are in the order of the batches, which is the order of
+            the BAM header, so the merged files are in the same order
+        """
+        batch_tasks = []
+        for batch in batches:
+            label = batch_label(batch).replace("|", "_")
+            reads = profile_mapped_reads(bam_profile, batch)
+            if self.control is not None:
+                reads += profile_mapped_reads(self.control["profile"], batch)
+            batch_tasks.append({
+                "batch": batch,
+                "label": label,
+                "peak_files": batch_peak_files(output_files, label),
+                "reads": reads,
+                "slices": None
+            })
+
+        merge_jobs = []
+        for position, output_type in enumerate(PEAK_OUTPUTS):
+            merge_jobs.append((
+                output_files[output_type],
+                [batch_task["peak_files"][position] for batch_task in batch_tasks]
+            ))
+        for _output_name, output_type, tag, _cutoff in sweep_outputs:
+            position = PEAK_OUTPUTS.index(output_type)
+            merge_jobs.append((
+                sweep_file_name(output_files[output_type], tag),
+                [batch_task["peak_files"][position] + "." + tag for batch_task in batch_tasks]
+            ))
+
+        for index, batch_task in enumerate(batch_tasks):
+            batch_task["outputs"] = [merge_inputs[index] for _, merge_inputs in merge_jobs]
+
+        return batch_tasks, merge_jobs
+
+    def _fetch_cached(self, batch_tasks, pending, command_params, run_options, manifest):
+        """
+        Copy the results of the pending batches that are in the result cache
+        to their peak files, so that only the batches without results in the
+        cache are run.
+
+        Returns
+        -------
+        list
+            The pending batches that need to be run
+        """
+        if not run_options.get("cache"):
+            return pending
+
+        uncached = []
+        for index in pending:
+            batch_task = batch_tasks[index]
+            output_files, _sweep_files, cache_params = task_output_files(
+                batch_task["peak_files"], command_params, run_options.get("sweep"))
+            with self.profiler.stage("cache", batch_task["label"]):
+                cached = fetch_cached_results(
+                    run_options["cache"], cache_params, batch_task["batch"], output_files)[2]
+            if cached:
+                logger.info("MACS2: Using cached peaks for " + batch_task["label"])
+                manifest.mark(batch_task["label"], "complete", batch_task["outputs"])
+            else:
+                uncached.append(index)
+
+        return uncached
+
+    def _split_inputs(self, batch_tasks, pending, input_mode):
+        """
+        Split the bam files for all of the pending batches in a single pass
+        for the "presplit" and "distributed" input modes. In the distributed
+        input mode the slices that each task reads are recorded in
+        `batch_tasks`.
+
+        Returns
+        -------
+        list
+            Locations of the split bam files that the master removes once the
+            tasks have completed
+        """
+        if input_mode not in ("presplit", "distributed") or not pending:
+            return []
+
+        split_batches = [batch_tasks[index]["batch"] for index in pending]
+        treatment_slices = [
+            self.input_files['bam'].replace(".bam", "." + batch_label(batch) + ".bam")
+            for batch in split_batches
+        ]
+        split_jobs = [(self.input_files['bam'], split_batches, treatment_slices)]
+
+        control_slices = [None] * len(split_batches)
+        if self.control is not None:
+            control_batches = []
+            for position, batch in enumerate(split_batches):
+                shared_slices = control_slice_files(self.control["slices"], batch)
+                if shared_slices is not None and len(shared_slices) == 1:
+                    control_slices[position] = shared_slices[0]
+                elif shared_slices is None or input_mode == "distributed":
+                    control_slices[position] = self.control["bam"].replace(
+                        ".bam", "." + batch_label(batch) + ".bam")
+                    control_batches.append(position)
+            if control_batches:
+                split_jobs.append((
+                    self.control["bam"],
+                    [split_batches[position] for position in control_batches],
+                    [control_slices[position] for position in control_batches]))
+
+        split_files = []
+        with self.profiler.stage("split"):
+            if input_mode == "distributed":
+                # The master splits the files so that each task is only sent
+                # the reads for its own batch
+                for bam_file, bam_batches, bam_files_out in split_jobs:
+                    bam_split_batches(bam_file, bam_batches, bam_files_out, SPLIT_TASK_CPUS)
+                    split_files.extend(bam_files_out)
+                for position, index in enumerate(pending):
+                    batch_tasks[index]["slices"] = (
+                        treatment_slices[position], control_slices[position])
+            else:
+                compss_wait_on([
+                    self.tasks.macs2_split_bam(*split_job) for split_job in split_jobs])
+
+        return split_files
+
+    def _runner_args(self, name, batch_task, command_params, bam_profile, run_options):
+        """
+        Get the arguments of `macs2_runner` for the task for a batch.
+        """
+        bam_file = str(self.input_files['bam'])
+        bai_file = bam_file + '.bai'
+        bam_bg, bai_bg, control_slices = None, None, None
+        if self.control is not None:
+            bam_bg, bai_bg = str(self.control["bam"]), str(self.control["bai"])
+            control_slices = self.control["slices"]
+        if batch_task["slices"] is not None:
+            (bam_file, bam_bg), bai_file, bai_bg = batch_task["slices"], None, None
+            control_slices = None
+
+        return tuple(
+            [name + "." + batch_label(batch_task["batch"]), bam_file, bai_file, command_params]
+            + batch_task["peak_files"]
+            + [batch_task["batch"], bam_bg, bai_bg, bam_profile, run_options, control_slices])
+
+    def _high_memory(self, batch_task):
+        """
+        Check if the task for a batch needs the larger share of a node
+        requested by the high memory tasks, so that it is not run alongside
+        other large tasks. There are only the two sizes of task, so a task
+        that is estimated to need more than HIGH_MEMORY_TASK_SIZE is logged as
+        it may run out of memory.
+        """
+        memory = estimate_task_memory(batch_task["reads"])
+        if memory > HIGH_MEMORY_TASK_SIZE * 1024 ** 3:
+            logger.warn(
+                "MACS2: {} is estimated to need {:.1f} GB, more than the {} GB requested "
+                "by the largest tasks".format(
+                    batch_task["label"], float(memory) / 1024 ** 3, HIGH_MEMORY_TASK_SIZE))
+
+        return memory > float(
+            self.configuration.get("macs2_high_memory_threshold", 4)) * 1024 ** 3
+
+    def _submit_task(  # pylint: disable=too-many-arguments
+            self, name, batch_task, command_params, bam_profile, run_options, high_memory):
+        """
+        Submit the COMPSs peak calling task for a batch. The task is chosen
+        from the input files that it reads and whether it needs a larger share
+        of a node.
+        """
+        task_name = name + "." + batch_label(batch_task["batch"])
+        task_args = batch_task["peak_files"] + [batch_task["batch"], bam_profile, run_options]
+
+        if batch_task["slices"] is not None:
+            bam_slice, bam_slice_bgd = batch_task["slices"]
+            if bam_slice_bgd is None:
+                return self.tasks.macs2_peak_calling_slice_nobgd(
+                    task_name, bam_slice, command_params, *task_args)
+            return self.tasks.macs2_peak_calling_slice(
+                task_name, bam_slice, bam_slice_bgd, command_params, *task_args)
+
+        bam_file = str(self.input_files['bam'])
+        if self.control is None:
+            peak_calling = self.tasks.macs2_peak_calling_nobgd
+            if high_memory:
+                peak_calling = self.tasks.macs2_peak_calling_nobgd_high_memory
+            return peak_calling(task_name, bam_file, bam_file + '.bai', command_params, *task_args)
+
+        peak_calling = self.tasks.macs2_peak_calling
+        if high_memory:
+            peak_calling = self.tasks.macs2_peak_calling_high_memory
+        return peak_calling(
+            task_name, bam_file, bam_file + '.bai',
+            str(self.control["bam"]), str(self.control["bai"]), command_params,
+            *(task_args + [self.control["slices"]]))
+
+    def _run_local(self, task_args, batch_tasks, pending, merge_jobs, manifest):
+        """
+        Run the tasks concurrently in local worker processes and merge the
+        results as they complete.
+
+        Parameters
+        ----------
+        task_args : list
+            The arguments of `macs2_runner` for each of the pending tasks
+
+        Returns
+        -------
+        str
+            Description of the failure, None if all of the tasks completed
+        """
+        jobs = [
+            (args, estimate_task_memory(batch_tasks[index]["reads"]))
+            for index, args in zip(pending, task_args)
+        ]
+
+        merger = OrderedPeakMerger(merge_jobs)
+        for index in range(len(batch_tasks)):
+            if index not in pending:
+                merger.add(index)
+
+        def _task_complete(job_index, result):
+            """
+            Record a completed task and merge its results
+            """
+            self.profiler.add(result)
+            batch_task = batch_tasks[pending[job_index]]
+            manifest.mark(batch_task["label"], "complete", batch_task["outputs"])
+            with self.profiler.stage("merge", batch_task["label"]):
+                merger.add(pending[job_index])
+
+        def _task_failed(job_index, message):
+            """
+            Record a failed task
+            """
+            manifest.mark(batch_tasks[pending[job_index]]["label"], "failed", message=message)
+
+        executor = LocalExecutor(
+            self.configuration.get("macs2_local_workers"),
+            float(self.configuration.get("macs2_local_memory", 0)) * 1024 ** 3)
+        with self.profiler.stage("peak_calling", tasks=len(jobs)):
+            _, error = executor.run(macs2_runner, jobs, _task_complete, _task_failed)
+            merger.close()
+
+        if error is None:
+            # The results of each batch are only kept to resume a failed run
+            self._remove_files(
+                [input_file for _, input_files in merge_jobs for input_file in input_files])
+
+        return error
+
+    def _wait_for_tasks(self, results, batch_tasks, pending, manifest):
+        """
+        Wait for the COMPSs peak calling tasks and record each of them in the
+        manifest.
+
+        Parameters
+        ----------
+        results : list
+            The future for the result of each of the pending tasks
+
+        Returns
+        -------
+        str
+            Description of the failure, None if all of the tasks completed
+        """
+        # The tasks are waited on as a set so that a slow task does not hold
+        # up the others. Whether a task completed is taken from its result,
+        # so the files for each batch stay on the workers to be merged there
+        failed = []
+        for index, result in zip(pending, compss_wait_on(results)):
+            batch_task = batch_tasks[index]
+            if result is False:
+                manifest.mark(batch_task["label"], "failed")
+                failed.append(batch_task["label"])
+                continue
+            self.profiler.add(result)
+            manifest.mark(batch_task["label"], "complete", batch_task["outputs"])
+
+        if failed:
+            return "the tasks for {} failed".format(", ".join(failed))
+
+        return None
+
+    def _merge_on_workers(self, merge_jobs):
+        """
+        Merge the results files on the workers as a tree of pairwise merges
+        so that only the merged files are sent to the master.
+
+        Parameters
+        ----------
+        merge_jobs : list
+            List of tuples of the form (output_file, input_files)
+        """
+        with self.profiler.stage("merge"):
+            root_jobs = []
+            merged_files = []
+            merge_results = []
+            for output_file, input_files in merge_jobs:
+                steps, root_file = merge_tree_steps(input_files, output_file)
+                for (peak_file_1, peak_file_2), peak_file_out in steps:
+                    merge_results.append(self.tasks.macs2_merge_peak_pair(
+                        peak_file_1, peak_file_2, peak_file_out))
+                    merged_files.extend([peak_file_1, peak_file_2])
+                root_jobs.append((output_file, [root_file] if root_file else []))
+
+            merge_peak_files(root_jobs, compss_open, compss_delete_file)
+            for merged_file in merged_files:
+                compss_delete_file(merged_file)
+            for merge_result in compss_wait_on(merge_results):
+                self.profiler.add(merge_result)
+
+    def _collect_outputs(self, input_metadata, outputs):
+        """
+        Generate the metadata for the output files that hold peaks. Empty
+        output files are removed.
+
+        Parameters
+        ----------
+        input_metadata : dict
+            Matching metadata for the input files
+        outputs : list
+            List of tuples of the form (output_name, output_file, output_type,
+            meta_data) where meta_data holds the values specific to the file
+
+        Returns
+        -------
+        output_files : dict
+            Locations of the output files
+        output_metadata : dict
+            Matching metadata for the output files
+        """
+        sources = [input_metadata["bam"].file_path]
+        if self.control is not None:
+            sources.append(input_metadata["bam_bg"].file_path)
+
+        output_files_created = {}
+        output_metadata = {}
+        for output_name, output_file, output_type, meta_data in outputs:
+            if not os.path.isfile(output_file):
+                continue
+            if os.path.getsize(output_file) == 0:
+                os.remove(output_file)
+                continue
+
+            meta_data.update({
+                "assembly": input_metadata["bam"].meta_data["assembly"],
+                "tool": "macs2",
+                "bed_type": OUTPUT_BED_TYPES[output_type]
+            })
+            output_files_created[output_name] = output_file
+            output_metadata[output_name] = Metadata(
+                data_type="data_chip_seq",
+                file_type="BED",
+                file_path=output_file,
+                sources=sources,
+                taxon_id=input_metadata["bam"].taxon_id,
+                meta_data=meta_data
+            )
+            if self.configuration.get("macs2_compress_outputs", False):
+                with self.profiler.stage("compress", output_file=output_name):
+                    self._compress_output(output_metadata[output_name])
+                output_files_created[output_name] = output_metadata[output_name].file_path
+            # The peak set is built from the final file so that it is named
+            # after it and holds the peaks in the same order
+            if self.configuration.get("macs2_peak_sets", False):
+                with self.profiler.stage("peak_set", output_file=output_name):
+                    self._add_peak_set(
+                        output_metadata[output_name], output_files_created[output_name],
+                        output_type)
+
+        return (output_files_created, output_metadata)
+
+    def _record_profile(self, output_metadata, strategy):
+        """
+        Record the strategy and the profile of the run in the metadata of the
+        output files and save the profile and trace files. The summary covers
+        the whole run so it is the same for every file.
+        """
+        profile = self.profiler.summary()
+        profile_file = self.configuration.get("macs2_profile")
+        if profile_file:
+            self.profiler.save(profile_file)
+        trace_file = self.configuration.get("macs2_trace")
+        if trace_file:
+            self.profiler.save_trace(trace_file)
+        for metadata in output_metadata.values():
+            metadata.meta_data["strategy"] = strategy
+            metadata.meta_data["profile"] = profile
+            if profile_file:
+                metadata.meta_data["profile_file"] = profile_file
+            if trace_file:
+                metadata.meta_data["trace_file"] = trace_file
+
+    def run(self, input_metadata, output_files, command_params):
+        """
+        Run the peak calling for the treatment bam file.
+
+        Parameters
+        ----------
+        input_metadata : dict
+            Matching metadata for the input files
+        output_files : dict
+            Locations of the output files indexed by output type. Files that
+            are None are named after the treatment bam file
+        command_params : list
+            List of MACS2 parameters as generated by `Macs2.get_macs2_params`
+
+        Returns
+        -------
+        output_files : dict
+            Locations of the output files
+        output_metadata : dict
+            Matching metadata for the output files
+        """
+        name = os.path.split(self.input_files['bam'])[1].replace('.bam', '')
+        for output_type in PEAK_OUTPUTS:
+            if output_files[output_type] is None:
+                output_files[output_type] = os.path.join(
+                    self.configuration['execution'], name + "_" + output_type + ".bed")
+
+        with self.profiler.stage("index"):
+            bam_utils_handle = bamUtilsTask()
+            bam_utils_handle.bam_index(self.input_files['bam'], self.input_files['bam'] + '.bai')
+
+        with self.profiler.stage("chromosomes"):
+            bam_profile = compss_wait_on(self.tasks.macs2_bam_profile(
+                self.input_files['bam'], self.input_files['bam'] + '.bai'))
+
+        # Chromosomes without any aligned reads are not peak called
+        contig_stats = [
+            (contig, length, mapped)
+            for contig, length, mapped, _unmapped in bam_profile["contigs"] if mapped > 0
+        ]
+
+        limits = {
+            "time": float(self.configuration.get("macs2_time_limit", 0)),
+            "memory": float(self.configuration.get("macs2_memory_limit", 0)) * 1024 ** 3
+        }
+
+        sweep, sweep_outputs = self._sweep(command_params)
+        run_params = command_params
+        if sweep is not None:
+            run_params = command_params + [
+                "--sweep", ",".join([tag for tag, _cutoff in sweep["cutoffs"]])]
+
+        # Record the state of each task so that a failed run can be resumed. A
+        # resumed run uses the batches and the fragment size from the run that
+        # it resumes, so the key holds how the fragment size is estimated
+        # rather than the fragment size
+        resume = self.configuration.get("macs2_resume", False)
+        manifest = RunManifest(
+            self.configuration.get(
+                "macs2_manifest", str(output_files['narrow_peak']) + ".manifest.json"),
+            RunManifest.run_key(
+                [self.input_files[bam] for bam in ['bam', 'bam_bg'] if bam in self.input_files],
+                run_params + [self.configuration.get("macs2_fragment_model", "predictd")]),
+            resume)
+
+        command_params, fragment_size = self._fragment_size(
+            command_params, bam_profile, contig_stats, limits, manifest)
+
+        strategy = self._choose_strategy(contig_stats)
+        batches = batch_contigs(contig_stats, strategy["batch_size"], strategy["batch_by"])
+        batches = tile_batches(
+            batches, contig_stats, strategy["tile_reads"],
+            int(self.configuration.get("macs2_tile_overlap", 10000)))
+        batches = manifest.use_batches(batches)
+        strategy["tasks"] = len(batches)
+
+        logger.info("MACS2 COMMAND PARAMS: " + ", ".join(command_params))
+        logger.info("MACS2: {} of {} chromosomes with aligned reads in {} batches ({})".format(
+            len(contig_stats), len(bam_profile["contigs"]), len(batches),
+            strategy["strategy"]))
+
+        run_options = self._run_options(limits, sweep, strategy, batches)
+        batch_tasks, merge_jobs = self._plan_tasks(
+            batches, output_files, sweep_outputs, bam_profile)
+
+        # The largest tasks are started first
+        pending = [
+            index for index, batch_task in enumerate(batch_tasks)
+            if not (resume and manifest.is_complete(batch_task["label"]))
+        ]
+        pending = self._fetch_cached(batch_tasks, pending, command_params, run_options, manifest)
+        pending = order_longest_first(
+            pending, [batch_task["reads"] for batch_task in batch_tasks])
+        logger.info("MACS2: Running {} of {} batches".format(len(pending), len(batches)))
+
+        split_files = self._split_inputs(batch_tasks, pending, run_options["input_mode"])
+
+        if hasattr(sys, '_run_from_cmdl') is True:
+            task_args = [
+                self._runner_args(
+                    name, batch_tasks[index], command_params, bam_profile, run_options)
+                for index in pending
+            ]
+            error = self._run_local(task_args, batch_tasks, pending, merge_jobs, manifest)
+        else:
+            with self.profiler.stage("peak_calling", tasks=len(pending)):
+                results = [
+                    self._submit_task(
+                        name, batch_tasks[index], command_params, bam_profile, run_options,
+                        self._high_memory(batch_tasks[index]))
+                    for index in pending
+                ]
+                error = self._wait_for_tasks(results, batch_tasks, pending, manifest)
+            if error is None:
+                self._merge_on_workers(merge_jobs)
+        self._remove_files(split_files)
+
+        if error is not None:
+            logger.fatal("MACS2: Something went wrong with the peak calling: " + error)
+            logger.fatal("MACS2: Rerun with --resume to only run the incomplete chromosomes")
+            self._remove_files([output_file for output_file, _ in merge_jobs])
+            return ({}, {})
+
+        # All of the tasks have completed so the run does not need resuming
+        os.remove(manifest.manifest_file)
+
+        outputs = [
+            (output_type, output_files[output_type], output_type, {
+                "parameters": command_params,
+                "fragment_size": fragment_size
+            })
+            for output_type in PEAK_OUTPUTS
+        ]
+        for output_name, output_type, tag, cutoff in sweep_outputs:
+            sweep_file = sweep_file_name(output_files[output_type], tag)
+            outputs.append((output_name, sweep_file, output_type, {
+                "parameters": set_macs2_param(command_params, "--" + sweep["param"], str(cutoff)),
+                "sweep_param": sweep["param"],
+                "cutoff": cutoff,
+                "fragment_size": fragment_size
+            }))
+        output_files_created, output_metadata = self._collect_outputs(input_metadata, outputs)
+        self._record_profile(output_metadata, strategy)
+
+        logger.info("MACS2: GENERATED FILES: " + " ".join(output_files))
+
+        return (output_files_created, output_metadata)
+
+# ------------------------------------------------------------------------------
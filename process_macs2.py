@@ -49,6 +49,9 @@ class process_macs2(Workflow):  # pylint: disable=invalid-name,too-few-public-me
         if configuration is None:
             configuration = {}
 
+        # The configuration is copied so that the settings for one run are
+        # not shared with every other instance
+        self.configuration = dict(self.configuration)
         self.configuration.update(configuration)
 
     def run(self, input_files, metadata, output_files):
@@ -58,7 +61,9 @@ class process_macs2(Workflow):  # pylint: disable=invalid-name,too-few-public-me
         Parameters
         ----------
         input_files : dict
-           Dictionary of file locations
+           Dictionary of file locations. If "bam" is a list of treatment bam
+           files then the peaks are called for each of them, preparing each of
+           the background bam files in "bam_bg" once
         metadata : list
            Required meta data
         output_files : dict
@@ -74,26 +79,60 @@ class process_macs2(Workflow):  # pylint: disable=invalid-name,too-few-public-me
 
         # Initialise the test tool
         macs2_handle = Macs2(self.configuration)
-        macs2_files, macs2_meta = macs2_handle.run(input_files, metadata, output_files)
+
+        if isinstance(input_files["bam"], list):
+            # Several treatments sharing background files
+            macs2_files, macs2_meta = macs2_handle.run_batch(input_files, metadata, output_files)
+        else:
+            macs2_files, macs2_meta = macs2_handle.run(input_files, metadata, output_files)
 
         return (macs2_files, macs2_meta)
 
+
+class process_macs2_resume(process_macs2):  # pylint: disable=invalid-name,too-few-public-methods
+    """
+    The pipeline run with `macs2_resume` set, whatever the value in the
+    configuration file, so that only the chromosomes that did not complete
+    in the previous run are peak called.
+    """
+
+    def __init__(self, configuration=None):
+        """
+        Initialise the tool with its configuration.
+
+        Parameters
+        ----------
+        configuration : dict
+           a dictionary containing parameters that define how the operation
+           should be carried out, which are specific to each Tool.
+        """
+        configuration = dict(configuration or {})
+        configuration["macs2_resume"] = True
+
+        super(process_macs2_resume, self).__init__(configuration)
+
 # ------------------------------------------------------------------------------
 
 
-def main_json(config, in_metadata, out_metadata):
+def main_json(config, in_metadata, out_metadata, resume=False):
     """
     Main function
     -------------
 
     This function launches the app using configuration written in
     two json files: config.json and input_metadata.json.
+
+    If resume is True then only the chromosomes that did not complete in a
+    previous run with the same inputs and parameters are peak called. This
+    takes precedence over `macs2_resume` in the configuration file.
     """
+    workflow = process_macs2_resume if resume else process_macs2
+
     # 1. Instantiate and launch the App
     logger.info("1. Instantiate and launch the App")
     from apps.jsonapp import JSONApp
     app = JSONApp()
-    result = app.launch(process_macs2,
+    result = app.launch(workflow,
                         config,
                         in_metadata,
                         out_metadata)
@@ -113,6 +152,9 @@ if __name__ == "__main__":
     PARSER.add_argument("--in_metadata", help="Location of input metadata file")
     PARSER.add_argument("--out_metadata", help="Location of output metadata file")
     PARSER.add_argument("--local", action="store_const", const=True, default=False)
+    PARSER.add_argument(
+        "--resume", action="store_const", const=True, default=False,
+        help="Only run the chromosomes that did not complete in the previous run")
 
     # Get the matching parameters from the command line
     ARGS = PARSER.parse_args()
@@ -121,10 +163,11 @@ if __name__ == "__main__":
     IN_METADATA = ARGS.in_metadata
     OUT_METADATA = ARGS.out_metadata
     LOCAL = ARGS.local
+    RESUME = ARGS.resume
 
     if LOCAL:
         import sys
         sys._run_from_cmdl = True  # pylint: disable=protected-access
 
-    RESULTS = main_json(CONFIG, IN_METADATA, OUT_METADATA)
+    RESULTS = main_json(CONFIG, IN_METADATA, OUT_METADATA, RESUME)
     print(RESULTS)
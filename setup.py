@@ -22,7 +22,7 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=[
-        'pytest', 'pylint', 'pysam', 'macs2', 'ConfigParser'
+        'pytest', 'pylint', 'pysam', 'numpy', 'macs2', 'ConfigParser'
     ],
     setup_requires=[
         'pytest-runner',